@@ -0,0 +1,78 @@
+"""
+Compare query plans for active-embedding retrieval of one conversation.
+
+"before" is the original correlated EXISTS against ``items``; "after" reads the
+denormalized ``embeddings.item_active`` flag through the partial index
+``ix_embeddings_conversation_active``.
+
+Usage:
+    DATABASE_URL=postgresql://... python -m benchmarks.bench_active_embeddings [conversation_id] [--runs N]
+"""
+import argparse
+import os
+import statistics
+import time
+from dotenv import load_dotenv, find_dotenv
+from sqlalchemy import create_engine, func, select, text
+from sqlalchemy.dialects import postgresql
+from models.embedding import Embedding
+from models.item import Item
+
+
+def compile_query(statement) -> str:
+    return str(statement.compile(
+        dialect=postgresql.dialect(),
+        compile_kwargs={"literal_binds": True}
+    ))
+
+
+def build_queries(conversation_id: str) -> dict:
+    return {
+        "before": select(Embedding).where(
+            Embedding.conversation_id == conversation_id,
+            Embedding.item.has(Item.active)
+        ),
+        "after": select(Embedding).where(
+            Embedding.conversation_id == conversation_id,
+            Embedding.item_active
+        ),
+    }
+
+
+def main():
+    load_dotenv(find_dotenv())
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("conversation_id", nargs="?", help="Defaults to the conversation with most chunks")
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    engine = create_engine(os.environ["DATABASE_URL"])
+    with engine.connect() as conn:
+        conversation_id = args.conversation_id or conn.execute(
+            select(Embedding.conversation_id)
+            .group_by(Embedding.conversation_id)
+            .order_by(func.count().desc())
+            .limit(1)
+        ).scalar()
+        if conversation_id is None:
+            raise SystemExit("No embeddings found")
+        conn.execute(text("ANALYZE embeddings; ANALYZE items;"))
+
+        for name, statement in build_queries(str(conversation_id)).items():
+            sql = compile_query(statement)
+            plan = conn.execute(text(f"EXPLAIN (ANALYZE, BUFFERS) {sql}")).scalars().all()
+            timings = []
+            for _ in range(args.runs):
+                start = time.perf_counter()
+                conn.execute(text(sql)).fetchall()
+                timings.append((time.perf_counter() - start) * 1000)
+            print(f"=== {name}")
+            print("\n".join(plan))
+            print(
+                f"median {statistics.median(timings):.2f} ms, "
+                f"p95 {sorted(timings)[int(len(timings) * 0.95) - 1]:.2f} ms over {args.runs} runs\n"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Measure PDF parse-and-chunk throughput in-process versus across the parse pool.
+
+A synthetic text PDF is generated so the benchmark needs no fixtures, and the
+pooled run is checked to produce the same chunks in the same page order.
+
+Usage:
+    python -m benchmarks.bench_parse_pool [--pages N] [--workers N] [--pdf PATH]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+WORDS = "the quick brown fox jumps over the lazy dog while retrieval augmented answers cite their sources".split()
+
+
+def write_pdf(path: str, pages: int, lines_per_page: int = 45) -> None:
+    """Write a minimal uncompressed PDF with ``pages`` pages of text."""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for page in range(pages):
+        lines = []
+        for line in range(lines_per_page):
+            words = [WORDS[(page * 7 + line * 3 + i) % len(WORDS)] for i in range(12)]
+            lines.append(f"({' '.join(words).capitalize()}.) Tj T*")
+        stream = f"BT /F1 10 Tf 12 TL 40 800 Td {' '.join(lines)} ET".encode()
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % kid for kid in kids), pages
+    )
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pages", type=int, default=400)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--pdf", help="Use an existing PDF instead of a synthetic one")
+    args = parser.parse_args()
+
+    os.environ["PARSE_WORKERS"] = str(args.workers)
+    from utils import parsing
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.pdf
+        if path is None:
+            path = os.path.join(tmp, "bench.pdf")
+            write_pdf(path, args.pages)
+        pages = parsing.count_pdf_pages(path)
+
+        start = time.perf_counter()
+        serial = parsing.parse_page_range(path, 0, pages, 1000, 200)
+        serial_time = time.perf_counter() - start
+
+        # Start the workers outside the timed section
+        list(parsing.get_parse_pool().map(parsing.count_pdf_pages, [path] * args.workers))
+        start = time.perf_counter()
+        pooled = list(parsing.iter_pdf_chunks(path))
+        pooled_time = time.perf_counter() - start
+        parsing.shutdown_parse_pool()
+
+    assert pooled == serial, "pooled chunks differ from in-process chunks"
+    chunks = sum(len(page_chunks) for _, page_chunks in serial)
+    print(f"{pages} pages, {chunks} chunks")
+    print(f"in-process:          {serial_time:.2f} s ({pages / serial_time:.0f} pages/s)")
+    print(f"pool ({args.workers} workers): {pooled_time:.2f} s ({pages / pooled_time:.0f} pages/s), "
+          f"speedup {serial_time / pooled_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
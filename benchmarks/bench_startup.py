@@ -0,0 +1,55 @@
+"""
+Measure cold start: importing the app module and running its lifespan startup.
+
+Each sample runs in a fresh interpreter so module caches do not hide import
+cost. Pass --import-only to time ``import main`` alone (no database needed).
+
+Usage:
+    python -m benchmarks.bench_startup [--runs N] [--import-only]
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+
+SNIPPET = """
+import asyncio, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+async def run():
+    async with main.app.router.lifespan_context(main.app):
+        pass
+if {startup}:
+    asyncio.run(run())
+print(imported - start, time.perf_counter() - start)
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--import-only", action="store_true")
+    args = parser.parse_args()
+
+    code = SNIPPET.format(startup=not args.import_only)
+    imports, totals = [], []
+    for _ in range(args.runs):
+        output = subprocess.run(
+            [sys.executable, "-c", code],
+            check=True, capture_output=True, text=True
+        ).stdout.split()
+        imports.append(float(output[-2]) * 1000)
+        totals.append(float(output[-1]) * 1000)
+
+    print(f"import main:      median {statistics.median(imports):.1f} ms, max {max(imports):.1f} ms")
+    print(f"import + startup: median {statistics.median(totals):.1f} ms, max {max(totals):.1f} ms")
+    heavy = subprocess.run(
+        [sys.executable, "-c", "import sys, main; print(sorted({m.split('.')[0] for m in sys.modules} & {'llama_index', 'openai', 'boto3', 'tiktoken'}))"],
+        check=True, capture_output=True, text=True
+    ).stdout.strip()
+    print(f"heavy modules loaded by import: {heavy}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Compare the CPU and memory of loading a conversation's vectors for retrieval.
+
+Both paths start from what the driver returns, synthesized without a database:
+
+- text: pgvector's text format parsed per row (what the ORM ``Vector`` type
+  does), stacked into a matrix and copied into Python float lists for the
+  in-memory index
+- binary: ``vector_send`` values decoded into one float32 matrix by
+  ``vectors_from_binary``
+
+Usage:
+    python -m benchmarks.bench_vector_loading [--chunks N] [--dimensions D] [--runs R]
+"""
+import argparse
+import struct
+import time
+import tracemalloc
+import numpy as np
+from services.embedding import vectors_from_binary
+
+
+def load_text(values):
+    vectors = [np.array(value[1:-1].split(','), dtype=np.float32) for value in values]
+    matrix = np.array(vectors, dtype=np.float32)
+    return [vector.tolist() for vector in vectors], matrix
+
+
+def load_binary(values):
+    return vectors_from_binary(values)
+
+
+def measure(fn, values, runs: int):
+    start = time.perf_counter()
+    for _ in range(runs):
+        fn(values)
+    elapsed = (time.perf_counter() - start) / runs * 1000
+    tracemalloc.start()
+    fn(values)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 1024 ** 2
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    vectors = np.random.default_rng(0).standard_normal((args.chunks, args.dimensions)).astype(np.float32)
+    text_values = ["[" + ",".join(f"{x:.8g}" for x in vector) + "]" for vector in vectors]
+    binary_values = [struct.pack(">HH", args.dimensions, 0) + vector.astype(">f4").tobytes() for vector in vectors]
+    assert np.array_equal(load_binary(binary_values), vectors)
+
+    print(f"{args.chunks} chunks x {args.dimensions} dimensions")
+    print(f"{'path':<10}{'ms':>10}{'peak MiB':>12}")
+    for name, fn, values in [("text", load_text, text_values), ("binary", load_binary, binary_values)]:
+        elapsed, peak = measure(fn, values, args.runs)
+        print(f"{name:<10}{elapsed:>10.1f}{peak:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
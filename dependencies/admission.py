@@ -0,0 +1,40 @@
+import time
+from typing import Optional
+from fastapi import Depends, HTTPException
+from dependencies.security import validate_token
+from utils.admission import AdmissionController, AdmissionRejected
+from utils.resilience import remaining
+
+_chat_admission: Optional[AdmissionController] = None
+
+
+def get_chat_admission() -> AdmissionController:
+    """Process-wide admission controller for chat work, configured from CHAT_* env vars."""
+    global _chat_admission
+    if _chat_admission is None:
+        _chat_admission = AdmissionController.from_env("CHAT")
+    return _chat_admission
+
+
+async def acquire_chat_slot(email: str) -> None:
+    """Wait for a chat slot for this user, or fail fast with 429 and Retry-After."""
+    try:
+        # No point queueing past the request deadline
+        await get_chat_admission().acquire(email, timeout=remaining())
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=429,
+            detail=e.reason,
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+
+async def admit_chat(user: dict = Depends(validate_token)):
+    """Hold a chat slot for the duration of the request."""
+    email = user['UserAttributes'][0]['Value']
+    await acquire_chat_slot(email)
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        await get_chat_admission().release(email, time.monotonic() - start)
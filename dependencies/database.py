@@ -1,59 +1,158 @@
+from typing import Iterator, List, Optional
+from fastapi import Depends
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from models.base import Base
-from sqlalchemy.sql import text
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.orm import Session, sessionmaker
 import logging
+import os
 from services.user import UserService
 from services.item import ItemService
 from services.conversation import ConversationService
 from services.message import MessageService
 from services.chat import ChatService
 from services.embedding import EmbeddingService
+from dependencies.security import validate_token
+from utils.querylog import query_log
+from utils.routing import ReplicaSet, RoutingSession, WriteTracker
 
 class DatabaseService:
-    def __init__(self, db_url: str):
+    def __init__(self, db_url: Optional[str] = None, replica_urls: Optional[List[str]] = None):
         """
-        Initialize database connection and create tables.
-        
+        Hold the process-wide engines and session factory.
+
+        Nothing is opened here; the engines are created on the first call to
+        ``connect`` (normally from the application lifespan). Schema setup
+        lives in ``utils.bootstrap`` and is run as a separate command.
+
         Args:
-            db_url (str): Database connection URL
+            db_url (Optional[str]): Database connection URL, defaults to ``DATABASE_URL``
+            replica_urls (Optional[List[str]]): Read replica URLs, defaults to the
+                comma-separated ``DATABASE_REPLICA_URLS``
         """
         self.logger = logging.getLogger(self.__class__.__name__)
-        self.engine = create_engine(db_url)
-        
-        # Create all tables before creating the session
-        try:
-            # Enable pgvector extension
-            with self.engine.connect() as conn:
-                conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector;"))
-                conn.commit()
-            
-            # Create all tables defined in the models
-            Base.metadata.create_all(bind=self.engine)
-            
-        except Exception as e:
-            self.logger.error(f"Failed to create database tables: {str(e)}")
-            raise
-        
-        # Create session factory
-        self.SessionLocal = sessionmaker(bind=self.engine)
-        self.db = self.SessionLocal()
-
-
-    def get_user_service(self):
-        return UserService(self.db)
-
-    def get_item_service(self):
-        return ItemService(self.db)
-
-    def get_conversation_service(self):
-        return ConversationService(self.db)
-
-    def get_message_service(self):
-        return MessageService(self.db)
-
-    def get_chat_service(self):
-        return ChatService(self.db)
-
-    def get_embedding_service(self):
-        return EmbeddingService(self.db)
\ No newline at end of file
+        self.db_url = db_url
+        self.replica_urls = replica_urls
+        self.staleness = float(os.getenv('REPLICA_STALENESS_SECONDS', '5'))
+        self.engine: Optional[Engine] = None
+        self.replicas: Optional[ReplicaSet] = None
+        self.write_tracker = WriteTracker(self.staleness)
+        self.SessionLocal: Optional[sessionmaker] = None
+
+    def create_engine(self, url: str) -> Engine:
+        """
+        Engine with the shared pool settings.
+
+        URLs without a driver (``postgresql://``) use psycopg 3, on which
+        statements run ``DB_PREPARE_THRESHOLD`` times on a connection are
+        prepared server-side; set it empty to disable, e.g. behind PgBouncer
+        in transaction mode. An explicit ``postgresql+psycopg2://`` keeps
+        psycopg2, which never prepares. Statements are timed by the slow
+        query log.
+        """
+        connect_args = {}
+        url = make_url(url)
+        if url.drivername == 'postgresql':
+            # SQLAlchemy would pick psycopg2 for these
+            url = url.set(drivername='postgresql+psycopg')
+        if url.get_driver_name() == 'psycopg':
+            threshold = os.getenv('DB_PREPARE_THRESHOLD', '5')
+            connect_args['prepare_threshold'] = int(threshold) if threshold else None
+        engine = create_engine(url, pool_pre_ping=True, connect_args=connect_args)
+        query_log.install(engine)
+        return engine
+
+    def connect(self) -> Engine:
+        """Create the shared engines and session factory if not done yet."""
+        if self.engine is None:
+            self.engine = self.create_engine(self.db_url or os.getenv('DATABASE_URL'))
+            replica_urls = self.replica_urls
+            if replica_urls is None:
+                replica_urls = [url.strip() for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+            if replica_urls:
+                self.replicas = ReplicaSet(
+                    [self.create_engine(url) for url in replica_urls],
+                    max_staleness=self.staleness
+                )
+            self.SessionLocal = sessionmaker(
+                bind=self.engine,
+                class_=RoutingSession,
+                info={'write_tracker': self.write_tracker}
+            )
+            self.logger.info(f"Database engine created with {len(replica_urls)} read replicas")
+        return self.engine
+
+    def session(self, user_key: Optional[str] = None) -> Session:
+        """
+        Open a new session on the primary.
+
+        Args:
+            user_key (Optional[str]): Caller whose commits should keep their
+                reads on the primary for a while (read-your-writes)
+        """
+        self.connect()
+        session = self.SessionLocal()
+        session.info['user_key'] = user_key
+        return session
+
+    def replica_for(self, user_key: str) -> Optional[Engine]:
+        """A replica the caller may read from, or None when reads must stay on the primary."""
+        self.connect()
+        if self.replicas is None or self.write_tracker.wrote_recently(user_key):
+            return None
+        return self.replicas.pick()
+
+    def dispose(self) -> None:
+        """Close all pooled connections."""
+        query_log.uninstall()
+        if self.engine is not None:
+            self.engine.dispose()
+            self.engine = None
+            self.SessionLocal = None
+        if self.replicas is not None:
+            self.replicas.dispose()
+            self.replicas = None
+
+
+db_service = DatabaseService()
+
+
+def get_db() -> Iterator[Session]:
+    """Request-scoped session shared by every service of the request."""
+    session = db_service.session()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+def track_writes(user: dict = Depends(validate_token), db: Session = Depends(get_db)) -> None:
+    """Attribute the request session's commits to the caller, for read-your-writes."""
+    db.info['user_key'] = user['UserAttributes'][0]['Value']
+
+
+def use_replica(user: dict = Depends(validate_token), db: Session = Depends(get_db)) -> None:
+    """Let the request session read from a replica when the caller's data is fresh enough there."""
+    email = user['UserAttributes'][0]['Value']
+    db.info['user_key'] = email
+    db.info['replica'] = db_service.replica_for(email)
+    if db.info['replica'] is not None:
+        db.info['replica_staleness'] = db_service.replicas.max_lag
+
+
+def get_user_service(db: Session = Depends(get_db)) -> UserService:
+    return UserService(db)
+
+def get_item_service(db: Session = Depends(get_db)) -> ItemService:
+    return ItemService(db)
+
+def get_conversation_service(db: Session = Depends(get_db)) -> ConversationService:
+    return ConversationService(db)
+
+def get_message_service(db: Session = Depends(get_db)) -> MessageService:
+    return MessageService(db)
+
+def get_chat_service(db: Session = Depends(get_db)) -> ChatService:
+    return ChatService(db)
+
+def get_embedding_service(db: Session = Depends(get_db)) -> EmbeddingService:
+    return EmbeddingService(db, openai_api_key=os.getenv("OPENAI_API_KEY"))
@@ -1,25 +1,68 @@
+from functools import lru_cache
+import math
+import os
 from fastapi import HTTPException, Depends
 from fastapi.security import HTTPBearer
-import boto3
+from utils.resilience import call_with_retries, get_breaker, timeout_for
 
 reusable_oauth2 = HTTPBearer(
     scheme_name='Authorization'
 )
 
+COGNITO_TIMEOUT = float(os.getenv('COGNITO_TIMEOUT', '5'))
+# Client timeouts are fixed per client, so one client is kept per step of remaining budget
+COGNITO_TIMEOUT_STEP = 0.25
+
+
+@lru_cache(maxsize=32)
+def get_cognito_client(timeout: float = COGNITO_TIMEOUT):
+    """Shared Cognito client with the given timeouts; retries are handled by call_with_retries"""
+    import boto3
+    from botocore.config import Config
+
+    return boto3.client(
+        'cognito-idp',
+        region_name='us-east-1',
+        config=Config(
+            connect_timeout=min(2.0, timeout),
+            read_timeout=timeout,
+            retries={'total_max_attempts': 1}
+        )
+    )
+
+
+def cognito_client_for_deadline():
+    """Cognito client whose timeouts fit the remaining request budget, rounded down to a step."""
+    timeout = timeout_for(COGNITO_TIMEOUT)
+    steps = max(1, math.floor(timeout / COGNITO_TIMEOUT_STEP))
+    return get_cognito_client(min(COGNITO_TIMEOUT, steps * COGNITO_TIMEOUT_STEP))
+
+
 def validate_token(http_authorization_credentials=Depends(reusable_oauth2)) -> str:
     """
     Decode JWT token to get username => return username
     """
-    client = boto3.client('cognito-idp', region_name='us-east-1')
+    from botocore.exceptions import BotoCoreError, ClientError
+
     try:
-        user = client.get_user(
-            AccessToken=http_authorization_credentials.credentials
+        user = call_with_retries(
+            # Each attempt gets the budget left at the time it starts
+            lambda: cognito_client_for_deadline().get_user(
+                AccessToken=http_authorization_credentials.credentials
+            ),
+            breaker=get_breaker('cognito'),
+            retry_on=(BotoCoreError,)
         )
-    except Exception as _:
+    except ClientError as _:
         raise HTTPException(
             status_code=401,
             detail="Could not validate credentials",
         )
+    except BotoCoreError as _:
+        raise HTTPException(
+            status_code=503,
+            detail="Authentication service unavailable",
+        )
     is_verified = user['UserAttributes'][1]['Value']
     if is_verified != 'true':
         raise HTTPException(
@@ -27,4 +70,3 @@ def validate_token(http_authorization_credentials=Depends(reusable_oauth2)) -> s
             detail="User is not verified",
         )
     return user
-
@@ -1,16 +1,42 @@
-from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv, find_dotenv
-from routes import conversation, chat
 
-# Load environment variables from.env file
+# Load environment variables from.env file, before the app modules read them
 load_dotenv(find_dotenv())
 
+from contextlib import asynccontextmanager
+import math
+import os
+from fastapi import FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+from dependencies.database import db_service
+from routes import conversation, chat, item, search, metrics, profile
+from services.archive import ArchiveUnavailable
+from services.embedding import EmbeddingModelUnavailable
+from utils.invalidation import invalidation_bus
+from utils.parsing import shutdown_parse_pool
+from utils.profiling import PROFILE_SECRET, ProfilingMiddleware
+from utils.resilience import CircuitOpenError, DeadlineExceeded, DeadlineMiddleware
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One engine per worker; the schema is managed by `python -m utils.bootstrap`
+    engine = db_service.connect()
+    # Other workers' writes evict this worker's cached entries
+    invalidation_bus.start(engine)
+    yield
+    invalidation_bus.stop()
+    shutdown_parse_pool()
+    db_service.dispose()
+
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Chat API",
     description="API for managing chat conversations and messages",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Configure CORS
@@ -22,9 +48,51 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Give every request a time budget that outbound calls derive their timeouts from
+app.add_middleware(
+    DeadlineMiddleware,
+    default_seconds=float(os.getenv("REQUEST_DEADLINE_SECONDS", "60")),
+    max_seconds=float(os.getenv("REQUEST_DEADLINE_MAX_SECONDS", "120"))
+)
+
+# Refuse oversized uploads before FastAPI spools their body
+app.add_middleware(item.UploadSizeLimitMiddleware)
+
+# Profile single requests on demand; not installed at all unless a secret is configured
+if PROFILE_SECRET:
+    app.add_middleware(ProfilingMiddleware)
+
+
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded_handler(request: Request, exc: DeadlineExceeded):
+    return JSONResponse(status_code=504, content={"detail": str(exc)})
+
+
+@app.exception_handler(ArchiveUnavailable)
+async def archive_unavailable_handler(request: Request, exc: ArchiveUnavailable):
+    return JSONResponse(status_code=503, content={"detail": str(exc)})
+
+
+@app.exception_handler(EmbeddingModelUnavailable)
+async def embedding_model_unavailable_handler(request: Request, exc: EmbeddingModelUnavailable):
+    return JSONResponse(status_code=503, content={"detail": str(exc)})
+
+
+@app.exception_handler(CircuitOpenError)
+async def circuit_open_handler(request: Request, exc: CircuitOpenError):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(math.ceil(exc.retry_after))}
+    )
+
 # Include routers
 app.include_router(conversation.router)
 app.include_router(chat.router)
+app.include_router(item.router)
+app.include_router(search.router)
+app.include_router(metrics.router)
+app.include_router(profile.router)
 
 if __name__ == "__main__":
     import uvicorn
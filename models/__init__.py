@@ -4,6 +4,7 @@ from .conversation import Conversation
 from .item import Item
 from .embedding import Embedding
 from .message import Message
+from .message_archive import MessageArchive, MessageArchiveSegment
 
 # Define the order of table creation
 __all__ = [
@@ -12,5 +13,7 @@ __all__ = [
     'Conversation',   # Depends on User
     'Item',          # Depends on User and Conversation
     'Embedding',     # Depends on Item
-    'Message'        # Depends on User, Conversation, and Embedding
+    'Message',       # Depends on User, Conversation, and Embedding
+    'MessageArchive',
+    'MessageArchiveSegment'  # Depends on MessageArchive and Conversation
 ]
@@ -1,10 +1,12 @@
-from sqlalchemy import Column, String, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from .base import Base
 import uuid
 
+LAST_MESSAGE_PREVIEW_CHARS = 200
+
 class Conversation(Base):
     """
     Model representing a conversation in the system.
@@ -15,6 +17,15 @@ class Conversation(Base):
     user_id = Column(UUID(as_uuid=True), ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
     title = Column(String, nullable=False)
     context = Column(String, nullable=False)
+    # Rolling summary of every message created up to and including summarized_until
+    summary = Column(Text, nullable=True)
+    summarized_until = Column(DateTime(timezone=True), nullable=True)
+    # Listing stats, kept current by ConversationService in the writing transaction
+    active_item_count = Column(Integer, nullable=False, default=0, server_default='0')
+    chunk_count = Column(Integer, nullable=False, default=0, server_default='0')
+    message_count = Column(Integer, nullable=False, default=0, server_default='0')
+    last_message_at = Column(DateTime(timezone=True), nullable=True)
+    last_message_preview = Column(String(LAST_MESSAGE_PREVIEW_CHARS), nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, DateTime, ForeignKey, Text, UniqueConstraint
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text, UniqueConstraint, Index, text
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from pgvector.sqlalchemy import Vector
@@ -15,9 +15,16 @@ class Embedding(Base):
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     item_id = Column(UUID(as_uuid=True), ForeignKey("items.id", ondelete="CASCADE"), nullable=False)
     conversation_id = Column(UUID(as_uuid=True), ForeignKey("conversations.id", ondelete="CASCADE"), nullable=False)
+    # Copy of Item.owner_id so owner-scoped vector search filters without a join
+    owner_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=True)
     page = Column(Integer, nullable=False)
+    chunk_index = Column(Integer, nullable=False, default=0, server_default='0')
     chunk_text = Column(Text, nullable=False)
+    content_hash = Column(String(64), nullable=True)
     embedding = Column(Vector(1536)) 
+    # Mirror of Item.active, kept in sync by ItemService, so retrieval does not
+    # need to probe the items table for every chunk
+    item_active = Column(Boolean, nullable=False, default=True, server_default=text('true'))
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
@@ -27,10 +34,26 @@ class Embedding(Base):
     conversation = relationship("Conversation", back_populates="embeddings")
     
 
-    # Composite unique constraint and table configuration
+    # Composite unique constraint and table configuration.
+    # Deferred so a re-sync can shift chunks between slots inside one transaction.
     __table_args__ = (
-        UniqueConstraint('item_id', 'page', name='uix_item_page'),
+        UniqueConstraint(
+            'item_id', 'page', 'chunk_index',
+            name='uix_item_page_chunk',
+            deferrable=True,
+            initially='DEFERRED'
+        ),
+        Index(
+            'ix_embeddings_conversation_active',
+            'conversation_id',
+            postgresql_where=text('item_active')
+        ),
+        Index(
+            'ix_embeddings_owner_active',
+            'owner_id',
+            postgresql_where=text('item_active')
+        ),
     )
 
     def __repr__(self):
-        return f"<Embedding(id={self.id}, item_id={self.item_id}, page={self.page})>"
+        return f"<Embedding(id={self.id}, item_id={self.item_id}, page={self.page}, chunk={self.chunk_index})>"
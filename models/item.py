@@ -23,7 +23,13 @@ class Item(Base):
     # Define relationships
     owner = relationship("User", back_populates="owned_items")
     conversation = relationship("Conversation", back_populates="items")
-    embeddings = relationship("Embedding", back_populates="item", cascade="all, delete-orphan", lazy="dynamic")
+    embeddings = relationship(
+        "Embedding",
+        back_populates="item",
+        cascade="all, delete-orphan",
+        lazy="dynamic",
+        passive_deletes=True
+    )
 
     def __repr__(self):
         return f"<Item(id={self.id}, file_name='{self.file_name}')>" 
\ No newline at end of file
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Text, DateTime, ForeignKey, Enum
+from sqlalchemy import Column, String, Text, DateTime, ForeignKey, Enum, Index, text
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
@@ -21,9 +21,22 @@ class Message(Base):
     role = Column(Enum(MessageRole), nullable=False)
     user_id = Column(UUID(as_uuid=True), ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
     content = Column(Text, nullable=False)
-    source_embedding_id = Column(UUID(as_uuid=True), ForeignKey('embeddings.id'), nullable=True)
+    source_embedding_id = Column(UUID(as_uuid=True), ForeignKey('embeddings.id', ondelete='SET NULL'), nullable=True)
+    # Client supplied Idempotency-Key of the chat request that produced the message
+    idempotency_key = Column(String(255), nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
+    # History is always read newest first within one conversation
+    __table_args__ = (
+        Index('ix_messages_conversation_created', 'conversation_id', 'created_at'),
+        Index(
+            'uix_messages_idempotency',
+            'conversation_id', 'idempotency_key', 'role',
+            unique=True,
+            postgresql_where=text('idempotency_key IS NOT NULL')
+        ),
+    )
+
     # Relationships
     conversation = relationship("Conversation", back_populates="messages")
     user = relationship("User", back_populates="messages")
@@ -0,0 +1,50 @@
+from sqlalchemy import Column, BigInteger, Integer, String, DateTime, ForeignKey, Index
+from sqlalchemy.dialects.postgresql import ARRAY, UUID
+from sqlalchemy.sql import func
+from .base import Base
+import uuid
+
+class MessageArchive(Base):
+    """
+    A cold ``messages`` partition moved to a compressed file.
+
+    The file holds one gzip member per conversation; the members are listed
+    in ``message_archive_segments`` so one conversation can be read without
+    decompressing the rest.
+    """
+    __tablename__ = "message_archives"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    partition_name = Column(String(63), nullable=False, unique=True)
+    range_start = Column(DateTime(timezone=True), nullable=True)
+    range_end = Column(DateTime(timezone=True), nullable=False)
+    # Relative to MESSAGE_ARCHIVE_DIR
+    path = Column(String, nullable=False)
+    row_count = Column(Integer, nullable=False)
+    archived_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    def __repr__(self):
+        return f"<MessageArchive(partition={self.partition_name}, rows={self.row_count})>"
+
+
+class MessageArchiveSegment(Base):
+    """Byte range of one conversation's messages inside an archive file."""
+    __tablename__ = "message_archive_segments"
+
+    archive_id = Column(UUID(as_uuid=True), ForeignKey('message_archives.id', ondelete='CASCADE'), primary_key=True)
+    conversation_id = Column(UUID(as_uuid=True), ForeignKey('conversations.id', ondelete='CASCADE'), primary_key=True)
+    offset = Column(BigInteger, nullable=False)
+    length = Column(Integer, nullable=False)
+    row_count = Column(Integer, nullable=False)
+    # Ids of the messages in the range; NULL for segments archived before ids were recorded
+    message_ids = Column(ARRAY(UUID(as_uuid=True)), nullable=True)
+    first_created_at = Column(DateTime(timezone=True), nullable=False)
+    last_created_at = Column(DateTime(timezone=True), nullable=False)
+
+    # Archived history is read newest first within one conversation
+    __table_args__ = (
+        Index('ix_message_archive_segments_conversation', 'conversation_id', 'last_created_at'),
+    )
+
+    def __repr__(self):
+        return f"<MessageArchiveSegment(archive_id={self.archive_id}, conversation_id={self.conversation_id})>"
@@ -11,7 +11,8 @@ Item.embeddings = relationship(
     "Embedding",
     back_populates="item",
     cascade="all, delete-orphan",
-    lazy="dynamic"
+    lazy="dynamic",
+    passive_deletes=True
 )
 
 Embedding.item = relationship(
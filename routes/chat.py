@@ -1,33 +1,83 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, BackgroundTasks, Depends, Header, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
+import orjson
+import time
 import uuid
-import os
-from dependencies.database import DatabaseService
+from datetime import datetime, timezone
+from typing import Optional
+from sqlalchemy.exc import IntegrityError
+from dependencies.database import (
+    db_service,
+    get_chat_service,
+    get_conversation_service,
+    get_embedding_service,
+    get_item_service,
+    get_message_service,
+    get_user_service,
+    track_writes,
+    use_replica,
+)
 from dependencies.security import validate_token
+from dependencies.admission import acquire_chat_slot, admit_chat, get_chat_admission
+from services.archive import MessageArchiveService
 from services.message import MessageService, MessageRole
 from services.conversation import ConversationService
 from services.embedding import EmbeddingService
 from services.item import ItemService
 from services.chat import ChatService
 from services.user import UserService
-from schemas.chat import ChatRequest
+from utils.singleflight import SingleFlight
+from utils.resilience import DeadlineExceeded, deadline_scope, remaining
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from schemas.chat import BatchChatRequest, BatchChatResult, ChatRequest, ChatResponse
 
 router = APIRouter(
     prefix="/api/v1/chat",
-    tags=["chat"]
+    tags=["chat"],
+    dependencies=[Depends(track_writes)]
 )
-db_service = DatabaseService(os.getenv('DATABASE_URL'))
+# Concurrent identical questions (double clicks, retries) share one execution
+chat_flights = SingleFlight()
+
+def refresh_conversation_summary(conversation_id: uuid.UUID):
+    """Background task: the request session is closed by the time it runs."""
+    session = db_service.session()
+    try:
+        chat_service = ChatService(session)
+        # Runs after the response; the request's deadline is spent or nearly so
+        with deadline_scope(chat_service.summary_refresh_timeout, override=True):
+            chat_service.refresh_summary(conversation_id)
+    finally:
+        session.close()
+
 
-@router.post("")
+@router.post(
+    "",
+    response_model=ChatResponse,
+    response_class=ORJSONResponse,
+    dependencies=[Depends(admit_chat), Depends(use_replica)]
+)
 def chat(
     request: ChatRequest,
+    background_tasks: BackgroundTasks,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=255),
     user: dict = Depends(validate_token),
-    message_service: MessageService = Depends(db_service.get_message_service),
-    conversation_service: ConversationService = Depends(db_service.get_conversation_service),
-    user_service: UserService = Depends(db_service.get_user_service),
-    chat_service: ChatService = Depends(db_service.get_chat_service)
+    message_service: MessageService = Depends(get_message_service),
+    conversation_service: ConversationService = Depends(get_conversation_service),
+    user_service: UserService = Depends(get_user_service),
+    item_service: ItemService = Depends(get_item_service),
+    chat_service: ChatService = Depends(get_chat_service)
 ):
     """
     Chat endpoint that supports RAG functionality within conversation context
+
+    Identical questions in flight for the same conversation and documents
+    share one answer. With an ``Idempotency-Key`` header, a retried request
+    returns the stored answer instead of generating a new one; reusing the
+    key for a different message is rejected with 422, and a retry racing the
+    original on another worker gets 409 with ``Retry-After``.
     """
     # Extract user email from token
     email = user['UserAttributes'][0]['Value']
@@ -41,50 +91,250 @@ def chat(
     )
     if not conversation:
         raise HTTPException(status_code=404, detail="Conversation not found")
-    
-    message_service.create_message(
-        user=user,
-        conversation=conversation,
-        content=request.message,
-        role=MessageRole.USER
+
+    def check_same_question(stored) -> None:
+        question = stored.get(MessageRole.USER)
+        if question is not None and question.content != request.message:
+            raise HTTPException(
+                status_code=422,
+                detail="Idempotency-Key was already used for a different message"
+            )
+
+    def answer() -> ChatResponse:
+        stored = {}
+        if idempotency_key:
+            stored = message_service.get_messages_by_idempotency_key(conversation, idempotency_key)
+            check_same_question(stored)
+            if MessageRole.ASSISTANT in stored:
+                return chat_service.build_stored_response(
+                    stored[MessageRole.USER], stored[MessageRole.ASSISTANT]
+                )
+        try:
+            return answer_question(
+                request, user, conversation, background_tasks,
+                message_service, chat_service, idempotency_key,
+                user_message=stored.get(MessageRole.USER)
+            )
+        except IntegrityError:
+            # Another worker stored a message for this key first
+            message_service.db.rollback()
+            stored = message_service.get_messages_by_idempotency_key(conversation, idempotency_key)
+            if MessageRole.USER not in stored:
+                raise
+            check_same_question(stored)
+            if MessageRole.ASSISTANT not in stored:
+                # Its answer is still being generated
+                raise HTTPException(
+                    status_code=409,
+                    detail="A request with this Idempotency-Key is still in progress",
+                    headers={"Retry-After": "1"}
+                )
+            return chat_service.build_stored_response(
+                stored[MessageRole.USER], stored[MessageRole.ASSISTANT]
+            )
+
+    if idempotency_key:
+        # A different message under the same key must not get this one's answer
+        flight_key = ('idempotency', conversation.id, idempotency_key, request.message)
+    else:
+        flight_key = (
+            'question',
+            conversation.id,
+            " ".join(request.message.lower().split()),
+            request.mode,
+            request.top_k,
+            item_service.get_conversation_document_state(conversation.id)
+        )
+    try:
+        response, _ = chat_flights.do(flight_key, answer, timeout=remaining())
+    except FutureTimeoutError:
+        raise DeadlineExceeded("Timed out waiting for an identical request")
+    # Already validated; skip FastAPI's generic encoder and let orjson serialize
+    return ORJSONResponse(response.model_dump())
+
+
+def answer_question(
+    request: ChatRequest,
+    user,
+    conversation,
+    background_tasks: BackgroundTasks,
+    message_service: MessageService,
+    chat_service: ChatService,
+    idempotency_key: Optional[str] = None,
+    user_message=None
+) -> ChatResponse:
+    """Store the question, generate the answer and store it"""
+    # Checked before the question is stored, so a refused question leaves nothing behind
+    retriever = chat_service.build_answer_retriever(conversation, request.mode, request.top_k)
+    if retriever is None:
+        raise HTTPException(status_code=400, detail="Conversation has no active documents")
+    # Load the history before storing the question so it is not sent twice
+    messages = message_service.get_conversation_messages(
+        conversation,
+        limit=chat_service.history_limit,
+        after=conversation.summarized_until
     )
-    messages = message_service.get_conversation_messages(conversation)
-    
+    if user_message is None:
+        user_message = message_service.create_message(
+            user=user,
+            conversation=conversation,
+            content=request.message,
+            role=MessageRole.USER,
+            idempotency_key=idempotency_key
+        )
+    else:
+        # A previous attempt stored the question but not the answer
+        messages = [message for message in messages if message.id != user_message.id]
     
     chat_msgs, chat_history = chat_service.parse_message_history(messages)
     
-    
     answer_nodes = chat_service.get_answer_nodes(
         request.message, 
         conversation=conversation,
         chat_store=chat_history,
-        messages=chat_msgs
+        messages=chat_msgs,
+        mode=request.mode,
+        top_k=request.top_k,
+        retriever=retriever
     )
-    sources_id = None
-    sources = answer_nodes.sources
-    if len(sources) and len(sources[0].raw_output.source_nodes):
-        sources_id = uuid.UUID(
-            sources[0].raw_output.source_nodes[0].node.extra_info['id']
-        )
-    message_service.create_message(
+    sources = chat_service.extract_sources(answer_nodes, limit=request.top_k)
+    answer = message_service.create_message(
         user=user,
         conversation=conversation,
         role=MessageRole.ASSISTANT,
         content=answer_nodes.response,
-        source_embedding_id=sources_id
+        source_embedding_id=sources[0].embedding_id if sources else None,
+        idempotency_key=idempotency_key
+    )
+    # The question and the answer just added are not summarized either
+    if chat_service.needs_summary_refresh(len(messages) + 2):
+        background_tasks.add_task(refresh_conversation_summary, conversation.id)
+    return ChatResponse(
+        conversation_id=conversation.id,
+        message_id=user_message.id,
+        answer_id=answer.id,
+        answer=answer.content,
+        sources=sources,
+        created_at=answer.created_at
     )
-    return answer_nodes
 
 
-@router.get("/history/{conversation_id}")
+@router.post("/batch", dependencies=[Depends(use_replica)])
+async def batch_chat(
+    request: BatchChatRequest,
+    user: dict = Depends(validate_token),
+    conversation_service: ConversationService = Depends(get_conversation_service),
+    user_service: UserService = Depends(get_user_service),
+    chat_service: ChatService = Depends(get_chat_service)
+):
+    """
+    Answer a list of questions over one conversation's documents.
+
+    Authentication, lookups, chunk loading and query embedding happen once;
+    answers are generated concurrently and streamed back as NDJSON lines
+    (one BatchChatResult per question) in completion order.
+    """
+    email = user['UserAttributes'][0]['Value']
+    # Held until the stream ends, not just until the handler returns
+    await acquire_chat_slot(email)
+    admitted_at = time.monotonic()
+
+    released = False
+
+    async def release_slot():
+        nonlocal released
+        if not released:
+            released = True
+            await get_chat_admission().release(email, time.monotonic() - admitted_at)
+
+    try:
+        user = await run_in_threadpool(user_service.get_user_by_email, email)
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+
+        conversation = await run_in_threadpool(
+            conversation_service.get_conversation,
+            conversation_id=request.conversation_id,
+            user_id=user.id
+        )
+        if not conversation:
+            raise HTTPException(status_code=404, detail="Conversation not found")
+
+        batch = await run_in_threadpool(
+            chat_service.prepare_batch, conversation, request.questions, request.top_k
+        )
+        if batch is None:
+            raise HTTPException(status_code=400, detail="Conversation has no active documents")
+    except BaseException:
+        await release_slot()
+        raise
+
+    def persist(question: str, answer: str, source_embedding_id):
+        # The request session is closed once streaming starts
+        session = db_service.session(user_key=email)
+        try:
+            message_service = MessageService(session)
+            question_message = message_service.create_message(
+                user=user, conversation=conversation, content=question, role=MessageRole.USER
+            )
+            answer_message = message_service.create_message(
+                user=user,
+                conversation=conversation,
+                content=answer,
+                role=MessageRole.ASSISTANT,
+                source_embedding_id=source_embedding_id
+            )
+            return question_message.id, answer_message.id
+        finally:
+            session.close()
+
+    async def stream():
+        try:
+            async for index, response, error in chat_service.answer_batch(
+                batch, request.questions, request.max_concurrency
+            ):
+                result = BatchChatResult(index=index, question=request.questions[index], error=error)
+                if response is not None:
+                    result.answer = response.response
+                    result.sources = chat_service.extract_sources(response, limit=request.top_k)
+                    if request.persist:
+                        result.message_id, result.answer_id = await run_in_threadpool(
+                            persist,
+                            result.question,
+                            result.answer,
+                            result.sources[0].embedding_id if result.sources else None
+                        )
+                yield orjson.dumps(result.model_dump()) + b"\n"
+        finally:
+            await release_slot()
+
+    # The background task also covers clients that disconnect before the stream starts
+    return StreamingResponse(
+        stream(),
+        media_type="application/x-ndjson",
+        background=BackgroundTask(release_slot)
+    )
+
+
+@router.get("/history/{conversation_id}", dependencies=[Depends(use_replica)])
 def get_chat_history(
     conversation_id: uuid.UUID,
     user: dict = Depends(validate_token),
-    message_service: MessageService = Depends(db_service.get_message_service),
+    message_service: MessageService = Depends(get_message_service),
     limit: int = 5,
-    conversation_service: ConversationService = Depends(db_service.get_conversation_service),
-    user_service: UserService = Depends(db_service.get_user_service)
+    before: Optional[datetime] = None,
+    conversation_service: ConversationService = Depends(get_conversation_service),
+    user_service: UserService = Depends(get_user_service)
 ):
+    """
+    Page through a conversation's messages, newest first.
+
+    Pass the ``created_at`` of the oldest message received as ``before`` to
+    get the next page; old pages are read from the message archive. A
+    ``before`` without a UTC offset is taken as UTC.
+    """
+    if before is not None and before.tzinfo is None:
+        before = before.replace(tzinfo=timezone.utc)
     email = user['UserAttributes'][0]['Value']
     user = user_service.get_user_by_email(email)
     if not user:
@@ -97,20 +347,20 @@ def get_chat_history(
     if not conversation:
         raise HTTPException(status_code=404, detail="Conversation not found")
     
-    messages = message_service.get_conversation_messages(conversation, limit=limit)
+    messages = message_service.get_history(conversation, limit=limit, before=before)
     return messages
 
 
-@router.get("/history/{conversation_id}/{message_id}")
+@router.get("/history/{conversation_id}/{message_id}", dependencies=[Depends(use_replica)])
 def get_message(
     conversation_id: uuid.UUID,
     message_id: uuid.UUID,
     user: dict = Depends(validate_token),
-    message_service: MessageService = Depends(db_service.get_message_service),
-    conversation_service: ConversationService = Depends(db_service.get_conversation_service),
-    embedding_service: EmbeddingService = Depends(db_service.get_embedding_service),
-    user_service: UserService = Depends(db_service.get_user_service),
-    item_service: ItemService = Depends(db_service.get_item_service)
+    message_service: MessageService = Depends(get_message_service),
+    conversation_service: ConversationService = Depends(get_conversation_service),
+    embedding_service: EmbeddingService = Depends(get_embedding_service),
+    user_service: UserService = Depends(get_user_service),
+    item_service: ItemService = Depends(get_item_service)
 ):
     email = user['UserAttributes'][0]['Value']
     user = user_service.get_user_by_email(email)
@@ -125,11 +375,18 @@ def get_message(
         raise HTTPException(status_code=404, detail="Conversation not found")
     
     message = message_service.get_one_message(message_id)
+    if not message:
+        message = MessageArchiveService(message_service.db).get_message(conversation.id, message_id)
     if not message:
         raise HTTPException(status_code=404, detail="Message not found")
+    source_embedding = None
     if message.source_embedding_id:
         source_embedding = embedding_service.get_embedding(message.source_embedding_id)
-        item = item_service.get_item_by_id_only(source_embedding.item_id)
+    # The cited chunk or its document may have been removed since
+    item = None
+    if source_embedding is not None:
+        item = item_service.get_item_metadata([source_embedding.item_id]).get(source_embedding.item_id)
+    if item is not None:
         return {
             **message.asdict(),
             "original_text": source_embedding.chunk_text,
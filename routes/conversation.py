@@ -1,22 +1,30 @@
-import os 
 from fastapi import APIRouter, Depends, HTTPException
 from pydantic import UUID4
-from dotenv import load_dotenv, find_dotenv
 from dependencies.security import validate_token
-from dependencies.database import DatabaseService, UserService, ConversationService, ItemService
+from dependencies.database import (
+    UserService,
+    ConversationService,
+    ItemService,
+    get_conversation_service,
+    get_item_service,
+    get_user_service,
+    track_writes,
+    use_replica,
+)
 from schemas.conversation import ConversationCreate
 
-load_dotenv(find_dotenv())
-
-router = APIRouter(prefix='/api/v1/conversation', tags=['Conversations'])
-db_service = DatabaseService(os.getenv('DATABASE_URL'))
+router = APIRouter(
+    prefix='/api/v1/conversation',
+    tags=['Conversations'],
+    dependencies=[Depends(track_writes)]
+)
 
 @router.post("")
 def create_conversation(
     conversation: ConversationCreate,
     user: dict = Depends(validate_token),
-    user_service: UserService = Depends(db_service.get_user_service),
-    conversation_service: ConversationService = Depends(db_service.get_conversation_service)
+    user_service: UserService = Depends(get_user_service),
+    conversation_service: ConversationService = Depends(get_conversation_service)
 ):
     email = user['UserAttributes'][0]['Value']
     user = user_service.get_user_by_email(email)
@@ -27,12 +35,12 @@ def create_conversation(
     return conversation
 
 
-@router.get("")
+@router.get("", dependencies=[Depends(use_replica)])
 def get_all_conversation(
     title: str = None,
     user: dict = Depends(validate_token),
-    user_service: UserService = Depends(db_service.get_user_service),
-    conversation_service: ConversationService = Depends(db_service.get_conversation_service)
+    user_service: UserService = Depends(get_user_service),
+    conversation_service: ConversationService = Depends(get_conversation_service)
 ):
     email = user['UserAttributes'][0]['Value']
     user = user_service.get_user_by_email(email)
@@ -48,12 +56,12 @@ def get_all_conversation(
     return conversation
 
 
-@router.get("/{conversation_id}")
+@router.get("/{conversation_id}", dependencies=[Depends(use_replica)])
 def get_conversation(
     conversation_id: UUID4,
     user: dict = Depends(validate_token),
-    user_service: UserService = Depends(db_service.get_user_service),
-    conversation_service: ConversationService = Depends(db_service.get_conversation_service)
+    user_service: UserService = Depends(get_user_service),
+    conversation_service: ConversationService = Depends(get_conversation_service)
 ):
     email = user['UserAttributes'][0]['Value']
     user = user_service.get_user_by_email(email)
@@ -71,8 +79,8 @@ def update_conversation(
     conversation_id: UUID4,
     data: ConversationCreate,
     user: dict = Depends(validate_token),
-    user_service: UserService = Depends(db_service.get_user_service),
-    conversation_service: ConversationService = Depends(db_service.get_conversation_service)
+    user_service: UserService = Depends(get_user_service),
+    conversation_service: ConversationService = Depends(get_conversation_service)
 ):
     email = user['UserAttributes'][0]['Value']
     user = user_service.get_user_by_email(email)
@@ -89,9 +97,9 @@ def update_conversation(
 def delete_conversation(
     conversation_id: UUID4,
     user: dict = Depends(validate_token),
-    user_service: UserService = Depends(db_service.get_user_service),
-    conversation_service: ConversationService = Depends(db_service.get_conversation_service),
-    item_service: ItemService = Depends(db_service.get_item_service)
+    user_service: UserService = Depends(get_user_service),
+    conversation_service: ConversationService = Depends(get_conversation_service),
+    item_service: ItemService = Depends(get_item_service)
 ):
     email = user['UserAttributes'][0]['Value']
     user = user_service.get_user_by_email(email)
@@ -0,0 +1,263 @@
+from fastapi import APIRouter, Depends, File, Form, HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from pydantic import UUID4
+from sqlalchemy import delete
+from typing import Optional, Tuple
+import logging
+import os
+import tempfile
+import threading
+import orjson
+from dependencies.security import validate_token
+from dependencies.database import (
+    db_service,
+    get_conversation_service,
+    get_embedding_service,
+    get_item_service,
+    get_user_service,
+    track_writes,
+)
+from models.item import Item
+from services.conversation import ConversationService
+from services.embedding import EmbeddingService
+from services.item import ItemService
+from services.user import UserService
+from schemas.item import UploadProgress
+
+router = APIRouter(
+    prefix='/api/v1/item',
+    tags=['Items'],
+    dependencies=[Depends(track_writes)]
+)
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(2 * 1024 ** 3)))
+UPLOAD_READ_BYTES = 1024 ** 2
+UPLOAD_FORM_OVERHEAD = 64 * 1024
+UPLOAD_MIME_TYPES = {"application/pdf"}
+
+
+def progress_line(progress: UploadProgress) -> bytes:
+    return orjson.dumps(progress.model_dump(exclude_none=True)) + b"\n"
+
+
+async def spool_upload(file: UploadFile) -> Tuple[str, int]:
+    """
+    Copy an uploaded file to a temp file on disk in fixed-size reads.
+
+    Args:
+        file (UploadFile): The uploaded file
+
+    Returns:
+        Tuple[str, int]: Path of the temp file and its size; the caller removes it
+    """
+    spool = tempfile.NamedTemporaryFile(prefix="upload-", suffix=".pdf", delete=False)
+    size = 0
+    try:
+        while chunk := await file.read(UPLOAD_READ_BYTES):
+            size += len(chunk)
+            if size > UPLOAD_MAX_BYTES:
+                raise HTTPException(status_code=413, detail="File too large")
+            await run_in_threadpool(spool.write, chunk)
+        spool.close()
+    except BaseException:
+        spool.close()
+        os.unlink(spool.name)
+        raise
+    return spool.name, size
+
+
+@router.post("/upload")
+async def upload_item(
+    conversation_id: UUID4 = Form(...),
+    file: UploadFile = File(...),
+    uri: Optional[str] = Form(None),
+    user: dict = Depends(validate_token),
+    user_service: UserService = Depends(get_user_service),
+    conversation_service: ConversationService = Depends(get_conversation_service),
+    item_service: ItemService = Depends(get_item_service)
+):
+    """
+    Upload a PDF into a conversation and ingest it, reporting progress as NDJSON.
+
+    The file is copied in fixed-size reads to a temp file on disk, then pages
+    are parsed, chunked, embedded and stored batch by batch, so worker memory
+    does not depend on the file size. The item stays inactive (invisible to
+    chat and search) until every batch is stored; on failure or disconnect it
+    is removed again.
+    """
+    if file.content_type not in UPLOAD_MIME_TYPES:
+        raise HTTPException(status_code=415, detail=f"Unsupported file type: {file.content_type}")
+
+    email = user['UserAttributes'][0]['Value']
+    user = await run_in_threadpool(user_service.get_user_by_email, email)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    conversation = await run_in_threadpool(
+        conversation_service.get_conversation,
+        conversation_id=conversation_id,
+        user_id=user.id
+    )
+    if not conversation:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+
+    path, size = await spool_upload(file)
+    try:
+        item = await run_in_threadpool(
+            item_service.create_item,
+            file_name=file.filename or "upload.pdf",
+            mime_type=file.content_type,
+            uri=uri or f"upload://{file.filename}",
+            owner=user,
+            conversation_id=conversation.id,
+            active=False
+        )
+    except BaseException:
+        os.unlink(path)
+        raise
+    item_id = item.id
+
+    state = {"done": False, "cleaned": False}
+    lock = threading.Lock()
+    # Held while the stream runs a step; a disconnect waits for it before cleaning up
+    step = threading.Lock()
+    stop = threading.Event()
+
+    def cleanup():
+        # Runs from the stream and again as a background task; only the first call acts
+        with lock:
+            if state["cleaned"]:
+                return
+            state["cleaned"] = True
+        os.unlink(path)
+        if not state["done"]:
+            session = db_service.session()
+            try:
+                session.execute(delete(Item).where(Item.id == item_id))
+                session.commit()
+            finally:
+                session.close()
+
+    def stream():
+        # The request session is closed once streaming starts
+        session = db_service.session(user_key=email)
+        updates = None
+        try:
+            yield progress_line(UploadProgress(status="uploaded", item_id=item_id, bytes_received=size))
+            item_service = ItemService(session)
+            item = item_service.get_item_by_id_only(item_id)
+            embedding_service = EmbeddingService(session, openai_api_key=os.getenv("OPENAI_API_KEY"))
+            progress = None
+            updates = embedding_service.ingest_pdf(item, path)
+            for progress in updates:
+                yield progress_line(progress)
+            item_service.update_item(item, active=True)
+            state["done"] = True
+            yield progress_line(UploadProgress(
+                status="done",
+                item_id=item_id,
+                pages_total=progress.pages_total if progress else 0,
+                pages_done=progress.pages_done if progress else 0,
+                chunks_done=progress.chunks_done if progress else 0
+            ))
+        except Exception as e:
+            logger.error(f"Failed to ingest upload {item_id}: {str(e)}")
+            session.rollback()
+            yield progress_line(UploadProgress(status="error", item_id=item_id, detail=str(e)))
+        finally:
+            if updates is not None:
+                # Stops handing pages to the parse pool
+                updates.close()
+            session.close()
+            cleanup()
+
+    ingest = stream()
+
+    def steps():
+        while True:
+            with step:
+                if stop.is_set():
+                    return
+                try:
+                    line = next(ingest)
+                except StopIteration:
+                    return
+            yield line
+
+    def stop_ingest():
+        # After a disconnect nobody resumes the stream: stop it, wait for the
+        # batch in progress and close it, so its session and files are
+        # released before the item is deleted
+        stop.set()
+        with step:
+            ingest.close()
+        # Closing a stream that never started does not run its cleanup
+        cleanup()
+
+    # The background task also covers clients that disconnect before the stream starts
+    return StreamingResponse(
+        steps(),
+        media_type="application/x-ndjson",
+        background=BackgroundTask(stop_ingest)
+    )
+
+
+@router.put("/{item_id}/document")
+async def replace_item_document(
+    item_id: UUID4,
+    file: UploadFile = File(...),
+    user: dict = Depends(validate_token),
+    user_service: UserService = Depends(get_user_service),
+    item_service: ItemService = Depends(get_item_service),
+    embedding_service: EmbeddingService = Depends(get_embedding_service)
+):
+    """
+    Replace an item's PDF with a new version and re-sync its chunks.
+
+    Chunks are matched by content hash, so only new or edited chunks are
+    embedded again and chunks that disappeared are deleted, in one transaction.
+    """
+    if file.content_type not in UPLOAD_MIME_TYPES:
+        raise HTTPException(status_code=415, detail=f"Unsupported file type: {file.content_type}")
+
+    email = user['UserAttributes'][0]['Value']
+    user = await run_in_threadpool(user_service.get_user_by_email, email)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    item = await run_in_threadpool(item_service.get_item_by_id, user, item_id)
+    if not item:
+        raise HTTPException(status_code=404, detail="Item not found")
+
+    path, _ = await spool_upload(file)
+    try:
+        return await run_in_threadpool(embedding_service.resync_pdf, item, path)
+    finally:
+        os.unlink(path)
+
+
+class UploadSizeLimitMiddleware:
+    """
+    ASGI middleware refusing item uploads whose declared size is over ``UPLOAD_MAX_BYTES``.
+
+    FastAPI reads and spools the whole multipart body before the route runs,
+    so a too large upload is answered with 413 from its ``Content-Length``
+    before any of it is read. Bodies without one are still cut off by the
+    route while they are copied.
+    """
+
+    def __init__(self, app, max_bytes: int = UPLOAD_MAX_BYTES, prefix: str = router.prefix):
+        self.app = app
+        # Room for the multipart framing and the other form fields
+        self.max_length = max_bytes + UPLOAD_FORM_OVERHEAD
+        self.prefix = prefix
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] in ("POST", "PUT") and scope["path"].startswith(self.prefix):
+            length = dict(scope["headers"]).get(b"content-length")
+            if length is not None and length.isdigit() and int(length) > self.max_length:
+                response = JSONResponse(status_code=413, content={"detail": "File too large"})
+                return await response(scope, receive, send)
+        await self.app(scope, receive, send)
@@ -0,0 +1,40 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from dependencies.admission import get_chat_admission
+from utils.cache import cache_stats
+from utils.invalidation import invalidation_bus
+from utils.querylog import query_log
+from utils.resilience import breaker_states
+
+router = APIRouter(tags=['Metrics'])
+
+
+def render_metrics(prefix: str, values: dict) -> str:
+    """Render a flat dict of numbers in the Prometheus text exposition format; names may carry {labels}"""
+    # Samples of one metric must be contiguous, whatever the order of ``values``
+    families = {}
+    for name, value in values.items():
+        metric = f"{prefix}_{name}"
+        families.setdefault(metric.split('{', 1)[0], []).append(f"{metric} {value}")
+    lines = []
+    for base, samples in families.items():
+        lines.append(f"# TYPE {base} {'counter' if base.endswith('_total') else 'gauge'}")
+        lines.extend(samples)
+    return "".join(f"{line}\n" for line in lines)
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    circuits = {
+        f'open{{dependency="{name}"}}': int(state == "open")
+        for name, state in breaker_states().items()
+    }
+    return render_metrics("chat_admission", get_chat_admission().stats()) + \
+        render_metrics("circuit", circuits) + \
+        render_metrics("invalidation", invalidation_bus.stats()) + \
+        render_metrics("query_log", query_log.stats()) + \
+        render_metrics("cache", {
+            f"{name}{{{label}}}": value
+            for label, stats in cache_stats()
+            for name, value in stats.items()
+        })
@@ -0,0 +1,40 @@
+from fastapi import APIRouter, Header, HTTPException, Query
+from fastapi.responses import FileResponse
+from typing import Literal, Optional
+from utils.profiling import is_authorized, profile_path
+from utils.querylog import query_log
+
+router = APIRouter(prefix='/api/v1/profile', tags=['Profiling'])
+
+
+@router.get("/queries")
+def get_top_queries(
+    limit: int = Query(20, ge=1, le=200),
+    order_by: Literal["total_ms", "max_ms", "calls", "slow_calls"] = "total_ms",
+    x_profile: Optional[str] = Header(None)
+):
+    """
+    Report the statements of this worker with the most database time.
+
+    Each entry carries its call count, timings, the functions that issued it
+    and, for sampled slow SELECTs, the last ``EXPLAIN (ANALYZE, BUFFERS)`` plan.
+    Plans may show parameter values, so this needs the profiling secret too.
+    """
+    if not is_authorized(x_profile):
+        raise HTTPException(status_code=403, detail="Profiling is not authorized")
+    return {"summary": query_log.stats(), "statements": query_log.top(limit, order_by)}
+
+
+@router.get("/{profile_id}")
+def get_profile(profile_id: str, x_profile: Optional[str] = Header(None)):
+    """
+    Download a stored request profile as a speedscope file.
+
+    Requires the profiling secret in ``X-Profile``, like the profiled request.
+    """
+    if not is_authorized(x_profile):
+        raise HTTPException(status_code=403, detail="Profiling is not authorized")
+    path = profile_path(profile_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="application/json", filename=f"{profile_id}.speedscope.json")
@@ -0,0 +1,53 @@
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import ORJSONResponse
+from pydantic import UUID4
+from dependencies.security import validate_token
+from dependencies.database import get_embedding_service, get_user_service, use_replica
+from services.embedding import EmbeddingService
+from services.user import UserService
+from schemas.search import SearchResponse
+
+router = APIRouter(prefix='/api/v1/search', tags=['Search'])
+
+
+@router.get(
+    "",
+    response_model=SearchResponse,
+    response_class=ORJSONResponse,
+    dependencies=[Depends(use_replica)]
+)
+def search(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(10, ge=1, le=50),
+    offset: int = Query(0, ge=0, le=1000),
+    mime_type: Optional[List[str]] = Query(None),
+    item_id: Optional[List[UUID4]] = Query(None),
+    user: dict = Depends(validate_token),
+    user_service: UserService = Depends(get_user_service),
+    embedding_service: EmbeddingService = Depends(get_embedding_service)
+):
+    """
+    Semantic search over every active document of the caller, across conversations
+    """
+    email = user['UserAttributes'][0]['Value']
+    user = user_service.get_user_by_email(email)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    results = embedding_service.search_owner_chunks(
+        owner_id=user.id,
+        query=q,
+        limit=limit,
+        offset=offset,
+        mime_types=mime_type,
+        item_ids=item_id
+    )
+    response = SearchResponse(
+        query=q,
+        results=results,
+        limit=limit,
+        offset=offset,
+        next_offset=offset + limit if len(results) == limit else None
+    )
+    return ORJSONResponse(response.model_dump())
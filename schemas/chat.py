@@ -1,8 +1,17 @@
-from pydantic import BaseModel, UUID4
+from pydantic import BaseModel, Field, UUID4
 from typing import List, Optional
 from datetime import datetime
+from enum import Enum
 from models.message import MessageRole
 
+class ChatMode(str, Enum):
+    # Tool-calling agent: the LLM decides whether to query the documents
+    AGENT = "agent"
+    # Retrieve once, answer with a single LLM call
+    CONTEXT = "context"
+    # Like CONTEXT, but follow-up questions are first condensed with the history
+    CONDENSE_PLUS_CONTEXT = "condense_plus_context"
+
 class ChatMessage(BaseModel):
     content: str
     role: MessageRole
@@ -12,16 +21,42 @@ class ChatRequest(BaseModel):
     message: str
     use_rag: bool = True
     top_k: int = 3
+    mode: ChatMode = ChatMode.CONTEXT
+
+class SourceReference(BaseModel):
+    embedding_id: UUID4
+    item_id: UUID4
+    item_name: Optional[str] = None
+    page: int
+    score: Optional[float] = None
 
 class ChatResponse(BaseModel):
     conversation_id: UUID4
-    message: str
-    sources: List[dict] = []
+    message_id: UUID4
+    answer_id: UUID4
+    answer: str
+    sources: List[SourceReference] = []
     created_at: datetime
 
     class Config:
         from_attributes = True
 
+class BatchChatRequest(BaseModel):
+    conversation_id: UUID4
+    questions: List[str] = Field(..., min_length=1, max_length=100)
+    top_k: int = 3
+    max_concurrency: int = Field(4, ge=1, le=16)
+    persist: bool = True
+
+class BatchChatResult(BaseModel):
+    index: int
+    question: str
+    answer: Optional[str] = None
+    message_id: Optional[UUID4] = None
+    answer_id: Optional[UUID4] = None
+    sources: List[SourceReference] = []
+    error: Optional[str] = None
+
 class ChatHistory(BaseModel):
     messages: List[ChatMessage]
     
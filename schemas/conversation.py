@@ -17,6 +17,11 @@ class Conversation(ConversationBase):
     user_id: UUID4
     created_at: datetime
     updated_at: Optional[datetime] = None
+    active_item_count: int = 0
+    chunk_count: int = 0
+    message_count: int = 0
+    last_message_at: Optional[datetime] = None
+    last_message_preview: Optional[str] = None
 
     class Config:
         from_attributes = True
\ No newline at end of file
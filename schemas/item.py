@@ -0,0 +1,12 @@
+from pydantic import BaseModel, UUID4
+from typing import Optional
+
+class UploadProgress(BaseModel):
+    # uploaded, parsing, embedding, done or error
+    status: str
+    item_id: Optional[UUID4] = None
+    bytes_received: Optional[int] = None
+    pages_total: Optional[int] = None
+    pages_done: Optional[int] = None
+    chunks_done: Optional[int] = None
+    detail: Optional[str] = None
@@ -0,0 +1,20 @@
+from pydantic import BaseModel, UUID4
+from typing import List, Optional
+
+class SearchResult(BaseModel):
+    embedding_id: UUID4
+    item_id: UUID4
+    conversation_id: UUID4
+    item_name: str
+    mime_type: str
+    uri: str
+    page: int
+    text: str
+    score: float
+
+class SearchResponse(BaseModel):
+    query: str
+    results: List[SearchResult] = []
+    limit: int
+    offset: int
+    next_offset: Optional[int] = None
@@ -0,0 +1,119 @@
+from typing import List, Optional
+from sqlalchemy import any_, bindparam, or_, select
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.orm import Session
+from datetime import datetime
+import gzip
+import logging
+import os
+import uuid
+import orjson
+from models.message import Message, MessageRole
+from models.message_archive import MessageArchive, MessageArchiveSegment
+from utils.partitioning import archive_directory
+
+# Built once so the compiled form is reused from the engine's statement cache
+ARCHIVED_SEGMENTS = select(MessageArchiveSegment, MessageArchive.path)\
+    .join(MessageArchive, MessageArchive.id == MessageArchiveSegment.archive_id)\
+    .where(MessageArchiveSegment.conversation_id == bindparam('conversation_id'))\
+    .order_by(MessageArchiveSegment.last_created_at.desc())
+
+# Only segments recorded as holding the message, plus those archived before ids were recorded
+SEGMENTS_WITH_MESSAGE = ARCHIVED_SEGMENTS.where(or_(
+    MessageArchiveSegment.message_ids.is_(None),
+    bindparam('message_id', type_=UUID(as_uuid=True)) == any_(MessageArchiveSegment.message_ids)
+))
+
+
+class ArchiveUnavailable(Exception):
+    """Archived messages are needed but their files cannot be read on this host."""
+
+
+class MessageArchiveService:
+    def __init__(self, db: Session, directory: Optional[str] = None):
+        """
+        Read messages of partitions archived by ``utils.partitioning``.
+
+        Args:
+            db (Session): Session used to read the archive catalogue
+            directory (Optional[str]): Directory holding the archive files,
+                ``MESSAGE_ARCHIVE_DIR`` by default
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.db = db
+        self.directory = directory
+
+    def read_segment(self, path: str, segment: MessageArchiveSegment) -> List[Message]:
+        """
+        Messages of one conversation in one archive file, oldest first, as transient instances.
+
+        Raises:
+            ArchiveUnavailable: If the archive directory is not configured or
+                the file cannot be read; history would otherwise come back
+                silently incomplete
+        """
+        try:
+            with open(os.path.join(archive_directory(self.directory), path), "rb") as f:
+                f.seek(segment.offset)
+                data = gzip.decompress(f.read(segment.length))
+        except (ValueError, OSError) as e:
+            self.logger.error(f"Failed to read archived messages from {path}: {str(e)}")
+            raise ArchiveUnavailable(f"Archived messages are unavailable: {str(e)}") from e
+        messages = []
+        for line in data.splitlines():
+            row = orjson.loads(line)
+            messages.append(Message(
+                id=uuid.UUID(row['id']),
+                conversation_id=uuid.UUID(row['conversation_id']),
+                role=MessageRole(row['role']),
+                user_id=uuid.UUID(row['user_id']),
+                content=row['content'],
+                source_embedding_id=uuid.UUID(row['source_embedding_id']) if row['source_embedding_id'] else None,
+                idempotency_key=row['idempotency_key'],
+                created_at=datetime.fromisoformat(row['created_at'])
+            ))
+        return messages
+
+    def get_messages(self, conversation_id: uuid.UUID, limit: int, before: Optional[datetime] = None) -> List[Message]:
+        """
+        Newest archived messages of a conversation, newest first.
+
+        Only the archive segments of this conversation are decompressed,
+        newest first, until ``limit`` messages are found.
+
+        Args:
+            conversation_id (uuid.UUID): Conversation to read
+            limit (int): Maximum number of messages
+            before (Optional[datetime]): Only messages created before this time
+
+        Returns:
+            List[Message]: Transient (unattached) messages
+        """
+        messages: List[Message] = []
+        for segment, path in self.db.execute(ARCHIVED_SEGMENTS, {'conversation_id': conversation_id}):
+            if len(messages) >= limit:
+                break
+            if before is not None and segment.first_created_at >= before:
+                continue
+            rows = self.read_segment(path, segment)
+            messages.extend(
+                message for message in reversed(rows)
+                if before is None or message.created_at < before
+            )
+        return messages[:limit]
+
+    def get_message(self, conversation_id: uuid.UUID, message_id: uuid.UUID) -> Optional[Message]:
+        """
+        Find an archived message of a conversation by id.
+
+        The catalogue says which segment holds the message, so an unknown id
+        is answered without reading any file.
+        """
+        segments = self.db.execute(
+            SEGMENTS_WITH_MESSAGE, {'conversation_id': conversation_id, 'message_id': message_id}
+        )
+        for segment, path in segments:
+            for message in self.read_segment(path, segment):
+                if message.id == message_id:
+                    return message
+        return None
@@ -1,17 +1,62 @@
-from typing import List, Dict, Optional, Union
+from typing import AsyncIterator, List, Dict, Optional, Tuple, Union, TYPE_CHECKING
+from dataclasses import dataclass
 from sqlalchemy.orm import Session
-from llama_index.core import VectorStoreIndex
-from llama_index.llms.openai import OpenAI
-from llama_index.core.storage.chat_store import SimpleChatStore
-from llama_index.core.memory import ChatMemoryBuffer
-from llama_index.core.prompts import ChatMessage, MessageRole as ChatMessageRole
+from sqlalchemy import func, select, update
 from models.conversation import Conversation
 from models.message import Message, MessageRole
 from services.embedding import EmbeddingService
-import openai
+from services.message import MessageService
+from schemas.chat import ChatMode, ChatResponse, SourceReference
+from utils.resilience import (
+    acall_with_retries,
+    call_with_retries,
+    deadline_scope,
+    get_breaker,
+    openai_transient_errors,
+    timeout_for,
+)
+from utils.invalidation import CONVERSATION, USER_CONVERSATIONS, publish
+from utils.routing import replica_reads
+import asyncio
+import logging
 import os
 import uuid
 
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a conversation between a user and an assistant "
+    "about their documents. Rewrite the summary so it also covers the new messages. "
+    "Keep facts, names, numbers, decisions and open questions; drop pleasantries. "
+    "Answer with the summary only, in at most {max_tokens} tokens.\n\n"
+    "Current summary:\n{summary}\n\nNew messages:\n{transcript}"
+)
+
+CONTEXT_PROMPT = (
+    "{system_prompt}\n\n"
+    "Context information is below.\n"
+    "--------------------\n"
+    "{context}\n"
+    "--------------------\n"
+    "Answer the user's question using the context above."
+)
+
+if TYPE_CHECKING:
+    from llama_index.core.chat_engine.types import AgentChatResponse
+    from llama_index.core.prompts import ChatMessage
+    from llama_index.core.storage.chat_store import SimpleChatStore
+    from llama_index.core.schema import NodeWithScore
+    from services.context import ContextPacker
+    from services.retriever import ChunkMatrixRetriever
+
+
+@dataclass
+class BatchRetrieval:
+    """Retrieval state loaded once and shared by every question of a batch."""
+    packer: "ContextPacker"
+    system_prompt: str
+    # Retrieved chunks per question, best first
+    retrieved: List[List["NodeWithScore"]]
+    top_k: int
+
 class ChatService:
     def __init__(self, db: Session):
         self.db = db
@@ -19,19 +64,227 @@ class ChatService:
             db=db,
             openai_api_key=os.getenv("OPENAI_API_KEY")
         )
-        self.llm = OpenAI(
-            model="gpt-4o",
-            api_key=os.getenv("OPENAI_API_KEY")
-        )
-        self.embed_model = self.embedding_service.embed_model
-        self.chat_store = SimpleChatStore()
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.context_token_budget = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+        # Candidates retrieved per requested chunk; the packer keeps what fits the budget
+        self.context_overfetch = int(os.getenv("CONTEXT_OVERFETCH", "4"))
+        # Prompts carry the summary plus the messages it does not cover yet:
+        # the last HISTORY_TURNS turns, and up to SUMMARY_EVERY_N_TURNS more
+        # until the next background refresh folds them into the summary
+        self.history_turns = int(os.getenv("HISTORY_TURNS", "3"))
+        self.summary_every_n_turns = int(os.getenv("SUMMARY_EVERY_N_TURNS", "4"))
+        self.summary_max_tokens = int(os.getenv("SUMMARY_MAX_TOKENS", "300"))
+        self.openai_timeout = float(os.getenv("OPENAI_TIMEOUT", "30"))
+        # Each batch question gets its own budget; the stream outlives the request deadline
+        self.batch_question_timeout = float(os.getenv("BATCH_QUESTION_TIMEOUT", "60"))
+        # Summary refreshes run after the response, outside the request deadline
+        self.summary_refresh_timeout = float(os.getenv("SUMMARY_REFRESH_TIMEOUT", "60"))
+        self._llm = None
+        self._chat_store = None
+
+    @property
+    def llm(self):
+        """gpt-4o client, imported and built on first use."""
+        if self._llm is None:
+            from llama_index.llms.openai import OpenAI
+            self._llm = OpenAI(
+                model="gpt-4o",
+                api_key=os.getenv("OPENAI_API_KEY"),
+                # Bounded by the request deadline; retries are ours
+                timeout=timeout_for(self.openai_timeout),
+                max_retries=0
+            )
+        return self._llm
+
+    @property
+    def embed_model(self):
+        return self.embedding_service.embed_model
+
+    @property
+    def chat_store(self) -> "SimpleChatStore":
+        if self._chat_store is None:
+            from llama_index.core.storage.chat_store import SimpleChatStore
+            self._chat_store = SimpleChatStore()
+        return self._chat_store
         
 
+    @property
+    def history_limit(self) -> int:
+        """Maximum number of unsummarized messages put in a prompt."""
+        # One extra turn of slack in case the refresh is still running
+        return 2 * (self.history_turns + self.summary_every_n_turns + 1)
+
+    def build_system_prompt(self, conversation: Conversation) -> str:
+        """Conversation context followed by the rolling summary, if any."""
+        if not conversation.summary:
+            return conversation.context
+        return f"{conversation.context}\n\nSummary of the earlier conversation:\n{conversation.summary}"
+
+    def needs_summary_refresh(self, unsummarized_count: int) -> bool:
+        """Whether enough turns piled up since the last summary to fold them in."""
+        return unsummarized_count >= 2 * (self.history_turns + self.summary_every_n_turns)
+
+    def refresh_summary(self, conversation_id: uuid.UUID) -> bool:
+        """
+        Fold the oldest unsummarized turns, all but the last ``HISTORY_TURNS``, into the summary.
+
+        Meant to run in the background after a response was sent. The turns
+        are read under an advisory lock, so concurrent refreshes of one
+        conversation are skipped, but no transaction is held during the LLM
+        call. The summary is only written if no other refresh moved
+        ``summarized_until`` in the meantime. At most ``4 * history_limit``
+        messages are folded per call; a longer backlog is folded by the
+        next refreshes, oldest first.
+
+        Args:
+            conversation_id (uuid.UUID): Conversation to summarize
+
+        Returns:
+            bool: True if the summary was updated
+        """
+        from llama_index.core.prompts import ChatMessage
+        from services.context import get_encoding
+
+        try:
+            locked = self.db.execute(
+                select(func.pg_try_advisory_xact_lock(func.hashtext(str(conversation_id))))
+            ).scalar()
+            conversation = self.db.get(Conversation, conversation_id)
+            if not locked or conversation is None:
+                self.db.rollback()
+                return False
+
+            keep = 2 * self.history_turns
+            # Oldest first, so a backlog longer than one fold is worked off in
+            # order by the following refreshes instead of being skipped; the
+            # extra ``keep`` rows tell whether the kept window is reached
+            pending = MessageService(self.db).get_messages_after(
+                conversation,
+                limit=self.history_limit * 4 + keep,
+                after=conversation.summarized_until
+            )
+            if len(pending) <= keep:
+                self.db.rollback()
+                return False
+            to_fold = pending[:len(pending) - keep]
+            summarized_until = conversation.summarized_until
+            transcript = "\n".join(
+                f"{message.role.value}: {message.content}" for message in to_fold
+            )
+            prompt = [ChatMessage(
+                role="user",
+                content=SUMMARY_PROMPT.format(
+                    max_tokens=self.summary_max_tokens,
+                    summary=conversation.summary or "(none)",
+                    transcript=transcript
+                )
+            )]
+            # Read now: ending the transaction expires the loaded rows
+            user_id = conversation.user_id
+            folded_until = to_fold[-1].created_at
+            # Ends the transaction and releases the lock before the slow part
+            self.db.rollback()
+
+            response = call_with_retries(
+                lambda: self.llm.chat(prompt),
+                breaker=get_breaker('openai-chat'),
+                retry_on=openai_transient_errors()
+            )
+            encoding = get_encoding(self.llm.model)
+            summary = encoding.decode(
+                encoding.encode(response.message.content.strip())[:self.summary_max_tokens]
+            )
+            updated = self.db.execute(
+                update(Conversation)
+                .where(
+                    Conversation.id == conversation_id,
+                    # Another refresh finished first: its summary already covers these turns
+                    Conversation.summarized_until.is_not_distinct_from(summarized_until)
+                )
+                .values(
+                    summary=summary,
+                    summarized_until=folded_until,
+                    # A summary refresh is not a user edit
+                    updated_at=Conversation.updated_at
+                )
+            ).rowcount
+            if not updated:
+                self.db.rollback()
+                self.logger.info(f"Dropped a stale summary of conversation {conversation_id}")
+                return False
+            publish(self.db, CONVERSATION, conversation_id)
+            publish(self.db, USER_CONVERSATIONS, user_id)
+            self.db.commit()
+            self.logger.info(f"Summarized {len(to_fold)} messages of conversation {conversation_id}")
+            return True
+        except Exception as e:
+            self.db.rollback()
+            self.logger.error(f"Failed to refresh summary of conversation {conversation_id}: {str(e)}")
+            return False
+
+    def extract_sources(self, response, limit: Optional[int] = None) -> List[SourceReference]:
+        """
+        Turn the source nodes of a chat response into ranked references.
+
+        Args:
+            response: Chat engine response carrying ``source_nodes``
+            limit (Optional[int]): Maximum number of references to return
+
+        Returns:
+            List[SourceReference]: Unique chunks ordered by descending score
+        """
+        ranked = sorted(
+            response.source_nodes,
+            key=lambda source: source.score if source.score is not None else float('-inf'),
+            reverse=True
+        )
+        sources: List[SourceReference] = []
+        seen = set()
+        for source in ranked:
+            metadata = source.node.metadata
+            if metadata['id'] in seen:
+                continue
+            seen.add(metadata['id'])
+            sources.append(SourceReference(
+                embedding_id=metadata['id'],
+                item_id=metadata['item_id'],
+                item_name=metadata.get('item_name'),
+                page=metadata['page'],
+                score=source.score
+            ))
+            if limit and len(sources) >= limit:
+                break
+        return sources
+
+    def build_stored_response(self, question: Message, answer: Message) -> ChatResponse:
+        """Rebuild the response of an already answered request from its stored messages."""
+        sources: List[SourceReference] = []
+        if answer.source_embedding_id:
+            embedding = self.embedding_service.get_embedding(answer.source_embedding_id)
+            if embedding is not None:
+                item = self.embedding_service.item_service.get_item_by_id_only(embedding.item_id)
+                sources.append(SourceReference(
+                    embedding_id=embedding.id,
+                    item_id=embedding.item_id,
+                    item_name=item.file_name if item else None,
+                    page=embedding.page
+                ))
+        return ChatResponse(
+            conversation_id=answer.conversation_id,
+            message_id=question.id,
+            answer_id=answer.id,
+            answer=answer.content,
+            sources=sources,
+            created_at=answer.created_at
+        )
+
     def parse_message_history(self, messages: List[Message]) -> \
-        Union[List[ChatMessage], Optional[SimpleChatStore]]:
-        """Parse message history into a list of strings"""
+        Union[List["ChatMessage"], Optional["SimpleChatStore"]]:
+        """Parse message history (newest first) into chat messages, oldest first"""
+        from llama_index.core.prompts import ChatMessage
+
         chat_messages: List[ChatMessage] = []
-        for message in messages:
+        for message in reversed(messages):
             role = str(message.role.value).lower()
             chat_message = ChatMessage(
                 role=role,
@@ -51,39 +304,213 @@ class ChatService:
         self, 
         query_text: str,
         conversation: Conversation,
-        chat_store: Optional[SimpleChatStore],
-        messages: List[Message],
-        # top_k: int = 5,
-        # use_hybrid: bool = True
+        chat_store: Optional["SimpleChatStore"],
+        messages: List["ChatMessage"],
+        mode: ChatMode = ChatMode.CONTEXT,
+        top_k: int = 3,
+        retriever: Optional["ChunkMatrixRetriever"] = None
     ):
         """
-        Get relevant nodes using hybrid search within conversation context
+        Answer a question over the conversation's documents.
+
+        Args:
+            query_text (str): The user's question
+            conversation (Conversation): Conversation whose documents are searched;
+                its ``context`` and rolling summary form the system prompt
+            chat_store (Optional[SimpleChatStore]): Store backing the chat memory
+            messages (List[ChatMessage]): Prior turns, oldest first, without the question
+            mode (ChatMode): ``CONTEXT`` retrieves once and makes a single LLM call,
+                ``CONDENSE_PLUS_CONTEXT`` first rewrites follow-up questions, and
+                ``AGENT`` lets a tool-calling agent decide when to query
+            top_k (int): Number of chunks to retrieve; the context modes retrieve
+                ``CONTEXT_OVERFETCH`` times as many candidates, merge them and pack
+                them into ``CONTEXT_TOKEN_BUDGET`` tokens
+            retriever (Optional[ChunkMatrixRetriever]): Retriever already built by
+                ``build_answer_retriever``, so callers can check for documents first
+
+        Returns:
+            Chat engine response, or None if the conversation has no active documents
         """
-        embeddings = self.embedding_service.get_conversation_embeddings(conversation.id)
-        if not len(embeddings):
+        from llama_index.core.chat_engine import CondensePlusContextChatEngine, ContextChatEngine
+        from llama_index.core.memory import ChatMemoryBuffer
+        from services.context import ContextPacker
+
+        if retriever is None:
+            retriever = self.build_answer_retriever(conversation, mode, top_k)
+        if retriever is None:
             return None
-        nodes = self.embedding_service.parse_embeddings_to_nodes(embeddings)
-        
-        self.vector_store = VectorStoreIndex(
-            nodes=nodes,
-            embed_model=self.embed_model,
-        )
         chat_mem = ChatMemoryBuffer.from_defaults(
             token_limit=4096,
             chat_history=messages, 
             chat_store=chat_store,
             chat_store_key=str(conversation.id) 
         )
-        chat_engine = self.vector_store.as_chat_engine(
-            llm=self.llm,
-            chat_history=messages,
-            memory=chat_mem
-        )
+        packer = ContextPacker(token_budget=self.context_token_budget, model=self.llm.model)
+        system_prompt = self.build_system_prompt(conversation)
+        if mode == ChatMode.AGENT:
+            from llama_index.core.agent import AgentRunner
+            from llama_index.core.query_engine import RetrieverQueryEngine
+            from llama_index.core.tools import QueryEngineTool
+
+            # What VectorStoreIndex.as_chat_engine builds, over our retriever
+            query_engine = RetrieverQueryEngine.from_args(retriever, llm=self.llm)
+            chat_engine = AgentRunner.from_llm(
+                tools=[QueryEngineTool.from_defaults(query_engine=query_engine)],
+                llm=self.llm,
+                chat_history=messages,
+                memory=chat_mem,
+                system_prompt=system_prompt
+            )
+        elif mode == ChatMode.CONDENSE_PLUS_CONTEXT:
+            chat_engine = CondensePlusContextChatEngine.from_defaults(
+                retriever=retriever,
+                llm=self.llm,
+                memory=chat_mem,
+                system_prompt=system_prompt,
+                node_postprocessors=[packer],
+                # Nothing to condense against on the first turn
+                skip_condense=not messages
+            )
+        else:
+            chat_engine = ContextChatEngine.from_defaults(
+                retriever=retriever,
+                llm=self.llm,
+                memory=chat_mem,
+                system_prompt=system_prompt,
+                node_postprocessors=[packer]
+            )
         
-        response = chat_engine.chat(
-            message=query_text,
-            chat_history=messages,
+        response = call_with_retries(
+            lambda: chat_engine.chat(
+                message=query_text,
+                chat_history=messages,
+            ),
+            breaker=get_breaker('openai-chat'),
+            retry_on=openai_transient_errors()
         )
         return response
-        
-    
\ No newline at end of file
+
+    def packed_candidates(self, top_k: int) -> int:
+        """Chunks to retrieve for ``top_k`` when the result goes through the ``ContextPacker``."""
+        return top_k * max(1, self.context_overfetch)
+
+    def build_answer_retriever(
+        self,
+        conversation: Conversation,
+        mode: ChatMode,
+        top_k: int
+    ) -> Optional["ChunkMatrixRetriever"]:
+        """Retriever for ``get_answer_nodes`` in ``mode``, or None if there are no active documents."""
+        # The agent's query engine has no packer to trim the candidates
+        return self.build_retriever(
+            conversation, top_k if mode == ChatMode.AGENT else self.packed_candidates(top_k)
+        )
+
+    def build_retriever(self, conversation: Conversation, top_k: int) -> Optional["ChunkMatrixRetriever"]:
+        """Retriever over the conversation's active chunks, or None if there are none."""
+        from services.retriever import ChunkMatrixRetriever
+
+        # The question may already be stored; the chunks do not depend on it
+        with replica_reads(self.db):
+            chunks = self.embedding_service.load_conversation_chunks(conversation.id)
+        if not len(chunks):
+            return None
+        return ChunkMatrixRetriever(chunks, self.embedding_service, similarity_top_k=top_k)
+
+    def prepare_batch(
+        self,
+        conversation: Conversation,
+        questions: List[str],
+        top_k: int = 3
+    ) -> Optional[BatchRetrieval]:
+        """
+        Load everything a batch of questions needs in one go.
+
+        The conversation's chunks are loaded once, all questions are embedded
+        with a single provider call, and the chunks every question retrieves
+        are read in one query, so answering needs no database access.
+
+        Args:
+            conversation (Conversation): Conversation whose documents are searched
+            questions (List[str]): Questions of the batch
+            top_k (int): Number of chunks to cite per question; ``CONTEXT_OVERFETCH``
+                times as many are retrieved for the packer to choose from
+
+        Returns:
+            Optional[BatchRetrieval]: Shared state, or None if there are no active documents
+        """
+        from services.context import ContextPacker
+
+        retriever = self.build_retriever(conversation, self.packed_candidates(top_k))
+        if retriever is None:
+            return None
+        return BatchRetrieval(
+            packer=ContextPacker(token_budget=self.context_token_budget, model=self.llm.model),
+            system_prompt=self.build_system_prompt(conversation),
+            retrieved=retriever.retrieve_many(self.embedding_service.embed_texts(questions)),
+            top_k=top_k
+        )
+
+    async def answer_with_context(
+        self,
+        batch: BatchRetrieval,
+        question: str,
+        nodes: List["NodeWithScore"]
+    ) -> "AgentChatResponse":
+        """Answer over already retrieved chunks with one LLM call."""
+        from llama_index.core.chat_engine.types import AgentChatResponse
+        from llama_index.core.prompts import ChatMessage
+        from llama_index.core.schema import MetadataMode, QueryBundle
+
+        nodes = batch.packer.postprocess_nodes(nodes, query_bundle=QueryBundle(query_str=question))
+        context = "\n\n".join(
+            node.node.get_content(metadata_mode=MetadataMode.LLM) for node in nodes
+        )
+        prompt = [
+            ChatMessage(
+                role="system",
+                content=CONTEXT_PROMPT.format(system_prompt=batch.system_prompt, context=context)
+            ),
+            ChatMessage(role="user", content=question)
+        ]
+        response = await acall_with_retries(
+            lambda: self.llm.achat(prompt),
+            breaker=get_breaker('openai-chat'),
+            retry_on=openai_transient_errors()
+        )
+        return AgentChatResponse(response=response.message.content or "", source_nodes=nodes)
+
+    async def answer_batch(
+        self,
+        batch: BatchRetrieval,
+        questions: List[str],
+        max_concurrency: int = 4
+    ) -> AsyncIterator[Tuple[int, Optional["AgentChatResponse"], Optional[str]]]:
+        """
+        Answer every question of a batch, at most ``max_concurrency`` at a time.
+
+        Yields:
+            Tuple[int, Optional[AgentChatResponse], Optional[str]]: Question index,
+                response and error message, in completion order
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def run(index: int):
+            async with semaphore:
+                try:
+                    with deadline_scope(self.batch_question_timeout, override=True):
+                        return index, await self.answer_with_context(
+                            batch, questions[index], batch.retrieved[index]
+                        ), None
+                except Exception as e:
+                    self.logger.error(f"Batch question {index} failed: {str(e)}")
+                    return index, None, str(e)
+
+        tasks = [asyncio.create_task(run(index)) for index in range(len(questions))]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                yield await finished
+        finally:
+            # Client went away: do not keep spending tokens
+            for task in tasks:
+                task.cancel()
@@ -0,0 +1,127 @@
+from typing import List, Optional
+from functools import lru_cache
+from llama_index.core.bridge.pydantic import Field
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import MetadataMode, NodeWithScore, QueryBundle, TextNode
+import tiktoken
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str) -> tiktoken.Encoding:
+    """Tokenizer for a model, loaded once per process."""
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def find_overlap(left: str, right: str, max_chars: int, min_chars: int = 16, probe: int = 32) -> int:
+    """
+    Length of the longest suffix of ``left`` that is also a prefix of ``right``.
+
+    Only the last ``max_chars`` characters of ``left`` are searched, and
+    overlaps shorter than ``min_chars`` are ignored as coincidental.
+    """
+    if not left or not right:
+        return 0
+    window = max(0, len(left) - max_chars)
+    head = right[:probe]
+    start = left.find(head, window)
+    while start != -1:
+        if right.startswith(left[start:]):
+            return len(left) - start
+        start = left.find(head, start + 1)
+    # Overlaps shorter than the probe cannot contain the whole head
+    for start in range(max(window, len(left) - len(head) + 1), len(left) - min_chars + 1):
+        if right.startswith(left[start:]):
+            return len(left) - start
+    return 0
+
+
+class ContextPacker(BaseNodePostprocessor):
+    """
+    Assemble retrieved chunks into a context that fits a token budget.
+
+    Chunks of the same item that follow each other (same or next page) and
+    share overlapping text are merged so the overlap is only paid once. The
+    merged chunks are then added in relevance order until the budget is used.
+    """
+    token_budget: int = Field(default=3000, description="Maximum context tokens")
+    model: str = Field(default="gpt-4o", description="Model whose tokenizer is used")
+    max_overlap_chars: int = Field(default=4000, description="How far back to look for overlap")
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "ContextPacker"
+
+    def count_tokens(self, node: NodeWithScore) -> int:
+        """Tokens the node costs in the prompt, metadata included."""
+        return len(get_encoding(self.model).encode(
+            node.node.get_content(metadata_mode=MetadataMode.LLM)
+        ))
+
+    def merge_adjacent(self, nodes: List[NodeWithScore]) -> List[NodeWithScore]:
+        """Merge overlapping neighbouring chunks of the same item."""
+        ordered = sorted(
+            nodes,
+            key=lambda n: (
+                n.node.metadata.get('item_id', ''),
+                n.node.metadata.get('page', 0),
+                n.node.metadata.get('chunk_index', 0)
+            )
+        )
+        groups: List[List[NodeWithScore]] = []
+        texts: List[str] = []
+        for node in ordered:
+            text = node.node.get_content()
+            if groups:
+                last = groups[-1][-1].node.metadata
+                metadata = node.node.metadata
+                if last.get('item_id') == metadata.get('item_id') \
+                        and 0 <= metadata.get('page', 0) - last.get('page', 0) <= 1:
+                    overlap = find_overlap(texts[-1], text, self.max_overlap_chars)
+                    if overlap:
+                        groups[-1].append(node)
+                        texts[-1] += text[overlap:]
+                        continue
+            groups.append([node])
+            texts.append(text)
+
+        merged: List[NodeWithScore] = []
+        for group, text in zip(groups, texts):
+            if len(group) == 1:
+                merged.append(group[0])
+                continue
+            best = max(group, key=lambda n: n.score or 0.0)
+            metadata = {
+                **best.node.metadata,
+                'page': group[0].node.metadata.get('page'),
+                'page_end': group[-1].node.metadata.get('page'),
+            }
+            merged.append(NodeWithScore(
+                node=TextNode(
+                    id_=best.node.node_id,
+                    text=text,
+                    metadata=metadata,
+                    excluded_llm_metadata_keys=best.node.excluded_llm_metadata_keys,
+                    excluded_embed_metadata_keys=best.node.excluded_embed_metadata_keys
+                ),
+                score=best.score
+            ))
+        return merged
+
+    def _postprocess_nodes(
+        self,
+        nodes: List[NodeWithScore],
+        query_bundle: Optional[QueryBundle] = None,
+    ) -> List[NodeWithScore]:
+        packed: List[NodeWithScore] = []
+        used = 0
+        for node in sorted(self.merge_adjacent(nodes), key=lambda n: n.score or 0.0, reverse=True):
+            tokens = self.count_tokens(node)
+            if used + tokens > self.token_budget:
+                # Smaller, less relevant chunks may still fit
+                continue
+            packed.append(node)
+            used += tokens
+        return packed
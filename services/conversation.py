@@ -1,10 +1,29 @@
 from typing import Optional
+from sqlalchemy import bindparam, func, select, update
 from sqlalchemy.orm import Session
-from models import Conversation
+from models import Conversation, Embedding, Item
+from models.conversation import LAST_MESSAGE_PREVIEW_CHARS
 from models.schemas import ConversationCreate
 from uuid import UUID
 import logging
 from datetime import datetime
+from utils.cache import from_row, get_cache, to_row
+from utils.invalidation import CONVERSATION, USER_CONVERSATIONS, invalidation_bus, publish
+from utils.routing import replica_staleness
+
+# Built once so the compiled form is reused from the engine's statement cache
+CONVERSATION_BY_ID = select(Conversation).where(
+    Conversation.id == bindparam('conversation_id'),
+    Conversation.user_id == bindparam('user_id')
+).limit(1)
+
+# Conversation rows by id, and the rows of a user's conversations by user id
+conversation_cache = get_cache("conversation")
+user_conversations_cache = get_cache("user_conversations")
+invalidation_bus.subscribe(CONVERSATION, conversation_cache.delete)
+invalidation_bus.subscribe(USER_CONVERSATIONS, user_conversations_cache.delete)
+invalidation_bus.on_reset(conversation_cache.reset)
+invalidation_bus.on_reset(user_conversations_cache.reset)
 
 class ConversationService:
     def __init__(self, session: Session):
@@ -30,6 +49,7 @@ class ConversationService:
                 updated_at=datetime.now()
             )
             self.session.add(conversation)
+            publish(self.session, USER_CONVERSATIONS, user_id)
             self.session.commit()
             self.session.refresh(conversation)
             
@@ -51,10 +71,16 @@ class ConversationService:
         Returns:
             list[Conversation]: List of conversations
         """
-        return self.session.query(Conversation)\
+        rows = user_conversations_cache.get(user_id)
+        if rows is not None:
+            return [from_row(self.session, Conversation, row) for row in rows]
+        fill = user_conversations_cache.begin_fill(replica_staleness(self.session))
+        conversations = self.session.query(Conversation)\
             .filter(Conversation.user_id == user_id)\
             .order_by(Conversation.created_at.desc())\
             .all()
+        user_conversations_cache.fill(fill, user_id, [to_row(conversation) for conversation in conversations])
+        return conversations
 
     def get_conversation(self, conversation_id: UUID, user_id: UUID) -> Optional[Conversation]:
         """
@@ -67,11 +93,19 @@ class ConversationService:
         Returns:
             Optional[Conversation]: Conversation if found and owned by user, None otherwise
         """
-        return self.session.query(Conversation)\
-            .filter(
-                Conversation.id == conversation_id,
-                Conversation.user_id == user_id
-            ).first() 
+        row = conversation_cache.get(conversation_id)
+        if row is not None:
+            if row['user_id'] != str(user_id):
+                return None
+            return from_row(self.session, Conversation, row)
+        fill = conversation_cache.begin_fill(replica_staleness(self.session))
+        conversation = self.session.execute(
+            CONVERSATION_BY_ID,
+            {'conversation_id': conversation_id, 'user_id': user_id}
+        ).scalars().first()
+        if conversation is not None:
+            conversation_cache.fill(fill, conversation_id, to_row(conversation))
+        return conversation
             
     def get_user_conversations_by_title(self, user_id: UUID, title: str) -> list[Conversation]:
         """
@@ -108,6 +142,8 @@ class ConversationService:
             conversation.title = data.title
             conversation.context = data.context
             conversation.updated_at = datetime.now()
+            publish(self.session, CONVERSATION, conversation.id)
+            publish(self.session, USER_CONVERSATIONS, conversation.user_id)
             self.session.commit()
             self.session.refresh(conversation)
             
@@ -120,6 +156,68 @@ class ConversationService:
             return None
     
     
+    def record_message(self, conversation: Conversation, content: str) -> None:
+        """
+        Count a new message in the conversation's listing stats.
+
+        Runs in the caller's transaction, before it commits the message.
+
+        Args:
+            conversation (Conversation): Conversation the message was added to
+            content (str): Text of the message
+        """
+        self.session.execute(
+            update(Conversation)
+            .where(Conversation.id == conversation.id)
+            .values(
+                message_count=Conversation.message_count + 1,
+                last_message_at=func.now(),
+                last_message_preview=content[:LAST_MESSAGE_PREVIEW_CHARS],
+                # New messages are not edits of the conversation
+                updated_at=Conversation.updated_at
+            )
+            .execution_options(synchronize_session=False)
+        )
+        publish(self.session, CONVERSATION, conversation.id)
+        publish(self.session, USER_CONVERSATIONS, conversation.user_id)
+
+    def refresh_stats(self, conversation_id: UUID) -> None:
+        """
+        Recompute the listing stats of a conversation from its rows.
+
+        Runs in the caller's transaction, after its item or chunk changes.
+        The conversation row is locked first so concurrent refreshes see each
+        other's committed changes instead of overwriting them.
+
+        Message stats are maintained incrementally by ``record_message``.
+
+        Args:
+            conversation_id (UUID): Conversation to refresh
+        """
+        user_id = self.session.execute(
+            select(Conversation.user_id)
+            .where(Conversation.id == conversation_id)
+            .with_for_update()
+        ).scalar()
+        if user_id is None:
+            return
+        values = {
+            'active_item_count': select(func.count(Item.id))
+                .where(Item.conversation_id == conversation_id, Item.active)
+                .scalar_subquery(),
+            'chunk_count': select(func.count(Embedding.id))
+                .where(Embedding.conversation_id == conversation_id, Embedding.item_active)
+                .scalar_subquery(),
+        }
+        self.session.execute(
+            update(Conversation)
+            .where(Conversation.id == conversation_id)
+            .values(**values, updated_at=Conversation.updated_at)
+            .execution_options(synchronize_session=False)
+        )
+        publish(self.session, CONVERSATION, conversation_id)
+        publish(self.session, USER_CONVERSATIONS, user_id)
+
     def delete_conversation(self, conversation: Conversation) -> None:
         """
         Delete a conversation.
@@ -129,6 +227,8 @@ class ConversationService:
         """
         try:
             self.session.delete(conversation)
+            publish(self.session, CONVERSATION, conversation.id)
+            publish(self.session, USER_CONVERSATIONS, conversation.user_id)
             self.session.commit()
             self.logger.info(f"Deleted conversation: {conversation.id}")
         except Exception as e:
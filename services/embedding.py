@@ -1,13 +1,135 @@
-from typing import List, Optional
-from llama_index.embeddings.openai import OpenAIEmbedding
-from llama_index.core.text_splitter import SentenceSplitter
-from llama_index.core.schema import TextNode
+from typing import Collection, Dict, Iterator, List, Optional, Sequence, Tuple, TYPE_CHECKING
 from sqlalchemy.orm import Session
+from sqlalchemy import LargeBinary, bindparam, delete, func, insert, select, text
+from dataclasses import dataclass
+from datetime import datetime
+import hashlib
 import logging
 import uuid
+import numpy as np
 from models.embedding import Embedding
 from models.item import Item
+from services.conversation import ConversationService
 from services.item import ItemService
+from schemas.item import UploadProgress
+from schemas.search import SearchResult
+from utils.cache import get_cache
+from utils.invalidation import CONVERSATION_DOCUMENTS, invalidation_bus, publish
+from utils.parsing import chunk_pdf, count_pdf_pages, iter_pdf_chunks
+from utils.resilience import (
+    call_with_retries,
+    deadline_scope,
+    get_breaker,
+    openai_transient_errors,
+    timeout_for,
+)
+from utils.routing import replica_staleness
+import os
+
+if TYPE_CHECKING:
+    from llama_index.core.schema import BaseNode, TextNode
+
+
+NODE_INTERNAL_METADATA_KEYS = ["id", "item_id", "item_uri", "chunk_index"]
+
+# pgvector >= 0.8 keeps walking the HNSW graph until filtered queries have enough rows
+SEARCH_ITERATIVE_SCAN = os.getenv("SEARCH_ITERATIVE_SCAN", "strict_order")
+
+# Same digest as compute_chunk_hash, for rows stored before chunks were hashed
+CHUNK_TEXT_HASH = func.encode(func.sha256(func.convert_to(Embedding.chunk_text, 'UTF8')), 'hex')
+
+# Built once so the compiled form is reused from the engine's statement cache
+CONVERSATION_CHUNKS = select(Embedding).where(
+    Embedding.conversation_id == bindparam('conversation_id'),
+    Embedding.item_active
+)
+
+# Retrieval only needs the vectors up front; pgvector's binary form skips text parsing
+CONVERSATION_CHUNK_VECTORS = select(
+    Embedding.id,
+    Embedding.item_id,
+    Embedding.page,
+    Embedding.chunk_index,
+    func.vector_send(Embedding.embedding, type_=LargeBinary)
+).where(
+    Embedding.conversation_id == bindparam('conversation_id'),
+    Embedding.item_active,
+    Embedding.embedding.is_not(None)
+)
+
+# Text and item details of the chunks a retrieval picked
+CHUNK_DETAILS = select(
+    Embedding.id,
+    Embedding.chunk_text,
+    Item.uri,
+    Item.file_name
+).join(Item, Item.id == Embedding.item_id).where(
+    Embedding.id.in_(bindparam('ids', expanding=True))
+)
+
+# Active chunks of a conversation without their text, vectors as one float32 matrix
+conversation_vectors_cache = get_cache("conversation_chunk_vectors")
+invalidation_bus.subscribe(CONVERSATION_DOCUMENTS, conversation_vectors_cache.delete)
+invalidation_bus.on_reset(conversation_vectors_cache.reset)
+
+
+@dataclass
+class ChunkMatrix:
+    """Active chunks of a conversation; row ``i`` of ``vectors`` belongs to ``ids[i]``."""
+    conversation_id: uuid.UUID
+    ids: List[uuid.UUID]
+    item_ids: List[uuid.UUID]
+    pages: List[int]
+    chunk_indexes: List[int]
+    vectors: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+def vectors_from_binary(values: Sequence[bytes]) -> np.ndarray:
+    """
+    Decode pgvector values in binary send format into one float32 matrix.
+
+    Each value is a 2-byte dimension count, 2 unused bytes and the components
+    as big-endian float32. Seen as big-endian float32 the header is one extra
+    leading column, which is dropped while copying into the result.
+
+    Args:
+        values (Sequence[bytes]): Output of ``vector_send``, all of one dimension
+
+    Returns:
+        np.ndarray: Matrix of shape (len(values), dimensions)
+    """
+    if not len(values):
+        return np.empty((0, 0), dtype=np.float32)
+    dimensions = int.from_bytes(bytes(values[0][:2]), 'big')
+    raw = b"".join(values)
+    if len(raw) != len(values) * 4 * (dimensions + 1):
+        raise ValueError("Vectors do not all have the same dimension")
+    matrix = np.empty((len(values), dimensions), dtype=np.float32)
+    matrix[...] = np.frombuffer(raw, dtype='>f4').reshape(len(values), dimensions + 1)[:, 1:]
+    return matrix
+
+
+class EmbeddingModelUnavailable(Exception):
+    """Embeddings are needed but no embedding model is configured."""
+
+
+def supports_iterative_scan(db: Session) -> bool:
+    """Whether the installed pgvector has ``hnsw.iterative_scan``; remembered per connection."""
+    info = db.connection().info
+    if 'iterative_scan' not in info:
+        version = db.execute(text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")).scalar()
+        parts = tuple(int(part) for part in (version or '0').split('.')[:2] if part.isdigit())
+        info['iterative_scan'] = parts >= (0, 8)
+    return info['iterative_scan']
+
+
+def compute_chunk_hash(text: str) -> str:
+    """Return the SHA-256 hex digest used to detect changed chunks."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
 
 class EmbeddingService:
     def __init__(self, 
@@ -25,50 +147,466 @@ class EmbeddingService:
             chunk_overlap (int): Number of overlapping tokens between chunks
         """
         self.logger = logging.getLogger(self.__class__.__name__)
-        self.embed_model = OpenAIEmbedding(api_key=openai_api_key) if openai_api_key else None 
-        self.text_splitter = SentenceSplitter(
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_overlap
-        )
+        self.openai_api_key = openai_api_key
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.openai_timeout = float(os.getenv("OPENAI_TIMEOUT", "30"))
+        self.ingest_batch_size = int(os.getenv("INGEST_BATCH_CHUNKS", "100"))
+        self.ingest_batch_timeout = float(os.getenv("INGEST_BATCH_TIMEOUT", "60"))
+        self._embed_model = None
+        self._text_splitter = None
         self.db = db
         self.item_service = ItemService(db)
+
+    @property
+    def embed_model(self):
+        """OpenAI embedding model, imported and built on first use."""
+        if self._embed_model is None and self.openai_api_key:
+            from llama_index.embeddings.openai import OpenAIEmbedding
+            self._embed_model = OpenAIEmbedding(
+                api_key=self.openai_api_key,
+                # Bounded by the request deadline; retries go through embed_texts
+                timeout=timeout_for(self.openai_timeout),
+                max_retries=0
+            )
+        return self._embed_model
+
+    def require_embed_model(self):
+        """
+        The embedding model, for callers that cannot do without it.
+
+        Raises:
+            EmbeddingModelUnavailable: If ``OPENAI_API_KEY`` is not configured
+        """
+        if self.embed_model is None:
+            raise EmbeddingModelUnavailable("No embedding model is configured")
+        return self.embed_model
+
+    def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts in as few provider calls as possible, with breaker and retries."""
+        self.require_embed_model()
+        return call_with_retries(
+            lambda: self.embed_model.get_text_embedding_batch(texts),
+            breaker=get_breaker('openai-embedding'),
+            retry_on=openai_transient_errors()
+        )
+
+    def embed_query(self, query: str) -> List[float]:
+        """Embed a search query, with breaker and retries."""
+        self.require_embed_model()
+        return call_with_retries(
+            lambda: self.embed_model.get_query_embedding(query),
+            breaker=get_breaker('openai-embedding'),
+            retry_on=openai_transient_errors()
+        )
+
+    @property
+    def text_splitter(self):
+        """Sentence splitter, imported and built on first use."""
+        if self._text_splitter is None:
+            from llama_index.core.text_splitter import SentenceSplitter
+            self._text_splitter = SentenceSplitter(
+                chunk_size=self.chunk_size,
+                chunk_overlap=self.chunk_overlap
+            )
+        return self._text_splitter
+
+    def chunk_pdf(self, path: str) -> List["TextNode"]:
+        """
+        Parse and chunk a PDF on local disk, spreading pages over the parse pool.
+
+        Args:
+            path (str): Path of the PDF
+
+        Returns:
+            List[TextNode]: Chunks in document order, with the page in ``page_label``
+        """
+        return chunk_pdf(path, self.chunk_size, self.chunk_overlap)
         
+    def resync_pdf(self, item: Item, path: str) -> dict:
+        """
+        Re-chunk a new version of an item's PDF and sync its stored chunks.
+
+        Only chunks whose text changed are embedded again, see
+        ``sync_item_embeddings``.
+
+        Args:
+            item (Item): The item the document belongs to
+            path (str): Path of the new PDF on local disk
+
+        Returns:
+            dict: Summary of the operation
+        """
+        return self.sync_item_embeddings(item, self.chunk_pdf(path))
+
+    def ingest_pdf(self, item: Item, path: str) -> Iterator[UploadProgress]:
+        """
+        Chunk, embed and store a PDF in page order, one batch of chunks at a time.
+
+        Pages come from the parse pool as they are ready and every batch of
+        ``INGEST_BATCH_CHUNKS`` chunks is embedded in one call and inserted in
+        its own transaction, so memory does not grow with the document size.
+        Rows take the item's current ``active`` flag; callers ingest into an
+        inactive item and activate it once every batch is stored.
+
+        Args:
+            item (Item): The item the document belongs to
+            path (str): Path of the PDF on local disk
+
+        Yields:
+            UploadProgress: Progress after every stored batch
+        """
+        pages_total = count_pdf_pages(path)
+        # Read once: committing a batch expires the item's attributes
+        item_id = item.id
+        columns = {
+            'item_id': item_id,
+            'conversation_id': item.conversation_id,
+            'owner_id': item.owner_id,
+            'item_active': bool(item.active)
+        }
+        yield UploadProgress(status="parsing", item_id=item_id, pages_total=pages_total, pages_done=0, chunks_done=0)
+
+        chunks_done = 0
+        batch: List[Tuple[int, int, str]] = []
+        for page, chunks in iter_pdf_chunks(
+            path, self.chunk_size, self.chunk_overlap, page_count=pages_total
+        ):
+            batch.extend((page, chunk_index, text) for chunk_index, text in enumerate(chunks))
+            if len(batch) < self.ingest_batch_size and page < pages_total:
+                continue
+            if batch:
+                self._store_chunk_batch(columns, batch)
+                chunks_done += len(batch)
+                batch = []
+            yield UploadProgress(
+                status="embedding",
+                item_id=item_id,
+                pages_total=pages_total,
+                pages_done=page,
+                chunks_done=chunks_done
+            )
+
+    def _store_chunk_batch(self, columns: dict, batch: List[Tuple[int, int, str]]) -> None:
+        """Embed one batch of (page, chunk_index, text) and insert it, with the shared ``columns``, in its own transaction."""
+        # Each batch gets its own budget; the whole document may take far longer than a request
+        with deadline_scope(self.ingest_batch_timeout, override=True):
+            vectors = self.embed_texts([text for _, _, text in batch])
+            try:
+                # Core insert: no ORM objects pile up in the session
+                self.db.execute(insert(Embedding), [
+                    {
+                        **columns,
+                        'page': page,
+                        'chunk_index': chunk_index,
+                        'chunk_text': text,
+                        'content_hash': compute_chunk_hash(text),
+                        'embedding': vector
+                    }
+                    for (page, chunk_index, text), vector in zip(batch, vectors)
+                ])
+                self.db.commit()
+            except Exception:
+                self.db.rollback()
+                raise
+
     def get_conversation_embeddings(self, conversation_id: uuid.UUID) -> List[Embedding]:
         """
-        Get all embeddings for a conversation.
+        Get all embeddings for a conversation as full ORM objects.
+
+        Retrieval uses ``load_conversation_chunks`` instead, which skips the
+        text and ORM state.
+        """
+        return self.db.execute(
+            CONVERSATION_CHUNKS, {'conversation_id': conversation_id}
+        ).scalars().all()
+
+    def load_conversation_chunks(self, conversation_id: uuid.UUID) -> ChunkMatrix:
+        """
+        Load the active chunks of a conversation for retrieval, without their text.
+
+        Only ids, positions and vectors are read; the vectors arrive in
+        pgvector's binary format and are decoded into one float32 matrix.
+        Served from the shared cache when possible.
+
+        Args:
+            conversation_id (uuid.UUID): Conversation whose chunks are loaded
+
+        Returns:
+            ChunkMatrix: The chunks, possibly empty
+        """
+        cached = conversation_vectors_cache.get(conversation_id)
+        if cached is not None:
+            return ChunkMatrix(
+                conversation_id=conversation_id,
+                ids=[uuid.UUID(embedding_id) for embedding_id in cached['ids']],
+                item_ids=[uuid.UUID(item_id) for item_id in cached['item_ids']],
+                pages=cached['pages'],
+                chunk_indexes=cached['chunk_indexes'],
+                vectors=cached['vectors']
+            )
+        fill = conversation_vectors_cache.begin_fill(replica_staleness(self.db))
+        rows = self.db.execute(
+            CONVERSATION_CHUNK_VECTORS, {'conversation_id': conversation_id}
+        ).all()
+        chunks = ChunkMatrix(
+            conversation_id=conversation_id,
+            ids=[row[0] for row in rows],
+            item_ids=[row[1] for row in rows],
+            pages=[row[2] for row in rows],
+            chunk_indexes=[row[3] for row in rows],
+            vectors=vectors_from_binary([row[4] for row in rows])
+        )
+        conversation_vectors_cache.fill(fill, conversation_id, {
+            'ids': chunks.ids,
+            'item_ids': chunks.item_ids,
+            'pages': chunks.pages,
+            'chunk_indexes': chunks.chunk_indexes,
+            'vectors': chunks.vectors
+        })
+        return chunks
+
+    def load_chunk_nodes(self, chunks: ChunkMatrix, rows: Collection[int]) -> Dict[int, "TextNode"]:
         """
-        return self.db \
-            .query(Embedding) \
-            .filter(
-                Embedding.conversation_id == conversation_id,
-                Embedding.item.has(Item.active)
-            ).all()
+        Build nodes for some rows of a chunk matrix, loading only their text.
+
+        Args:
+            chunks (ChunkMatrix): Chunks the rows refer to
+            rows (Collection[int]): Row positions in ``chunks``
+
+        Returns:
+            Dict[int, TextNode]: Nodes by row; chunks deleted since loading are missing
+        """
+        from llama_index.core.schema import TextNode
+
+        if not rows:
+            return {}
+        details = {
+            row.id: row
+            for row in self.db.execute(CHUNK_DETAILS, {'ids': [chunks.ids[row] for row in rows]})
+        }
+        nodes: Dict[int, TextNode] = {}
+        for row in rows:
+            detail = details.get(chunks.ids[row])
+            if detail is None:
+                continue
+            nodes[row] = TextNode(
+                id=str(detail.id),
+                text=detail.chunk_text,
+                metadata={
+                    "id": str(detail.id),
+                    "item_id": str(chunks.item_ids[row]),
+                    "item_uri": detail.uri,
+                    "item_name": detail.file_name,
+                    'page': chunks.pages[row],
+                    'chunk_index': chunks.chunk_indexes[row],
+                },
+                excluded_llm_metadata_keys=NODE_INTERNAL_METADATA_KEYS,
+                excluded_embed_metadata_keys=NODE_INTERNAL_METADATA_KEYS
+            )
+        return nodes
     
+    def search_owner_chunks(
+        self,
+        owner_id: uuid.UUID,
+        query: str,
+        limit: int = 10,
+        offset: int = 0,
+        mime_types: Optional[List[str]] = None,
+        item_ids: Optional[List[uuid.UUID]] = None
+    ) -> List[SearchResult]:
+        """
+        Semantic search over all active chunks of one owner, across conversations.
+
+        The owner and active filters are columns of ``embeddings`` so they are
+        applied inside the HNSW index scan rather than after a join. With
+        pgvector >= 0.8 the scan continues until the page is full
+        (``SEARCH_ITERATIVE_SCAN``); older versions stop after ``hnsw.ef_search``
+        candidates, so a short page is recomputed with an exact scan.
+
+        Args:
+            owner_id (uuid.UUID): Owner whose documents are searched
+            query (str): Natural language query
+            limit (int): Page size
+            offset (int): Number of results to skip
+            mime_types (Optional[List[str]]): Only search items of these MIME types
+            item_ids (Optional[List[uuid.UUID]]): Only search these items
+
+        Returns:
+            List[SearchResult]: Matches ordered by descending cosine similarity
+
+        Raises:
+            EmbeddingModelUnavailable: If no embedding model is configured
+        """
+        query_vector = self.embed_query(query)
+        distance = Embedding.embedding.cosine_distance(query_vector)
+        statement = select(
+            Embedding.id,
+            Embedding.item_id,
+            Embedding.conversation_id,
+            Embedding.page,
+            Embedding.chunk_text,
+            Item.file_name,
+            Item.mime_type,
+            Item.uri,
+            (1 - distance).label('score')
+        ).join(Item, Item.id == Embedding.item_id).where(
+            Embedding.owner_id == owner_id,
+            Embedding.item_active
+        )
+        if mime_types:
+            statement = statement.where(Item.mime_type.in_(mime_types))
+        if item_ids:
+            statement = statement.where(Embedding.item_id.in_(item_ids))
+
+        # The index scan must produce enough candidates for the requested page
+        self.db.execute(select(func.set_config(
+            'hnsw.ef_search', str(max(40, offset + limit)), True
+        )))
+        iterative_scan = SEARCH_ITERATIVE_SCAN != 'off' and supports_iterative_scan(self.db)
+        if iterative_scan:
+            self.db.execute(select(func.set_config('hnsw.iterative_scan', SEARCH_ITERATIVE_SCAN, True)))
+
+        rows = self.db.execute(statement.order_by(distance).offset(offset).limit(limit)).all()
+        if len(rows) < limit and not iterative_scan:
+            # The filters may have discarded every candidate the graph scan
+            # produced; an ordering the index cannot serve makes the scan exact
+            rows = self.db.execute(statement.order_by(distance + 0).offset(offset).limit(limit)).all()
+
+        return [
+            SearchResult(
+                embedding_id=row.id,
+                item_id=row.item_id,
+                conversation_id=row.conversation_id,
+                item_name=row.file_name,
+                mime_type=row.mime_type,
+                uri=row.uri,
+                page=row.page,
+                text=row.chunk_text,
+                score=row.score
+            )
+            for row in rows
+        ]
+
     def get_embedding(self, embedding_id: uuid.UUID) -> Embedding:
         """
         Get an embedding by ID.
         """
         return self.db.query(Embedding).get({'id': embedding_id})
     
-    def parse_embeddings_to_nodes(self, embeddings: List[Embedding]) -> List[TextNode]:
-        """
-        Parse embeddings to nodes.
-        """
-        nodes: List[TextNode] = []
-        item = self.item_service.get_item_by_id_only(embeddings[0].item_id)
-        for embedding in embeddings:
-            nodes.append(
-                TextNode(
-                    id=embedding.id,
-                    text=embedding.chunk_text,
-                    embedding=embedding.embedding,
-                    metadata={
-                        "id": str(embedding.id),
-                        "item_id": str(item.id),
-                        "item_uri": item.uri,
-                        "item_name": item.file_name,
-                        'page': embedding.page,
-                    }
+    def get_node_slots(self, nodes: List["BaseNode"]) -> List[Tuple[int, int, str]]:
+        """
+        Assign each chunk its (page, chunk_index) slot.
+
+        Args:
+            nodes (List[BaseNode]): Chunks in document order, with the page in
+                the ``page_label`` metadata like ``DatabaseManager.insert_document``
+
+        Returns:
+            List[Tuple[int, int, str]]: (page, chunk_index, text) per chunk
+        """
+        slots: List[Tuple[int, int, str]] = []
+        next_index: Dict[int, int] = {}
+        for node in nodes:
+            page = int(node.metadata.get('page_label', -1))
+            chunk_index = next_index.get(page, 0)
+            next_index[page] = chunk_index + 1
+            slots.append((page, chunk_index, node.get_content()))
+        return slots
+
+    def sync_item_embeddings(self, item: Item, nodes: List["BaseNode"]) -> dict:
+        """
+        Re-sync the stored chunks of an item against a fresh chunking.
+
+        Chunks are matched by content hash: unchanged chunks are kept (and
+        moved to their new slot if needed), only new or edited chunks are
+        embedded, and stored chunks that no longer exist are deleted. Rows
+        stored before chunks were hashed are hashed from their text and get
+        the hash written back. All of it happens in a single transaction.
+
+        Args:
+            item (Item): The item whose document changed
+            nodes (List[BaseNode]): The new chunks of the document in order
+
+        Returns:
+            dict: Summary of the operation
+        """
+        stored = self.db.query(
+            Embedding.id,
+            Embedding.page,
+            Embedding.chunk_index,
+            func.coalesce(Embedding.content_hash, CHUNK_TEXT_HASH).label('content_hash'),
+            Embedding.content_hash.is_(None).label('unhashed')
+        ).filter(Embedding.item_id == item.id).all()
+
+        stored_by_hash: Dict[str, List] = {}
+        for row in stored:
+            stored_by_hash.setdefault(row.content_hash, []).append(row)
+
+        moved: List[dict] = []
+        pending: List[Tuple[int, int, str, str]] = []
+        unchanged = 0
+        for page, chunk_index, chunk_text in self.get_node_slots(nodes):
+            content_hash = compute_chunk_hash(chunk_text)
+            candidates = stored_by_hash.get(content_hash)
+            if candidates:
+                row = candidates.pop()
+                if (row.page, row.chunk_index) != (page, chunk_index) or row.unhashed:
+                    moved.append({'id': row.id, 'page': page, 'chunk_index': chunk_index, 'content_hash': content_hash})
+                else:
+                    unchanged += 1
+            else:
+                pending.append((page, chunk_index, chunk_text, content_hash))
+
+        stale_ids = [row.id for rows in stored_by_hash.values() for row in rows]
+
+        try:
+            vectors = []
+            for start in range(0, len(pending), self.ingest_batch_size):
+                # Each batch gets its own budget, like ingest_pdf
+                with deadline_scope(self.ingest_batch_timeout, override=True):
+                    vectors.extend(self.embed_texts([
+                        chunk_text for _, _, chunk_text, _ in pending[start:start + self.ingest_batch_size]
+                    ]))
+            if stale_ids:
+                self.db.execute(
+                    delete(Embedding)
+                    .where(Embedding.id.in_(stale_ids))
+                    .execution_options(synchronize_session=False)
                 )
-            )
-        return nodes
+            if moved:
+                self.db.bulk_update_mappings(Embedding, moved)
+            self.db.add_all([
+                Embedding(
+                    item_id=item.id,
+                    conversation_id=item.conversation_id,
+                    owner_id=item.owner_id,
+                    page=page,
+                    chunk_index=chunk_index,
+                    chunk_text=chunk_text,
+                    content_hash=content_hash,
+                    embedding=vector,
+                    item_active=bool(item.active)
+                )
+                for (page, chunk_index, chunk_text, content_hash), vector in zip(pending, vectors)
+            ])
+            item.last_updated = datetime.now()
+            self.db.flush()
+            ConversationService(self.db).refresh_stats(item.conversation_id)
+            publish(self.db, CONVERSATION_DOCUMENTS, item.conversation_id)
+            self.db.commit()
+        except Exception as e:
+            self.db.rollback()
+            self.logger.error(f"Failed to sync embeddings for item {item.id}: {str(e)}")
+            raise
+
+        self.logger.info(
+            f"Synced item {item.id}: {len(pending)} embedded, {len(moved)} moved, "
+            f"{len(stale_ids)} deleted, {unchanged} unchanged"
+        )
+        return {
+            "embedded_count": len(pending),
+            "moved_count": len(moved),
+            "deleted_count": len(stale_ids),
+            "unchanged_count": unchanged
+        }
@@ -1,14 +1,41 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_, desc
+from sqlalchemy import and_, or_, bindparam, desc, select, update, delete, func
 from models.item import Item
+from models.embedding import Embedding
 from models.user import User
 from models.conversation import Conversation
-from typing import List, Optional
+from typing import Dict, Iterable, List, Optional, Tuple
+from uuid import UUID
+from dataclasses import dataclass
 from datetime import datetime
+from services.conversation import ConversationService
+from utils.invalidation import CONVERSATION_DOCUMENTS, publish
+
+# Built once so the compiled form is reused from the engine's statement cache
+ITEM_METADATA = select(
+    Item.id,
+    Item.file_name,
+    Item.uri,
+    Item.mime_type,
+    Item.last_updated
+).where(Item.id.in_(bindparam('ids', expanding=True)))
+
+
+@dataclass
+class ItemMetadata:
+    """What sources and citations show about an item."""
+    id: UUID
+    file_name: str
+    uri: str
+    mime_type: Optional[str]
+    last_updated: Optional[datetime]
+
 
 class ItemService:
     def __init__(self, session: Session):
         self.session = session
+        # Metadata looked up by this (request-scoped) service, by item id
+        self._item_metadata: Dict[UUID, ItemMetadata] = {}
 
     def get_item_by_id_only(self, item_id: str) -> Optional[Item]:
         """Get a single item by ID"""
@@ -17,6 +44,34 @@ class ItemService:
         item = query.first()
         return item
 
+    def get_item_metadata(self, item_ids: Iterable[UUID]) -> Dict[UUID, ItemMetadata]:
+        """
+        Metadata of several items, read in one query.
+
+        Items already looked up through this service are not read again.
+
+        Args:
+            item_ids (Iterable[UUID]): Items to describe, duplicates allowed
+
+        Returns:
+            Dict[UUID, ItemMetadata]: Metadata by item id; unknown ids are missing
+        """
+        item_ids = set(item_ids)
+        missing = [item_id for item_id in item_ids if item_id not in self._item_metadata]
+        if missing:
+            for row in self.session.execute(ITEM_METADATA, {'ids': missing}):
+                self._item_metadata[row.id] = ItemMetadata(
+                    id=row.id,
+                    file_name=row.file_name,
+                    uri=row.uri,
+                    mime_type=row.mime_type,
+                    last_updated=row.last_updated
+                )
+        return {
+            item_id: self._item_metadata[item_id]
+            for item_id in item_ids if item_id in self._item_metadata
+        }
+
     def get_item_by_id(self, owner: User, item_id: str) -> Optional[Item]:
         """Get a single item by ID"""
         filters = [Item.id == item_id, Item.owner_id == owner.id]
@@ -46,6 +101,13 @@ class ItemService:
         result = query.all()
         return result
 
+    def get_conversation_document_state(self, conversation_id: UUID) -> Tuple[int, Optional[datetime]]:
+        """Count and latest update time of the active items in a conversation, a cheap version stamp of its documents"""
+        return tuple(self.session.execute(
+            select(func.count(Item.id), func.max(Item.last_updated))
+            .where(Item.conversation_id == conversation_id, Item.active)
+        ).one())
+
     def search_items(self, 
                     search_term: str, 
                     owner: User,
@@ -88,7 +150,8 @@ class ItemService:
                    mime_type: str,
                    uri: str,
                    owner: str,
-                   conversation_id: str) -> Item:
+                   conversation_id: str,
+                   active: bool = True) -> Item:
         """Create a new item"""
         item = Item(
             file_name=file_name,
@@ -97,9 +160,13 @@ class ItemService:
             owner=owner,
             conversation_id=conversation_id,
             last_updated=datetime.now(),
-            active=True
+            active=active
         )
         self.session.add(item)
+        if active:
+            self.session.flush()
+            ConversationService(self.session).refresh_stats(conversation_id)
+            publish(self.session, CONVERSATION_DOCUMENTS, conversation_id)
         self.session.commit()
         return item
 
@@ -109,7 +176,13 @@ class ItemService:
             if hasattr(item, key):
                 setattr(item, key, value)
                 
+        if 'active' in kwargs:
+            self._sync_embeddings_active([item.id], bool(item.active))
+            self.session.flush()
+            ConversationService(self.session).refresh_stats(item.conversation_id)
         item.last_updated = datetime.now()
+        self._item_metadata.pop(item.id, None)
+        publish(self.session, CONVERSATION_DOCUMENTS, item.conversation_id)
         self.session.commit()
         return item
 
@@ -122,6 +195,11 @@ class ItemService:
         # Soft delete - just mark as inactive
         item.active = False
         item.last_updated = datetime.now()
+        self._sync_embeddings_active([item.id], False)
+        self.session.flush()
+        ConversationService(self.session).refresh_stats(item.conversation_id)
+        self._item_metadata.pop(item.id, None)
+        publish(self.session, CONVERSATION_DOCUMENTS, item.conversation_id)
         self.session.commit()
         return True
 
@@ -132,44 +210,91 @@ class ItemService:
             return False
             
         self.session.delete(item)
+        self.session.flush()
+        ConversationService(self.session).refresh_stats(item.conversation_id)
+        self._item_metadata.pop(item.id, None)
+        publish(self.session, CONVERSATION_DOCUMENTS, item.conversation_id)
         self.session.commit()
         return True
 
-    def delete_conversation_items(self, conversation: Conversation, owner: User, permanent: bool = False) -> dict:
+    def delete_conversation_items(
+        self,
+        conversation: Conversation,
+        owner: User,
+        permanent: bool = False,
+        batch_size: int = 500
+    ) -> dict:
         """
         Delete all items in a conversation
         
+        Runs set-based statements in batches of ``batch_size`` items, each in
+        its own short transaction. Permanent deletes rely on the database's
+        ``ON DELETE CASCADE`` to remove embeddings instead of loading them.
+        
         Args:
             conversation (Conversation): The conversation whose items should be deleted
             owner (User): The owner of the items
             permanent (bool): If True, permanently delete items. If False, soft delete
+            batch_size (int): Maximum number of items touched per statement
             
         Returns:
             dict: Summary of the operation
         """
-        # Query items that belong to both the conversation and owner
-        query = self.session.query(Item).filter(
+        filters = [
             Item.conversation_id == conversation.id,
             Item.owner_id == owner.id
-        )
-        
-        items = query.all()
-        if not items:
-            return {"message": "No items found", "deleted_count": 0}
-            
+        ]
+        if not permanent:
+            # Only pick rows that still need the update so every batch makes progress
+            filters.append(Item.active.isnot(False))
+        batch = select(Item.id).where(*filters).limit(batch_size).scalar_subquery()
+
+        if permanent:
+            statement = delete(Item).where(Item.id.in_(batch))
+        else:
+            statement = update(Item).where(Item.id.in_(batch)).values(
+                active=False,
+                last_updated=func.now()
+            )
+        statement = statement.returning(Item.id).execution_options(synchronize_session=False)
+
         count = 0
-        for item in items:
-            if permanent:
-                self.session.delete(item)
-            else:
-                item.active = False
-                item.last_updated = datetime.now()
-            count += 1
-            
-        self.session.commit()
-        
+        try:
+            while True:
+                item_ids = self.session.execute(statement).scalars().all()
+                if item_ids and not permanent:
+                    self._sync_embeddings_active(item_ids, False)
+                for item_id in item_ids:
+                    self._item_metadata.pop(item_id, None)
+                affected = len(item_ids)
+                if affected:
+                    ConversationService(self.session).refresh_stats(conversation.id)
+                    publish(self.session, CONVERSATION_DOCUMENTS, conversation.id)
+                self.session.commit()
+                count += affected
+                if affected < batch_size:
+                    break
+        except Exception:
+            self.session.rollback()
+            raise
+
+        if not count:
+            return {"message": "No items found", "deleted_count": 0}
+
+        # Rows were changed behind the ORM's back; drop stale in-memory state
+        self.session.expire_all()
+
         action = "permanently deleted" if permanent else "deactivated"
         return {
             "message": f"Successfully {action} {count} items",
             "deleted_count": count
-        } 
\ No newline at end of file
+        }
+
+    def _sync_embeddings_active(self, item_ids: List, active: bool) -> None:
+        """Mirror ``Item.active`` onto ``Embedding.item_active`` for the given items"""
+        self.session.execute(
+            update(Embedding)
+            .where(Embedding.item_id.in_(item_ids))
+            .values(item_active=active)
+            .execution_options(synchronize_session=False)
+        )
@@ -1,32 +1,89 @@
 from typing import List, Optional, Dict
+from sqlalchemy import Integer, bindparam, select
 from sqlalchemy.orm import Session
-from sqlalchemy import make_url
 from models.message import Message, MessageRole
 from models.embedding import Embedding
 from models.conversation import Conversation
 from models.user import User
-from llama_index.core import VectorStoreIndex, ServiceContext, Document
-from llama_index.vector_stores.postgres import PGVectorStore
-from llama_index.embeddings.openai import OpenAIEmbedding
-from llama_index.llms.openai import OpenAI
-import openai
-import os
+from services.archive import MessageArchiveService
+from services.conversation import ConversationService
 from datetime import datetime
 import uuid
 
+# Built once so the compiled forms are reused from the engine's statement cache
+LATEST_MESSAGES = select(Message)\
+    .where(Message.conversation_id == bindparam('conversation_id'))\
+    .order_by(Message.created_at.desc())\
+    .limit(bindparam('limit', type_=Integer))
+LATEST_MESSAGES_AFTER = LATEST_MESSAGES.where(Message.created_at > bindparam('after'))
+LATEST_MESSAGES_BEFORE = LATEST_MESSAGES.where(Message.created_at < bindparam('before'))
+EARLIEST_MESSAGES = select(Message)\
+    .where(Message.conversation_id == bindparam('conversation_id'))\
+    .order_by(Message.created_at)\
+    .limit(bindparam('limit', type_=Integer))
+EARLIEST_MESSAGES_AFTER = EARLIEST_MESSAGES.where(Message.created_at > bindparam('after'))
+
 class MessageService:
     def __init__(self, db: Session):
         self.db = db
         
         
-    def get_conversation_messages(self, conversation: Conversation, limit: int = 10) -> List[Message]:
-        """Get all messages in a conversation ordered by creation time"""
-        return self.db.query(Message)\
-            .filter(Message.conversation_id == conversation.id)\
-            .order_by(Message.created_at.desc())\
-            .limit(limit)\
-            .all()
+    def get_conversation_messages(
+        self,
+        conversation: Conversation,
+        limit: int = 10,
+        after: Optional[datetime] = None) -> List[Message]:
+        """Get the newest messages in a conversation, newest first, optionally only those created after `after`"""
+        params = {'conversation_id': conversation.id, 'limit': limit}
+        if after is None:
+            return self.db.execute(LATEST_MESSAGES, params).scalars().all()
+        return self.db.execute(LATEST_MESSAGES_AFTER, {**params, 'after': after}).scalars().all()
+
+
+    def get_messages_after(
+        self,
+        conversation: Conversation,
+        limit: int = 10,
+        after: Optional[datetime] = None) -> List[Message]:
+        """Get the oldest messages in a conversation, oldest first, optionally only those created after `after`"""
+        params = {'conversation_id': conversation.id, 'limit': limit}
+        if after is None:
+            return self.db.execute(EARLIEST_MESSAGES, params).scalars().all()
+        return self.db.execute(EARLIEST_MESSAGES_AFTER, {**params, 'after': after}).scalars().all()
+
 
+    def get_history(
+        self,
+        conversation: Conversation,
+        limit: int = 10,
+        before: Optional[datetime] = None) -> List[Message]:
+        """
+        Get a page of a conversation's history, newest first.
+
+        Pages reaching past the oldest message still in the ``messages`` table
+        are completed from the archive of cold partitions.
+
+        Args:
+            conversation (Conversation): Conversation to read
+            limit (int): Page size
+            before (Optional[datetime]): Only messages created before this time,
+                usually the ``created_at`` of the last message of the previous page
+
+        Returns:
+            List[Message]: Messages newest first; archived ones are transient instances
+        """
+        params = {'conversation_id': conversation.id, 'limit': limit}
+        if before is None:
+            messages = self.db.execute(LATEST_MESSAGES, params).scalars().all()
+        else:
+            messages = self.db.execute(LATEST_MESSAGES_BEFORE, {**params, 'before': before}).scalars().all()
+        if len(messages) < limit:
+            messages = list(messages) + MessageArchiveService(self.db).get_messages(
+                conversation.id,
+                limit=limit - len(messages),
+                before=messages[-1].created_at if messages else before
+            )
+        return messages
 
     def create_message(
         self, 
@@ -34,16 +91,19 @@ class MessageService:
         conversation: Conversation, 
         content: str, 
         role: MessageRole, 
-        source_embedding_id: Optional[uuid.UUID] = None) -> Message:
+        source_embedding_id: Optional[uuid.UUID] = None,
+        idempotency_key: Optional[str] = None) -> Message:
         """Create a new message"""
         message = Message(
             user_id=user.id,
             conversation_id=conversation.id,
             content=content,
             role=role,
-            source_embedding_id=source_embedding_id
+            source_embedding_id=source_embedding_id,
+            idempotency_key=idempotency_key
         )
         self.db.add(message)
+        ConversationService(self.db).record_message(conversation, content)
         self.db.commit()
         self.db.refresh(message)
         return message
@@ -52,3 +112,13 @@ class MessageService:
         return self.db.query(Message)\
             .filter(Message.id == message_id)\
             .first()
+
+    def get_messages_by_idempotency_key(self, conversation: Conversation, idempotency_key: str) -> Dict[MessageRole, Message]:
+        """Get the question and answer stored for an Idempotency-Key, by role"""
+        messages = self.db.query(Message)\
+            .filter(
+                Message.conversation_id == conversation.id,
+                Message.idempotency_key == idempotency_key
+            )\
+            .all()
+        return {message.role: message for message in messages}
@@ -0,0 +1,68 @@
+from typing import Iterable, List, Sequence, Tuple
+import numpy as np
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle
+from services.embedding import ChunkMatrix, EmbeddingService
+from utils.routing import replica_reads
+
+
+class ChunkMatrixRetriever(BaseRetriever):
+    """
+    Exact cosine top-k over the chunk matrix of one conversation.
+
+    Scoring is one matrix-vector product over the float32 vectors; text and
+    item details are only loaded for the chunks that are returned.
+    """
+
+    def __init__(
+        self,
+        chunks: ChunkMatrix,
+        embedding_service: EmbeddingService,
+        similarity_top_k: int = 2,
+        **kwargs
+    ):
+        self._chunks = chunks
+        self._embedding_service = embedding_service
+        self._similarity_top_k = similarity_top_k
+        norms = np.linalg.norm(chunks.vectors, axis=1) if len(chunks) else np.empty(0, dtype=np.float32)
+        norms[norms == 0] = 1.0
+        self._norms = norms
+        super().__init__(**kwargs)
+
+    def rank(self, query_embedding: Sequence[float]) -> List[Tuple[int, float]]:
+        """Rows of the best chunks for a query embedding with their cosine similarity, best first."""
+        k = min(self._similarity_top_k, len(self._chunks))
+        if k <= 0:
+            return []
+        query = np.asarray(query_embedding, dtype=np.float32)
+        scores = (self._chunks.vectors @ query) / (self._norms * (np.linalg.norm(query) or 1.0))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return [(int(row), float(scores[row])) for row in best]
+
+    def retrieve_many(self, query_embeddings: Iterable[Sequence[float]]) -> List[List[NodeWithScore]]:
+        """
+        Retrieve for several query embeddings, loading the picked chunks in one query.
+
+        Args:
+            query_embeddings (Iterable[Sequence[float]]): One embedding per query
+
+        Returns:
+            List[List[NodeWithScore]]: Nodes per query, best first
+        """
+        ranked = [self.rank(embedding) for embedding in query_embeddings]
+        # Chunk texts do not depend on anything the request itself writes
+        with replica_reads(self._embedding_service.db):
+            nodes = self._embedding_service.load_chunk_nodes(
+                self._chunks, {row for rows in ranked for row, _ in rows}
+            )
+        return [
+            [NodeWithScore(node=nodes[row], score=score) for row, score in rows if row in nodes]
+            for rows in ranked
+        ]
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        embedding = query_bundle.embedding
+        if embedding is None:
+            embedding = self._embedding_service.embed_query(query_bundle.query_str)
+        return self.retrieve_many([embedding])[0]
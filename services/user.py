@@ -1,8 +1,20 @@
+from sqlalchemy import bindparam, select
+from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import Session
 from models.user import User
 from typing import Optional
 import logging
-from sqlalchemy.dialects.postgresql import UUID
+from utils.cache import from_row, get_cache, to_row
+from utils.invalidation import USER, invalidation_bus, publish
+from utils.routing import replica_staleness
+
+# Built once so the compiled form is reused from the engine's statement cache
+USER_BY_EMAIL = select(User).where(User.email == bindparam('email')).limit(1)
+
+user_cache = get_cache("user")
+invalidation_bus.subscribe(USER, user_cache.delete)
+invalidation_bus.on_reset(user_cache.reset)
+
 
 class UserService:
     def __init__(self, db: Session):
@@ -11,12 +23,21 @@ class UserService:
         
     
     def get_user_by_email(self, email: str) -> Optional[User]:
-        return self.db.query(User).filter(User.email == email).first()
+        row = user_cache.get(email)
+        if row is not None:
+            return from_row(self.db, User, row)
+        fill = user_cache.begin_fill(replica_staleness(self.db))
+        user = self.db.execute(USER_BY_EMAIL, {'email': email}).scalars().first()
+        if user is not None:
+            user_cache.fill(fill, email, to_row(user))
+        return user
     
     def create_user(self, email: str) -> User:
         user = User(email=email, display_name=email.split('@')[0])
         self.db.add(user)
         self.db.flush()
+        # Delivered when the caller commits
+        publish(self.db, USER, email)
         self.db.expunge(user)
         return user
     
@@ -0,0 +1,138 @@
+from contextlib import contextmanager
+import os
+import sys
+import uuid
+import pytest
+
+# Tests import the app modules the way the app does, from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@contextmanager
+def scratch_database():
+    """
+    Engine on a new database, bootstrapped with ``utils.bootstrap`` and dropped afterwards.
+
+    The database is created next to the one TEST_DATABASE_URL names (a
+    disposable local Postgres with pgvector); tests are skipped without it.
+    """
+    url = os.getenv("TEST_DATABASE_URL")
+    if not url:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    from sqlalchemy import create_engine, text
+    from sqlalchemy.engine import make_url
+    from utils.bootstrap import init_database
+
+    name = f"test_{uuid.uuid4().hex[:12]}"
+    admin = create_engine(url, isolation_level="AUTOCOMMIT")
+    with admin.connect() as conn:
+        conn.execute(text(f'CREATE DATABASE "{name}"'))
+    engine = create_engine(make_url(url).set(database=name))
+    try:
+        init_database(engine)
+        yield engine
+    finally:
+        engine.dispose()
+        with admin.connect() as conn:
+            conn.execute(text(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)'))
+        admin.dispose()
+
+
+@pytest.fixture(scope="session")
+def pg_engine():
+    with scratch_database() as engine:
+        yield engine
+
+
+@pytest.fixture
+def db(pg_engine):
+    from sqlalchemy.orm import sessionmaker
+
+    session = sessionmaker(bind=pg_engine, expire_on_commit=False)()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def user(db):
+    from models.user import User
+
+    user = User(email=f"{uuid.uuid4().hex}@example.com", display_name="Test")
+    db.add(user)
+    db.commit()
+    return user
+
+
+@pytest.fixture
+def conversation(db, user):
+    """An empty conversation of ``user``."""
+    from models.conversation import Conversation
+
+    conversation = Conversation(user_id=user.id, title="Test", context="")
+    db.add(conversation)
+    db.commit()
+    return conversation
+
+
+@pytest.fixture
+def api(pg_engine, user):
+    """
+    Test client of the app on the scratch database, signed in as ``user``.
+
+    Cognito is replaced by a fixed token payload and replicas are not used;
+    everything else, including the sessions opened outside requests, runs
+    for real.
+    """
+    from fastapi.testclient import TestClient
+    import main
+    import dependencies.admission
+    from dependencies.database import db_service, use_replica
+    from dependencies.security import validate_token
+
+    # Admission state belongs to the event loop of the client that created it
+    dependencies.admission._chat_admission = None
+    db_service.dispose()
+    db_service.db_url = pg_engine.url.render_as_string(hide_password=False)
+    main.app.dependency_overrides[validate_token] = lambda: {'UserAttributes': [{'Value': user.email}]}
+    main.app.dependency_overrides[use_replica] = lambda: None
+    try:
+        yield TestClient(main.app)
+    finally:
+        main.app.dependency_overrides.clear()
+        db_service.dispose()
+        db_service.db_url = None
+
+
+@pytest.fixture
+def document(db, conversation):
+    """An active item of ``conversation`` with two stored chunks."""
+    from models.embedding import Embedding
+    from models.item import Item
+    from services.conversation import ConversationService
+    from services.embedding import compute_chunk_hash
+
+    item = Item(
+        file_name="doc.pdf",
+        mime_type="application/pdf",
+        uri="upload://doc.pdf",
+        conversation_id=conversation.id,
+        owner_id=conversation.user_id,
+        active=True
+    )
+    db.add(item)
+    db.flush()
+    for chunk_index, chunk_text in enumerate(["first chunk", "second chunk"]):
+        db.add(Embedding(
+            item_id=item.id,
+            conversation_id=conversation.id,
+            owner_id=conversation.user_id,
+            page=1,
+            chunk_index=chunk_index,
+            chunk_text=chunk_text,
+            content_hash=compute_chunk_hash(chunk_text),
+            embedding=[float(chunk_index + 1)] + [0.0] * 1535
+        ))
+    db.flush()
+    ConversationService(db).refresh_stats(conversation.id)
+    db.commit()
+    return item
@@ -0,0 +1,154 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+import httpx
+import pytest
+import dependencies.admission
+import main
+from dependencies.admission import get_chat_admission
+from services.chat import ChatService
+from tests.test_upload import run_asgi
+from utils.admission import AdmissionController, AdmissionRejected
+
+
+def controller(global_limit=4, per_key_limit=1, max_queue=4, queue_timeout=1.0):
+    return AdmissionController(global_limit, per_key_limit, max_queue, queue_timeout)
+
+
+def test_waiter_starts_when_a_slot_is_released():
+    async def scenario():
+        admission = controller()
+        await admission.acquire("a")
+        waiter = asyncio.create_task(admission.acquire("a"))
+        await asyncio.sleep(0.05)
+        assert admission.stats()["queue_depth"] == 1
+        await admission.release("a", 0.5)
+        await waiter
+        return admission.stats()
+
+    stats = asyncio.run(scenario())
+
+    assert stats["active"] == 1 and stats["queue_depth"] == 0 and stats["admitted_total"] == 2
+
+
+def test_other_keys_are_not_held_up_by_a_busy_one():
+    async def scenario():
+        admission = controller()
+        await admission.acquire("a")
+        return await asyncio.wait_for(admission.acquire("b"), timeout=0.5)
+
+    assert asyncio.run(scenario()) < 0.5
+
+
+def test_full_queue_and_timeouts_are_rejected_with_a_retry_hint():
+    async def scenario():
+        admission = controller(max_queue=1, queue_timeout=0.1)
+        await admission.acquire("a")
+        waiter = asyncio.create_task(admission.acquire("a"))
+        await asyncio.sleep(0.01)
+        with pytest.raises(AdmissionRejected) as full:
+            await admission.acquire("a")
+        with pytest.raises(AdmissionRejected) as timed_out:
+            await waiter
+        return admission, full.value, timed_out.value
+
+    admission, full, timed_out = asyncio.run(scenario())
+
+    assert full.reason == "Too many queued requests" and full.retry_after >= 1
+    assert timed_out.reason == "Timed out waiting for capacity"
+    stats = admission.stats()
+    assert stats["queue_depth"] == 0
+    assert stats["rejected_queue_full_total"] == stats["rejected_timeout_total"] == 1
+
+
+def test_cancelled_waiter_gives_its_queue_place_back():
+    async def scenario():
+        admission = controller(max_queue=1)
+        await admission.acquire("a")
+        waiter = asyncio.create_task(admission.acquire("a"))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        await admission.release("a")
+        await asyncio.wait_for(admission.acquire("a"), timeout=0.5)
+        return admission.stats()
+
+    stats = asyncio.run(scenario())
+
+    assert stats["active"] == 1 and stats["queue_depth"] == 0
+
+
+@pytest.fixture
+def admission(api):
+    """The app's chat admission, with one slot per user and no queue."""
+    dependencies.admission._chat_admission = controller(per_key_limit=1, max_queue=0, queue_timeout=0.1)
+    return get_chat_admission()
+
+
+@pytest.fixture
+def batch_llm(monkeypatch):
+    """Answers batches without retrieval; the last question never finishes."""
+    answered = threading.Event()
+
+    def prepare_batch(self, conversation, questions, top_k=3):
+        return SimpleNamespace(top_k=top_k)
+
+    async def answer_batch(self, batch, questions, max_concurrency=4):
+        for index, question in enumerate(questions):
+            if question == "hang":
+                answered.set()
+                await asyncio.sleep(30)
+            yield index, SimpleNamespace(response=f"answer to {question}", source_nodes=[]), None
+
+    monkeypatch.setattr(ChatService, "prepare_batch", prepare_batch)
+    monkeypatch.setattr(ChatService, "answer_batch", answer_batch)
+    return answered
+
+
+def test_chat_slot_is_released_after_a_refused_request(api, admission, conversation):
+    response = api.post("/api/v1/chat", json={"conversation_id": str(conversation.id), "message": "Anyone?"})
+
+    assert response.status_code == 400
+    assert admission.stats()["active"] == 0
+    assert admission.stats()["admitted_total"] == 1
+
+
+def test_busy_user_gets_429_with_retry_after(api, admission, conversation, user):
+    # A request of the same user holding the only slot
+    admission._active_total, admission._active[user.email] = 1, 1
+
+    response = api.post("/api/v1/chat", json={"conversation_id": str(conversation.id), "message": "Anyone?"})
+
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+
+
+def test_batch_slot_is_held_until_the_stream_ends(api, admission, conversation, batch_llm):
+    response = api.post("/api/v1/chat/batch", json={
+        "conversation_id": str(conversation.id), "questions": ["one", "two"], "persist": False
+    })
+
+    assert [line for line in response.text.splitlines() if line]
+    assert admission.stats()["active"] == 0
+    assert admission.stats()["admitted_total"] == 1
+
+
+def test_batch_slot_is_released_when_it_is_refused(api, admission, conversation, monkeypatch):
+    monkeypatch.setattr(ChatService, "prepare_batch", lambda self, *args: None)
+
+    response = api.post("/api/v1/chat/batch", json={"conversation_id": str(conversation.id), "questions": ["one"]})
+
+    assert response.status_code == 400
+    assert admission.stats()["active"] == 0
+
+
+def test_batch_slot_is_released_when_the_client_disconnects(api, admission, conversation, batch_llm):
+    request = httpx.Request("POST", "http://testserver/api/v1/chat/batch", json={
+        "conversation_id": str(conversation.id), "questions": ["one", "hang"], "persist": False
+    })
+
+    sent, _ = run_asgi(main.app, request, disconnect=batch_llm)
+
+    assert sent[0]["status"] == 200
+    assert admission.stats()["active"] == 0
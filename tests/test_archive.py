@@ -0,0 +1,147 @@
+from datetime import datetime, timedelta, timezone
+import uuid
+import pytest
+from sqlalchemy import insert, select, text
+from sqlalchemy.orm import sessionmaker
+from models.conversation import Conversation
+from models.message import Message, MessageRole
+from models.message_archive import MessageArchiveSegment
+from models.user import User
+from services.archive import ArchiveUnavailable, MessageArchiveService
+from services.message import MessageService
+from utils.partitioning import (
+    LEGACY_PARTITION,
+    archive_cold_partitions,
+    archive_directory,
+    is_partitioned,
+    month_start,
+    partition_messages,
+)
+from tests.conftest import scratch_database
+import utils.partitioning
+
+NOW = datetime.now(timezone.utc)
+OLD = [NOW - timedelta(days=400 - day) for day in range(3)]
+
+
+@pytest.fixture(scope="module")
+def archived(tmp_path_factory):
+    """A database whose messages were partitioned and whose old rows were archived."""
+    directory = str(tmp_path_factory.mktemp("archive"))
+    with scratch_database() as engine:
+        session = sessionmaker(bind=engine, expire_on_commit=False)()
+        user = User(email=f"{uuid.uuid4().hex}@example.com", display_name="Test")
+        session.add(user)
+        session.flush()
+        conversation = Conversation(user_id=user.id, title="Test", context="")
+        session.add(conversation)
+        session.flush()
+        rows = [
+            {'id': uuid.uuid4(), 'conversation_id': conversation.id, 'user_id': user.id,
+             'role': MessageRole.USER, 'content': f"old {index}", 'created_at': created_at}
+            for index, created_at in enumerate(OLD)
+        ]
+        session.execute(insert(Message), rows)
+        # This month's rows stay in the old table too
+        rows.append({'id': uuid.uuid4(), 'conversation_id': conversation.id, 'user_id': user.id,
+                     'role': MessageRole.USER, 'content': "this month", 'created_at': NOW})
+        session.execute(insert(Message), rows[-1:])
+        # Rows from before created_at had a server default
+        null_row = {'id': uuid.uuid4(), 'conversation_id': conversation.id, 'user_id': user.id,
+                    'role': MessageRole.USER, 'content': "legacy null"}
+        session.execute(text(
+            "INSERT INTO messages (id, conversation_id, user_id, role, content, created_at) "
+            "VALUES (:id, :conversation_id, :user_id, 'USER', :content, NULL)"
+        ), null_row)
+        rows.append(null_row)
+        session.commit()
+
+        assert partition_messages(engine)
+        # Lands in the first monthly partition, after the range of the old table
+        session.add(Message(conversation_id=conversation.id, user_id=user.id, role=MessageRole.USER,
+                            content="new", created_at=month_start(NOW, 1) + timedelta(days=1)))
+        session.commit()
+        assert archive_cold_partitions(engine, hot_months=-1, directory=directory) == [LEGACY_PARTITION]
+        yield engine, session, conversation, rows, directory
+        session.close()
+
+
+def test_partitioning_reuses_the_prebuilt_index(archived):
+    engine, session, _, _, _ = archived
+    with engine.connect() as conn:
+        assert is_partitioned(conn)
+        # The temporary NOT NULL check is gone once the column is NOT NULL
+        assert conn.execute(text(
+            "SELECT count(*) FROM pg_constraint WHERE conname = 'messages_created_at_not_null'"
+        )).scalar() == 0
+        assert not partition_messages(engine)
+
+
+def test_history_falls_back_to_the_archive(archived, monkeypatch):
+    _, session, conversation, rows, directory = archived
+    monkeypatch.setattr(utils.partitioning, "MESSAGE_ARCHIVE_DIR", directory)
+    service = MessageService(session)
+    # The hot row first, then archived rows newest first
+    assert [message.content for message in service.get_history(conversation, limit=3)] == [
+        "new", "this month", "old 2"
+    ]
+    older = service.get_history(conversation, limit=10, before=OLD[2])
+    assert [message.content for message in older] == ["old 1", "old 0", "legacy null"]
+
+
+def test_archived_message_is_found_by_id(archived):
+    _, session, conversation, rows, directory = archived
+    message = MessageArchiveService(session, directory).get_message(conversation.id, rows[1]['id'])
+    assert message is not None and message.content == "old 1"
+
+
+def test_unknown_message_id_reads_no_archive_file(archived, monkeypatch):
+    _, session, conversation, _, directory = archived
+    service = MessageArchiveService(session, directory)
+
+    def fail(*args):
+        raise AssertionError("archive file read")
+
+    monkeypatch.setattr(service, "read_segment", fail)
+    assert service.get_message(conversation.id, uuid.uuid4()) is None
+
+
+def test_segments_record_their_message_ids(archived):
+    _, session, conversation, rows, _ = archived
+    ids = session.execute(
+        select(MessageArchiveSegment.message_ids).where(MessageArchiveSegment.conversation_id == conversation.id)
+    ).scalar()
+    assert set(ids) == {row['id'] for row in rows}
+
+
+def test_unreadable_archive_fails_loudly(archived, tmp_path):
+    _, session, conversation, _, _ = archived
+    with pytest.raises(ArchiveUnavailable):
+        MessageArchiveService(session, str(tmp_path / "missing")).get_messages(conversation.id, limit=10)
+    with pytest.raises(ArchiveUnavailable):
+        MessageArchiveService(session, "relative/dir").get_messages(conversation.id, limit=10)
+
+
+def test_archive_directory_must_be_absolute(tmp_path):
+    assert archive_directory(str(tmp_path)) == str(tmp_path)
+    for directory in ("", "archive/messages"):
+        with pytest.raises(ValueError):
+            archive_directory(directory)
+
+
+def test_history_takes_a_naive_before_as_utc(api, conversation, monkeypatch):
+    seen = []
+
+    def get_history(self, conversation, limit=10, before=None):
+        seen.append(before)
+        # Archive segments are compared with aware datetimes
+        assert before < datetime.now(timezone.utc)
+        return []
+
+    monkeypatch.setattr(MessageService, "get_history", get_history)
+    response = api.get(
+        f"/api/v1/chat/history/{conversation.id}",
+        params={"before": "2020-01-01T00:00:00", "limit": 5}
+    )
+    assert response.status_code == 200
+    assert seen == [datetime(2020, 1, 1, tzinfo=timezone.utc)]
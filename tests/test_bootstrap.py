@@ -0,0 +1,53 @@
+import pytest
+from sqlalchemy import text
+from tests.conftest import scratch_database
+from utils.bootstrap import init_database
+
+STATS = "active_item_count, chunk_count, message_count, last_message_at, last_message_preview"
+
+
+@pytest.fixture(scope="module")
+def legacy():
+    """A database from before the listing stats, with one conversation of two messages."""
+    with scratch_database() as engine:
+        with engine.begin() as conn:
+            for column in STATS.split(", "):
+                conn.execute(text(f"ALTER TABLE conversations DROP COLUMN {column}"))
+            conn.execute(text(
+                "INSERT INTO users (id, email, display_name) "
+                "VALUES ('00000000-0000-0000-0000-000000000001', 'legacy@example.com', 'Legacy')"
+            ))
+            conn.execute(text(
+                "INSERT INTO conversations (id, user_id, title, context) VALUES "
+                "('00000000-0000-0000-0000-000000000002', '00000000-0000-0000-0000-000000000001', 'Old', '')"
+            ))
+            conn.execute(text(
+                "INSERT INTO messages (id, conversation_id, user_id, role, content, created_at) VALUES "
+                "(gen_random_uuid(), '00000000-0000-0000-0000-000000000002', "
+                "'00000000-0000-0000-0000-000000000001', 'USER', 'hello', now() - interval '1 minute'), "
+                "(gen_random_uuid(), '00000000-0000-0000-0000-000000000002', "
+                "'00000000-0000-0000-0000-000000000001', 'ASSISTANT', 'hi there', now())"
+            ))
+        init_database(engine)
+        yield engine
+
+
+def stats(engine):
+    with engine.connect() as conn:
+        return conn.execute(text(
+            "SELECT message_count, last_message_preview FROM conversations "
+            "WHERE id = '00000000-0000-0000-0000-000000000002'"
+        )).one()
+
+
+def test_stats_are_added_and_backfilled_on_upgrade(legacy):
+    assert tuple(stats(legacy)) == (2, "hi there")
+
+
+def test_later_bootstraps_do_not_recount(legacy):
+    with legacy.begin() as conn:
+        conn.execute(text("UPDATE conversations SET message_count = 0"))
+
+    init_database(legacy)
+
+    assert stats(legacy).message_count == 0
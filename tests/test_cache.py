@@ -0,0 +1,107 @@
+import numpy as np
+import pytest
+import utils.cache
+from utils.cache import Cache, MemoryCache, SQLiteCache, decode, encode
+from utils.routing import replica_staleness
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path, monkeypatch):
+    if request.param == "memory":
+        backend = MemoryCache(1024 ** 2)
+    else:
+        backend = SQLiteCache(str(tmp_path / "cache.sqlite"), 1024 ** 2)
+    monkeypatch.setattr(utils.cache, "_backend", backend)
+    return backend
+
+
+def test_encode_round_trips_arrays():
+    value = {"ids": ["a", "b"], "vectors": np.arange(6, dtype=np.float32).reshape(2, 3)}
+    restored = decode(encode(value))
+    assert restored["ids"] == ["a", "b"]
+    assert np.array_equal(restored["vectors"], value["vectors"])
+
+
+def test_fill_stores_when_nothing_was_invalidated(backend):
+    cache = Cache("test", 60)
+    token = cache.begin_fill()
+    assert cache.fill(token, "k", {"v": 1})
+    assert cache.get("k") == {"v": 1}
+
+
+def test_invalidation_between_read_and_fill_drops_the_value(backend):
+    cache = Cache("test", 60)
+    token = cache.begin_fill()
+    # The read returned the old row; the writer's invalidation arrives before the fill
+    cache.delete("k")
+    assert not cache.fill(token, "k", {"v": "old"})
+    assert cache.get("k") is None
+    assert cache.stats()["stale_fills_total"] == 1
+
+
+def test_invalidation_while_storing_does_not_leave_the_value(backend, monkeypatch):
+    cache = Cache("test", 60)
+    token = cache.begin_fill()
+    store = backend.set
+
+    def set_then_invalidate(key, value, ttl):
+        # The invalidation's delete runs just before the fill's write lands
+        cache.delete("k")
+        store(key, value, ttl)
+
+    monkeypatch.setattr(backend, "set", set_then_invalidate)
+    assert not cache.fill(token, "k", {"v": "old"})
+    assert cache.get("k") is None
+
+
+def test_replica_reads_right_after_an_invalidation_are_not_cached(backend):
+    cache = Cache("test", 60)
+    cache.delete("k")
+    # A replica within its lag limit may not have replayed the write yet
+    assert cache.begin_fill(staleness=5) is None
+    assert not cache.fill(cache.begin_fill(staleness=5), "k", {"v": "old"})
+    assert cache.get("k") is None
+    # The primary already has it
+    assert cache.begin_fill() is not None
+
+
+def test_replica_staleness_follows_session_routing():
+    class FakeSession:
+        def __init__(self, **info):
+            self.info = info
+
+    assert replica_staleness(FakeSession()) == 0.0
+    assert replica_staleness(FakeSession(replica=object(), replica_staleness=10.0)) == 10.0
+    assert replica_staleness(FakeSession(replica=object(), replica_staleness=10.0, wrote=True)) == 0.0
+    assert replica_staleness(
+        FakeSession(replica=object(), replica_staleness=10.0, wrote=True, replica_after_write=1)
+    ) == 10.0
+
+
+def test_reset_clears_a_process_local_backend(monkeypatch):
+    monkeypatch.setattr(utils.cache, "_backend", MemoryCache(1024 ** 2))
+    cache = Cache("test", 60)
+    cache.set("k", 1)
+    token = cache.begin_fill()
+    cache.reset()
+    assert cache.get("k") is None
+    assert not cache.fill(token, "j", 2)
+
+
+def test_reset_keeps_shared_entries_but_drops_fills_in_flight(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils.cache, "_backend", SQLiteCache(str(tmp_path / "cache.sqlite"), 1024 ** 2))
+    cache = Cache("test", 60)
+    cache.set("k", 1)
+    token = cache.begin_fill()
+    cache.reset()
+    # Other workers kept listening and evicting; their entries stay
+    assert cache.get("k") == 1
+    assert not cache.fill(token, "j", 2)
+    assert cache.get("j") is None
+
+
+def test_namespaces_are_invalidated_independently(backend):
+    users, conversations = Cache("users", 60), Cache("conversations", 60)
+    token = conversations.begin_fill()
+    users.delete("someone")
+    assert conversations.fill(token, "k", 1)
@@ -0,0 +1,59 @@
+from types import SimpleNamespace
+import pytest
+from sqlalchemy import select
+from models.message import Message
+from services.chat import ChatService
+from utils.invalidation import CONVERSATION_DOCUMENTS, publish
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    """Replaces answer generation; records the retriever it was handed."""
+    calls = []
+
+    def get_answer_nodes(self, query_text, *args, retriever=None, **kwargs):
+        calls.append(retriever)
+        return SimpleNamespace(response=f"answer to {query_text}", source_nodes=[])
+
+    monkeypatch.setattr(ChatService, "get_answer_nodes", get_answer_nodes)
+    return calls
+
+
+def stored_messages(db, conversation):
+    db.expire_all()
+    return db.execute(select(Message).where(Message.conversation_id == conversation.id)).scalars().all()
+
+
+def test_question_without_documents_is_refused_before_it_is_stored(api, db, conversation, llm):
+    response = api.post("/api/v1/chat", json={"conversation_id": str(conversation.id), "message": "Anyone?"})
+
+    assert response.status_code == 400
+    assert llm == []
+    assert stored_messages(db, conversation) == []
+
+
+def test_refused_idempotency_key_can_be_retried_once_documents_exist(api, db, conversation, llm, request):
+    body = {"conversation_id": str(conversation.id), "message": "Anyone?"}
+    assert api.post("/api/v1/chat", json=body, headers={"Idempotency-Key": "k"}).status_code == 400
+
+    request.getfixturevalue("document")
+    # What an upload publishes once its item is active
+    publish(db, CONVERSATION_DOCUMENTS, conversation.id)
+    db.commit()
+    response = api.post("/api/v1/chat", json=body, headers={"Idempotency-Key": "k"})
+
+    assert response.status_code == 200
+    # The retriever built for the document check is the one answering
+    assert llm[0] is not None
+    assert len(stored_messages(db, conversation)) == 2
+
+
+def test_batch_without_documents_is_refused_and_stores_nothing(api, db, conversation):
+    response = api.post("/api/v1/chat/batch", json={
+        "conversation_id": str(conversation.id),
+        "questions": ["One?", "Two?"],
+        "persist": True
+    })
+
+    assert response.status_code == 400
+    assert stored_messages(db, conversation) == []
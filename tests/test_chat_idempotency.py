@@ -0,0 +1,133 @@
+import threading
+from types import SimpleNamespace
+import pytest
+from sqlalchemy import select
+from models.message import Message, MessageRole
+from services.chat import ChatService
+from services.message import MessageService
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    """Replaces answer generation; counts the questions it answers."""
+    calls = []
+
+    def get_answer_nodes(self, query_text, *args, **kwargs):
+        calls.append(query_text)
+        return SimpleNamespace(response=f"answer to {query_text}", source_nodes=[])
+
+    monkeypatch.setattr(ChatService, "get_answer_nodes", get_answer_nodes)
+    return calls
+
+
+def stored_messages(db, conversation):
+    db.expire_all()
+    return db.execute(
+        select(Message).where(Message.conversation_id == conversation.id).order_by(Message.created_at)
+    ).scalars().all()
+
+
+def ask(api, conversation, message, key=None):
+    headers = {"Idempotency-Key": key} if key else {}
+    return api.post("/api/v1/chat", json={"conversation_id": str(conversation.id), "message": message}, headers=headers)
+
+
+def test_retry_with_the_same_key_returns_the_stored_answer(api, db, conversation, document, llm):
+    first = ask(api, conversation, "What is it?", key="k1")
+    second = ask(api, conversation, "What is it?", key="k1")
+
+    assert first.status_code == second.status_code == 200
+    assert second.json()["answer_id"] == first.json()["answer_id"]
+    assert llm == ["What is it?"]
+    assert len(stored_messages(db, conversation)) == 2
+
+
+def test_key_reused_for_another_message_is_rejected(api, db, conversation, document, llm):
+    assert ask(api, conversation, "What is it?", key="k2").status_code == 200
+
+    response = ask(api, conversation, "Something else?", key="k2")
+
+    assert response.status_code == 422
+    assert llm == ["What is it?"]
+    assert len(stored_messages(db, conversation)) == 2
+
+
+def test_retry_racing_an_unfinished_request_gets_409(api, db, conversation, document, llm, monkeypatch):
+    # Another worker stored the question and is still generating its answer
+    db.add(Message(conversation_id=conversation.id, user_id=conversation.user_id, role=MessageRole.USER,
+                   content="What is it?", idempotency_key="k3"))
+    db.commit()
+    lookup = MessageService.get_messages_by_idempotency_key
+    lookups = []
+
+    def racing_lookup(self, conversation, idempotency_key):
+        lookups.append(idempotency_key)
+        # The first lookup ran before the other worker committed
+        return {} if len(lookups) == 1 else lookup(self, conversation, idempotency_key)
+
+    monkeypatch.setattr(MessageService, "get_messages_by_idempotency_key", racing_lookup)
+    response = ask(api, conversation, "What is it?", key="k3")
+
+    assert response.status_code == 409
+    assert response.headers["Retry-After"] == "1"
+    assert llm == []
+    assert len(stored_messages(db, conversation)) == 1
+
+
+def test_racing_request_with_another_message_gets_422(api, db, conversation, document, llm, monkeypatch):
+    db.add(Message(conversation_id=conversation.id, user_id=conversation.user_id, role=MessageRole.USER,
+                   content="What is it?", idempotency_key="k4"))
+    db.commit()
+    lookup = MessageService.get_messages_by_idempotency_key
+    lookups = []
+
+    def racing_lookup(self, conversation, idempotency_key):
+        lookups.append(idempotency_key)
+        return {} if len(lookups) == 1 else lookup(self, conversation, idempotency_key)
+
+    monkeypatch.setattr(MessageService, "get_messages_by_idempotency_key", racing_lookup)
+    assert ask(api, conversation, "Something else?", key="k4").status_code == 422
+
+
+def test_question_stored_without_an_answer_is_answered_on_retry(api, db, conversation, document, llm):
+    # A previous attempt stored the question and then failed
+    db.add(Message(conversation_id=conversation.id, user_id=conversation.user_id, role=MessageRole.USER,
+                   content="What is it?", idempotency_key="k5"))
+    db.commit()
+
+    response = ask(api, conversation, "What is it?", key="k5")
+
+    assert response.status_code == 200
+    assert llm == ["What is it?"]
+    assert [message.role for message in stored_messages(db, conversation)] == [
+        MessageRole.USER, MessageRole.ASSISTANT
+    ]
+
+
+def test_concurrent_identical_requests_share_one_answer(api, db, conversation, document, monkeypatch):
+    calls = []
+    release = threading.Event()
+
+    def get_answer_nodes(self, query_text, *args, **kwargs):
+        calls.append(query_text)
+        release.wait(5)
+        return SimpleNamespace(response="shared", source_nodes=[])
+
+    monkeypatch.setattr(ChatService, "get_answer_nodes", get_answer_nodes)
+    responses = []
+    threads = [
+        threading.Thread(target=lambda: responses.append(ask(api, conversation, "Same question?", key="k6")))
+        for _ in range(3)
+    ]
+    for thread in threads:
+        thread.start()
+    while not calls:
+        threading.Event().wait(0.01)
+    threading.Event().wait(0.2)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert [response.status_code for response in responses] == [200, 200, 200]
+    assert len({response.json()["answer_id"] for response in responses}) == 1
+    assert calls == ["Same question?"]
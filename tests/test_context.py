@@ -0,0 +1,72 @@
+from llama_index.core.schema import NodeWithScore, TextNode
+from services.chat import ChatService, ChatMode
+from services.context import ContextPacker
+
+
+class WordPacker(ContextPacker):
+    """Counts words instead of loading a tokenizer."""
+
+    def count_tokens(self, node: NodeWithScore) -> int:
+        return len(node.node.get_content().split())
+
+
+def chunk(text, score, item_id="item", page=1, chunk_index=0):
+    return NodeWithScore(
+        node=TextNode(text=text, metadata={"item_id": item_id, "page": page, "chunk_index": chunk_index}),
+        score=score
+    )
+
+
+def test_packer_fills_the_budget_in_relevance_order():
+    nodes = [
+        chunk("a " * 6, 0.9, item_id="a"),
+        chunk("b " * 6, 0.8, item_id="b"),
+        chunk("c " * 3, 0.7, item_id="c"),
+        chunk("d " * 3, 0.6, item_id="d"),
+    ]
+
+    packed = WordPacker(token_budget=10).postprocess_nodes(nodes)
+
+    # The second chunk does not fit, smaller less relevant ones still do
+    assert [node.score for node in packed] == [0.9, 0.7]
+
+
+def test_packer_pays_for_overlapping_neighbours_once():
+    shared = "shared words repeated by the splitter between chunks"
+    first = chunk(f"start of the page {shared}", 0.5, chunk_index=0)
+    second = chunk(f"{shared} and the rest", 0.9, chunk_index=1)
+
+    packed = WordPacker(token_budget=100).postprocess_nodes([second, first])
+
+    assert len(packed) == 1
+    assert packed[0].node.get_content() == f"start of the page {shared} and the rest"
+    assert packed[0].score == 0.9
+
+
+def test_context_modes_retrieve_more_candidates_than_they_cite(db, monkeypatch):
+    requested = []
+
+    def build_retriever(self, conversation, top_k):
+        requested.append(top_k)
+        return None
+
+    monkeypatch.setattr(ChatService, "build_retriever", build_retriever)
+    service = ChatService(db)
+    service.context_overfetch = 4
+
+    for mode in (ChatMode.CONTEXT, ChatMode.CONDENSE_PLUS_CONTEXT, ChatMode.AGENT):
+        service.get_answer_nodes("question", None, None, [], mode=mode, top_k=3)
+
+    # The agent's query engine has no packer, so it gets exactly top_k
+    assert requested == [12, 12, 3]
+
+
+def test_batch_hands_the_packer_more_than_top_k_chunks(db, conversation, document, monkeypatch):
+    service = ChatService(db)
+    service.context_overfetch = 4
+    monkeypatch.setattr(service.embedding_service, "embed_texts", lambda texts: [[1.0] + [0.0] * 1535 for _ in texts])
+
+    batch = service.prepare_batch(conversation, ["question"], top_k=1)
+
+    assert batch.top_k == 1
+    assert sorted(node.node.get_content() for node in batch.retrieved[0]) == ["first chunk", "second chunk"]
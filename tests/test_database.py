@@ -0,0 +1,39 @@
+import psycopg
+import pytest
+from dependencies.database import DatabaseService
+
+
+@pytest.fixture
+def connect(pg_engine, monkeypatch):
+    """Connect to the scratch database through ``create_engine`` with a given driver."""
+    opened = []
+
+    def connect(drivername, threshold="5"):
+        monkeypatch.setenv("DB_PREPARE_THRESHOLD", threshold)
+        url = pg_engine.url.set(drivername=drivername).render_as_string(hide_password=False)
+        engine = DatabaseService().create_engine(url)
+        raw = engine.raw_connection()
+        opened.append((engine, raw))
+        return raw.driver_connection
+
+    yield connect
+    for engine, raw in opened:
+        raw.close()
+        engine.dispose()
+
+
+def test_urls_without_a_driver_prepare_statements_with_psycopg3(connect):
+    connection = connect("postgresql")
+
+    assert isinstance(connection, psycopg.Connection)
+    assert connection.prepare_threshold == 5
+
+
+def test_empty_threshold_disables_server_side_prepare(connect):
+    assert connect("postgresql", threshold="").prepare_threshold is None
+
+
+def test_explicit_psycopg2_is_kept(connect):
+    psycopg2 = pytest.importorskip("psycopg2")
+
+    assert isinstance(connect("postgresql+psycopg2"), psycopg2.extensions.connection)
@@ -0,0 +1,130 @@
+from sqlalchemy import select, text
+from llama_index.core.schema import TextNode
+from models.embedding import Embedding
+from models.item import Item
+from services.embedding import EmbeddingService, compute_chunk_hash
+from utils.bootstrap import init_database
+
+
+class FakeEmbedModel:
+    """Embedding provider double that records what it was asked to embed."""
+
+    def __init__(self):
+        self.batches = []
+
+    def get_text_embedding_batch(self, texts):
+        self.batches.append(list(texts))
+        return [[float(len(text))] + [0.0] * 1535 for text in texts]
+
+
+def nodes(*pages):
+    return [TextNode(text=text, metadata={'page_label': str(page)}) for page, text in pages]
+
+
+def embedding_service(db):
+    service = EmbeddingService(db, openai_api_key="test")
+    service._embed_model = FakeEmbedModel()
+    return service
+
+
+def make_item(db, conversation, chunks, hashed=True):
+    item = Item(
+        file_name="doc.pdf",
+        mime_type="application/pdf",
+        uri="upload://doc.pdf",
+        conversation_id=conversation.id,
+        owner_id=conversation.user_id,
+        active=True
+    )
+    db.add(item)
+    db.flush()
+    for page, chunk_index, chunk_text in chunks:
+        db.add(Embedding(
+            item_id=item.id,
+            conversation_id=conversation.id,
+            owner_id=conversation.user_id,
+            page=page,
+            chunk_index=chunk_index,
+            chunk_text=chunk_text,
+            content_hash=compute_chunk_hash(chunk_text) if hashed else None,
+            embedding=[1.0] + [0.0] * 1535
+        ))
+    db.commit()
+    return item
+
+
+def stored(db, item):
+    return {
+        (row.page, row.chunk_index): row
+        for row in db.execute(select(Embedding).where(Embedding.item_id == item.id)).scalars()
+    }
+
+
+def test_only_changed_chunks_are_embedded(db, conversation):
+    item = make_item(db, conversation, [(1, 0, "alpha"), (1, 1, "beta"), (2, 0, "gamma")])
+    before = stored(db, item)
+    service = embedding_service(db)
+
+    summary = service.sync_item_embeddings(item, nodes((1, "alpha"), (1, "beta edited"), (2, "gamma")))
+
+    assert service._embed_model.batches == [["beta edited"]]
+    assert summary == {"embedded_count": 1, "moved_count": 0, "deleted_count": 1, "unchanged_count": 2}
+    db.expire_all()
+    after = stored(db, item)
+    assert after[(1, 0)].id == before[(1, 0)].id
+    assert after[(1, 1)].chunk_text == "beta edited"
+    assert after[(1, 1)].content_hash == compute_chunk_hash("beta edited")
+
+
+def test_shifted_chunks_are_moved_not_embedded(db, conversation):
+    item = make_item(db, conversation, [(1, 0, "alpha"), (1, 1, "beta")])
+    service = embedding_service(db)
+
+    summary = service.sync_item_embeddings(item, nodes((1, "new"), (1, "alpha"), (1, "beta")))
+
+    assert service._embed_model.batches == [["new"]]
+    assert summary["moved_count"] == 2
+    db.expire_all()
+    assert [row.chunk_text for _, row in sorted(stored(db, item).items())] == ["new", "alpha", "beta"]
+
+
+def test_unhashed_rows_are_matched_by_text_and_backfilled(db, conversation):
+    item = make_item(db, conversation, [(1, 0, "alpha"), (1, 1, "beta")], hashed=False)
+    service = embedding_service(db)
+
+    summary = service.sync_item_embeddings(item, nodes((1, "alpha"), (1, "beta")))
+
+    assert service._embed_model.batches == []
+    assert summary["embedded_count"] == 0 and summary["deleted_count"] == 0
+    db.expire_all()
+    assert {row.content_hash for row in stored(db, item).values()} == {
+        compute_chunk_hash("alpha"), compute_chunk_hash("beta")
+    }
+
+
+def test_bootstrap_backfills_missing_hashes(pg_engine, db, conversation):
+    item = make_item(db, conversation, [(1, 0, "naïve text")], hashed=False)
+
+    init_database(pg_engine)
+
+    db.expire_all()
+    assert stored(db, item)[(1, 0)].content_hash == compute_chunk_hash("naïve text")
+    assert db.execute(text("SELECT count(*) FROM embeddings WHERE content_hash IS NULL")).scalar() == 0
+
+
+def test_replacing_the_document_resyncs_its_chunks(api, db, conversation, monkeypatch):
+    item = make_item(db, conversation, [(1, 0, "alpha"), (1, 1, "beta")])
+    embed_model = FakeEmbedModel()
+    monkeypatch.setattr(EmbeddingService, "embed_model", property(lambda self: embed_model))
+    monkeypatch.setattr(EmbeddingService, "chunk_pdf", lambda self, path: nodes((1, "alpha"), (1, "beta edited")))
+
+    response = api.put(
+        f"/api/v1/item/{item.id}/document",
+        files={"file": ("doc.pdf", b"%PDF-1.4 test", "application/pdf")}
+    )
+
+    assert response.status_code == 200
+    assert response.json()["embedded_count"] == 1
+    assert embed_model.batches == [["beta edited"]]
+    db.expire_all()
+    assert stored(db, item)[(1, 1)].chunk_text == "beta edited"
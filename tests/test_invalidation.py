@@ -0,0 +1,111 @@
+import threading
+import time
+import uuid
+import pytest
+from sqlalchemy import text
+import utils.invalidation
+from utils.invalidation import CHANNEL, InvalidationBus, publish
+
+TOPIC = "test_topic"
+
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.02)
+    return True
+
+
+@pytest.fixture
+def listener(pg_engine):
+    """A second worker's bus listening on its own connection."""
+    bus = InvalidationBus(poll_interval=0.1, max_backoff=1.0)
+    events = []
+    resets = []
+    received = threading.Condition()
+
+    def handle(key):
+        with received:
+            events.append(key)
+            received.notify_all()
+
+    bus.subscribe(TOPIC, handle)
+    bus.on_reset(lambda: resets.append(time.monotonic()))
+    bus.start(pg_engine)
+    assert wait_for(lambda: bus.connected)
+    try:
+        yield bus, events, resets
+    finally:
+        bus.stop()
+
+
+@pytest.fixture
+def local(monkeypatch):
+    """Payloads dispatched in this process right after commit."""
+    dispatched = []
+    monkeypatch.setattr(utils.invalidation.invalidation_bus, "dispatch", dispatched.append)
+    return dispatched
+
+
+def test_committed_events_reach_other_workers_and_this_one(db, listener, local):
+    bus, events, _ = listener
+    key = uuid.uuid4()
+
+    publish(db, TOPIC, key)
+    # Nothing is sent before the commit
+    time.sleep(0.3)
+    assert events == [] and local == []
+    db.commit()
+
+    assert wait_for(lambda: events == [str(key)])
+    assert len(local) == 1 and str(key) in local[0]
+    assert bus.received == 1
+
+
+def test_rolled_back_events_are_never_delivered(db, listener, local):
+    _, events, _ = listener
+
+    publish(db, TOPIC, "rolled back")
+    db.rollback()
+    # Notifications arrive in commit order, so once the marker is here the rollback's would be too
+    publish(db, TOPIC, "marker")
+    db.commit()
+
+    assert wait_for(lambda: "marker" in events)
+    assert events == ["marker"]
+    assert len(local) == 1 and "marker" in local[0]
+
+
+def test_lost_connection_resets_and_resumes_delivery(db, listener):
+    bus, events, resets = listener
+    assert len(resets) == 1
+
+    db.execute(text(
+        "SELECT pg_terminate_backend(pid) FROM pg_stat_activity "
+        "WHERE datname = current_database() AND query = :listen AND pid <> pg_backend_pid()"
+    ), {"listen": f"LISTEN {CHANNEL}"})
+    db.commit()
+
+    # Whatever was sent while disconnected is unknown, so caches are reset on reconnect
+    assert wait_for(lambda: len(resets) == 2)
+    assert bus.connected
+    publish(db, TOPIC, "after reconnect")
+    db.commit()
+    assert wait_for(lambda: events == ["after reconnect"])
+
+
+def test_malformed_and_failing_handlers_do_not_stop_dispatch():
+    bus = InvalidationBus()
+    seen = []
+
+    def failing(key):
+        raise RuntimeError("boom")
+
+    bus.subscribe(TOPIC, failing)
+    bus.subscribe(TOPIC, seen.append)
+    bus.dispatch("not json")
+    bus.dispatch('{"topic": "test_topic", "key": "k"}')
+
+    assert seen == ["k"]
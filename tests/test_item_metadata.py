@@ -0,0 +1,31 @@
+from services.item import ItemService
+
+
+def test_hard_deleted_items_are_not_described_from_memory(db, user, document):
+    service = ItemService(db)
+    assert document.id in service.get_item_metadata([document.id])
+
+    assert service.hard_delete_item(user, document.id)
+
+    assert service.get_item_metadata([document.id]) == {}
+
+
+def test_deactivated_items_are_read_again(db, user, document):
+    service = ItemService(db)
+    before = service.get_item_metadata([document.id])[document.id].last_updated
+
+    assert service.delete_item(user, document.id)
+
+    assert service.get_item_metadata([document.id])[document.id].last_updated != before
+
+
+def test_conversation_deletes_drop_the_metadata_of_their_items(db, user, conversation, document):
+    service = ItemService(db)
+    item_id = document.id
+    before = service.get_item_metadata([item_id])[item_id].last_updated
+
+    assert service.delete_conversation_items(conversation, user)["deleted_count"] == 1
+    assert service.get_item_metadata([item_id])[item_id].last_updated != before
+
+    assert service.delete_conversation_items(conversation, user, permanent=True)["deleted_count"] == 1
+    assert service.get_item_metadata([item_id]) == {}
@@ -0,0 +1,45 @@
+import io
+import pypdf
+import pytest
+from pypdf import PdfWriter
+from utils import parsing
+
+
+@pytest.fixture
+def pdf(tmp_path):
+    """A three page PDF without text."""
+    writer = PdfWriter()
+    for _ in range(3):
+        writer.add_blank_page(width=72, height=72)
+    path = tmp_path / "doc.pdf"
+    with open(path, "wb") as fh:
+        writer.write(fh)
+    return str(path)
+
+
+@pytest.fixture
+def readers(monkeypatch):
+    """Records what every ``PdfReader`` was opened from."""
+    sources = []
+    reader = pypdf.PdfReader
+
+    def recording_reader(stream, *args, **kwargs):
+        sources.append(stream)
+        return reader(stream, *args, **kwargs)
+
+    monkeypatch.setattr(pypdf, "PdfReader", recording_reader)
+    return sources
+
+
+def test_pdfs_are_read_from_an_open_file(pdf, readers):
+    assert parsing.count_pdf_pages(pdf) == 3
+    assert parsing.parse_page_range(pdf, 0, 3, 100, 10) == [(1, []), (2, []), (3, [])]
+
+    assert len(readers) == 2
+    assert all(isinstance(source, io.BufferedReader) for source in readers)
+
+
+def test_a_known_page_count_is_not_counted_again(pdf, readers):
+    assert [page for page, _ in parsing.iter_pdf_chunks(pdf, 100, 10, page_count=3)] == [1, 2, 3]
+
+    assert len(readers) == 1
@@ -0,0 +1,65 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+import utils.profiling
+from utils.profiling import ProfilingMiddleware, is_authorized
+
+SECRET = "s3cret-ü"
+
+
+@pytest.fixture
+def secret(monkeypatch):
+    monkeypatch.setattr(utils.profiling, "PROFILE_SECRET", SECRET)
+    return SECRET
+
+
+@pytest.fixture
+def client(secret, tmp_path):
+    app = FastAPI()
+
+    @app.get("/ping")
+    def ping():
+        return {"ok": True}
+
+    app.add_middleware(ProfilingMiddleware, directory=str(tmp_path))
+    return TestClient(app)
+
+
+def test_secret_matches_as_header_bytes_or_latin1_string(secret):
+    raw = secret.encode()
+    assert is_authorized(raw)
+    # What an ASGI server hands to Header() parameters
+    assert is_authorized(raw.decode("latin-1"))
+
+
+def test_wrong_or_non_ascii_secrets_are_refused_without_errors(secret):
+    assert not is_authorized("wrong")
+    assert not is_authorized("wröng")
+    assert not is_authorized("密码")
+    assert not is_authorized(b"\xff\xfe")
+    assert not is_authorized(None)
+    assert not is_authorized("")
+
+
+def test_disabled_profiling_refuses_everything(monkeypatch):
+    monkeypatch.setattr(utils.profiling, "PROFILE_SECRET", "")
+    assert not is_authorized("")
+    assert not is_authorized("anything")
+
+
+def test_header_secret_profiles_the_request(client, secret):
+    response = client.get("/ping", headers={"X-Profile": secret.encode()})
+    assert response.status_code == 200
+    assert "x-profile-id" in response.headers
+
+
+def test_query_parameter_secret_is_ignored(client, secret):
+    response = client.get("/ping", params={"profile": secret})
+    assert response.status_code == 200
+    assert "x-profile-id" not in response.headers
+
+
+def test_non_ascii_header_is_not_a_server_error(client):
+    response = client.get("/ping", headers={"X-Profile": "wröng".encode()})
+    assert response.status_code == 200
+    assert "x-profile-id" not in response.headers
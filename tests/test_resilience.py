@@ -0,0 +1,190 @@
+import asyncio
+import time
+import pytest
+from utils.resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    DeadlineExceeded,
+    DeadlineMiddleware,
+    acall_with_retries,
+    call_with_retries,
+    deadline_scope,
+    remaining,
+)
+
+
+class Flaky:
+    """Dependency double failing the first ``failures`` calls."""
+
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise ConnectionError("injected")
+        return "ok"
+
+
+def call(breaker, fn, attempts=1):
+    return call_with_retries(fn, breaker=breaker, retry_on=(ConnectionError,), attempts=attempts, base_delay=0)
+
+
+def trip(breaker):
+    for _ in range(breaker.failure_threshold):
+        with pytest.raises(ConnectionError):
+            call(breaker, Flaky(1))
+    assert breaker.state == "open"
+
+
+def test_breaker_opens_after_consecutive_failures_and_short_circuits():
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=60)
+    trip(breaker)
+    dependency = Flaky(0)
+    with pytest.raises(CircuitOpenError) as error:
+        call(breaker, dependency)
+    assert dependency.calls == 0
+    assert error.value.retry_after > 0
+
+
+def test_success_resets_the_failure_count():
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=60)
+    with pytest.raises(ConnectionError):
+        call(breaker, Flaky(1))
+    assert call(breaker, Flaky(0)) == "ok"
+    with pytest.raises(ConnectionError):
+        call(breaker, Flaky(1))
+    assert breaker.state == "closed"
+
+
+def test_half_open_lets_one_trial_through_and_recovers():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0.05)
+    trip(breaker)
+    time.sleep(0.06)
+    assert breaker.state == "half_open"
+    trial = breaker.before_call()
+    assert trial is not None
+    # Everyone else is still short-circuited while the trial runs
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_success()
+    breaker.end_trial(trial)
+    assert breaker.state == "closed"
+    assert call(breaker, Flaky(0)) == "ok"
+
+
+def test_failed_trial_reopens_the_circuit():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0.05)
+    trip(breaker)
+    time.sleep(0.06)
+    with pytest.raises(ConnectionError):
+        call(breaker, Flaky(1))
+    assert breaker.state == "open"
+
+
+class Interrupted(BaseException):
+    pass
+
+
+def test_interrupted_trial_does_not_keep_the_circuit_open():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0.05)
+    trip(breaker)
+    time.sleep(0.06)
+
+    def interrupted():
+        raise Interrupted()
+
+    with pytest.raises(Interrupted):
+        call(breaker, interrupted)
+    # The next caller becomes the trial instead of being rejected forever
+    assert call(breaker, Flaky(0)) == "ok"
+    assert breaker.state == "closed"
+
+
+def test_cancelled_async_trial_does_not_keep_the_circuit_open():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0.05)
+    trip(breaker)
+    time.sleep(0.06)
+
+    async def hang():
+        await asyncio.sleep(60)
+
+    async def ok():
+        return "ok"
+
+    async def scenario():
+        task = asyncio.create_task(
+            acall_with_retries(hang, breaker=breaker, retry_on=(ConnectionError,), attempts=1)
+        )
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return await acall_with_retries(ok, breaker=breaker, retry_on=(ConnectionError,), attempts=1)
+
+    assert asyncio.run(scenario()) == "ok"
+    assert breaker.state == "closed"
+
+
+def test_stale_trial_token_does_not_release_a_newer_trial():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0.01)
+    trip(breaker)
+    time.sleep(0.02)
+    first = breaker.before_call()
+    breaker.record_failure()
+    time.sleep(0.02)
+    second = breaker.before_call()
+    breaker.end_trial(first)
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.end_trial(second)
+
+
+def test_retries_stop_when_the_budget_cannot_cover_another_attempt():
+    breaker = CircuitBreaker("test", failure_threshold=10, reset_timeout=60)
+
+    def slow_failure():
+        time.sleep(0.05)
+        raise ConnectionError("injected")
+
+    calls = []
+    with deadline_scope(0.08):
+        with pytest.raises(ConnectionError):
+            call_with_retries(
+                lambda: calls.append(1) or slow_failure(),
+                breaker=breaker, retry_on=(ConnectionError,), attempts=5, base_delay=0
+            )
+    assert len(calls) == 1
+
+
+def test_spent_budget_raises_before_calling():
+    breaker = CircuitBreaker("test")
+    dependency = Flaky(0)
+    with deadline_scope(0):
+        with pytest.raises(DeadlineExceeded):
+            call(breaker, dependency)
+    assert dependency.calls == 0
+
+
+def request_budget(header=None):
+    """Budget a request gets from ``DeadlineMiddleware`` with the given ``X-Request-Timeout``."""
+    seen = []
+
+    async def app(scope, receive, send):
+        seen.append(remaining())
+
+    headers = [] if header is None else [(b"x-request-timeout", header)]
+    middleware = DeadlineMiddleware(app, default_seconds=10, max_seconds=30)
+    asyncio.run(middleware({"type": "http", "headers": headers}, None, None))
+    return seen[0]
+
+
+def test_requested_timeout_is_capped():
+    assert 4 < request_budget(b"5") <= 5
+    assert 29 < request_budget(b"60") <= 30
+
+
+@pytest.mark.parametrize("header", [b"nan", b"inf", b"-inf", b"0", b"-5", b"soon"])
+def test_unusable_requested_timeouts_get_the_default(header):
+    assert 9 < request_budget(header) <= 10
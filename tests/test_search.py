@@ -0,0 +1,116 @@
+import uuid
+import pytest
+from sqlalchemy import text
+import services.embedding
+from models.conversation import Conversation
+from models.embedding import Embedding
+from models.item import Item
+from models.user import User
+from services.embedding import EmbeddingModelUnavailable, EmbeddingService, supports_iterative_scan
+
+DIMENSIONS = 1536
+
+
+def vector(*head):
+    return list(head) + [0.0] * (DIMENSIONS - len(head))
+
+
+class QueryModel:
+    def get_query_embedding(self, query):
+        return vector(1.0)
+
+
+def add_document(db, owner, chunks):
+    conversation = Conversation(user_id=owner.id, title="Search", context="")
+    db.add(conversation)
+    db.flush()
+    item = Item(
+        file_name="doc.pdf",
+        mime_type="application/pdf",
+        uri="upload://doc.pdf",
+        conversation_id=conversation.id,
+        owner_id=owner.id,
+        active=True
+    )
+    db.add(item)
+    db.flush()
+    for chunk_index, embedding in enumerate(chunks):
+        db.add(Embedding(
+            item_id=item.id,
+            conversation_id=conversation.id,
+            owner_id=owner.id,
+            page=1,
+            chunk_index=chunk_index,
+            chunk_text=f"chunk {chunk_index}",
+            embedding=embedding
+        ))
+    db.commit()
+    return item
+
+
+@pytest.fixture
+def crowded(db, user):
+    """Five chunks of ``user`` far from the query behind 200 closer chunks of someone else."""
+    other = User(email=f"{uuid.uuid4().hex}@example.com", display_name="Other")
+    db.add(other)
+    db.commit()
+    add_document(db, other, [vector(1.0, 0.001 * i) for i in range(200)])
+    return add_document(db, user, [vector(0.1 * (i + 1), 1.0) for i in range(5)])
+
+
+def test_filtered_search_fills_the_page_past_the_graph_candidates(db, user, crowded):
+    service = EmbeddingService(db)
+    service._embed_model = QueryModel()
+    # Make the planner walk the HNSW graph even on a small table; rolled back below
+    db.execute(text("SET LOCAL enable_seqscan = off"))
+    db.execute(text("SET LOCAL enable_bitmapscan = off"))
+    db.execute(text("SET LOCAL enable_sort = off"))
+    db.execute(text("DROP INDEX ix_embeddings_owner_active"))
+    try:
+        results = service.search_owner_chunks(owner_id=user.id, query="q", limit=5)
+        second_page = service.search_owner_chunks(owner_id=user.id, query="q", limit=3, offset=3)
+    finally:
+        db.rollback()
+
+    assert [result.text for result in results] == [f"chunk {i}" for i in range(4, -1, -1)]
+    assert all(result.item_id == crowded.id for result in results)
+    assert [result.text for result in second_page] == ["chunk 1", "chunk 0"]
+
+
+def test_iterative_scan_is_detected_from_the_installed_pgvector(db):
+    version = db.execute(text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")).scalar()
+    major, minor = (int(part) for part in version.split('.')[:2])
+
+    assert supports_iterative_scan(db) == ((major, minor) >= (0, 8))
+
+
+def test_iterative_scan_can_be_turned_off(db, user, crowded, monkeypatch):
+    monkeypatch.setattr(services.embedding, "SEARCH_ITERATIVE_SCAN", "off")
+    service = EmbeddingService(db)
+    service._embed_model = QueryModel()
+
+    assert len(service.search_owner_chunks(owner_id=user.id, query="q", limit=5)) == 5
+
+
+def test_search_without_an_embedding_model_is_a_clear_error(db, user):
+    service = EmbeddingService(db, openai_api_key=None)
+
+    with pytest.raises(EmbeddingModelUnavailable):
+        service.search_owner_chunks(owner_id=user.id, query="q")
+
+
+def test_search_endpoint_answers_503_without_an_embedding_model(api, monkeypatch):
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+
+    response = api.get("/api/v1/search", params={"q": "anything"})
+
+    assert response.status_code == 503
+
+
+def test_bootstrap_drops_the_ivfflat_index(db):
+    indexes = db.execute(text(
+        "SELECT indexname FROM pg_indexes WHERE tablename = 'embeddings'"
+    )).scalars().all()
+
+    assert "embeddings_embedding_idx" not in indexes
+    assert "embeddings_embedding_hnsw_idx" in indexes
@@ -0,0 +1,18 @@
+from dependencies.security import COGNITO_TIMEOUT, cognito_client_for_deadline
+from utils.resilience import deadline_scope
+
+
+def test_cognito_client_uses_full_timeout_without_deadline():
+    assert cognito_client_for_deadline().meta.config.read_timeout == COGNITO_TIMEOUT
+
+
+def test_cognito_client_timeout_follows_remaining_budget():
+    with deadline_scope(1.1):
+        config = cognito_client_for_deadline().meta.config
+    assert config.read_timeout <= 1.1
+    assert config.connect_timeout <= config.read_timeout
+
+
+def test_cognito_client_keeps_a_minimal_timeout_near_the_deadline():
+    with deadline_scope(0.05):
+        assert cognito_client_for_deadline().meta.config.read_timeout > 0
@@ -0,0 +1,134 @@
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+import pytest
+from sqlalchemy import func, select, update
+import services.context
+from models.conversation import Conversation
+from models.message import Message, MessageRole
+from routes.chat import refresh_conversation_summary
+from services.chat import ChatService
+from utils.resilience import deadline_scope
+
+
+class WordEncoding:
+    def encode(self, text):
+        return text.split()
+
+    def decode(self, tokens):
+        return " ".join(tokens)
+
+
+class FakeLLM:
+    model = "gpt-4o"
+
+    def __init__(self, during_call=None):
+        self.during_call = during_call
+        self.prompts = []
+
+    def chat(self, prompt):
+        self.prompts.append(prompt)
+        if self.during_call:
+            self.during_call()
+        return SimpleNamespace(message=SimpleNamespace(content="the new summary"))
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    fake = FakeLLM()
+    monkeypatch.setattr(ChatService, "llm", property(lambda self: fake))
+    monkeypatch.setattr(services.context, "get_encoding", lambda model: WordEncoding())
+    return fake
+
+
+@pytest.fixture
+def turns(db, conversation):
+    """Ten messages, enough for the oldest four to be folded into the summary."""
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    messages = [
+        Message(
+            conversation_id=conversation.id,
+            user_id=conversation.user_id,
+            role=MessageRole.USER if i % 2 == 0 else MessageRole.ASSISTANT,
+            content=f"message {i}",
+            created_at=start + timedelta(minutes=i)
+        )
+        for i in range(10)
+    ]
+    db.add_all(messages)
+    db.commit()
+    return messages
+
+
+def summary_of(db, conversation):
+    db.expire_all()
+    return db.get(Conversation, conversation.id)
+
+
+def test_old_turns_are_folded_into_the_summary(db, conversation, turns, llm):
+    assert ChatService(db).refresh_summary(conversation.id)
+
+    stored = summary_of(db, conversation)
+    assert stored.summary == "the new summary"
+    assert stored.summarized_until == turns[3].created_at
+    assert "message 3" in llm.prompts[0][0].content
+    assert "message 4" not in llm.prompts[0][0].content
+
+
+def test_a_backlog_longer_than_one_fold_is_folded_oldest_first(db, conversation, turns, llm, monkeypatch):
+    # Four messages per fold, the last two turns kept
+    monkeypatch.setattr(ChatService, "history_limit", property(lambda self: 1))
+    service = ChatService(db)
+    service.history_turns = 2
+
+    assert service.refresh_summary(conversation.id)
+    assert summary_of(db, conversation).summarized_until == turns[3].created_at
+    assert "message 0" in llm.prompts[0][0].content
+
+    assert service.refresh_summary(conversation.id)
+    assert summary_of(db, conversation).summarized_until == turns[5].created_at
+    assert "message 4" in llm.prompts[1][0].content
+    assert "message 6" not in llm.prompts[1][0].content
+
+    assert not service.refresh_summary(conversation.id)
+
+
+def test_no_transaction_or_lock_is_held_during_the_llm_call(db, pg_engine, conversation, turns, llm):
+    service = ChatService(db)
+    seen = {}
+
+    def during_call():
+        seen["in_transaction"] = service.db.in_transaction()
+        with pg_engine.connect() as other:
+            seen["lock_free"] = other.execute(
+                select(func.pg_try_advisory_xact_lock(func.hashtext(str(conversation.id))))
+            ).scalar()
+            other.rollback()
+
+    llm.during_call = during_call
+
+    assert service.refresh_summary(conversation.id)
+    assert seen == {"in_transaction": False, "lock_free": True}
+
+
+def test_summary_of_a_refresh_that_lost_the_race_is_dropped(db, pg_engine, conversation, turns, llm):
+    def concurrent_refresh():
+        with pg_engine.begin() as other:
+            other.execute(
+                update(Conversation)
+                .where(Conversation.id == conversation.id)
+                .values(summary="written first", summarized_until=turns[5].created_at)
+            )
+
+    llm.during_call = concurrent_refresh
+
+    assert not ChatService(db).refresh_summary(conversation.id)
+    stored = summary_of(db, conversation)
+    assert stored.summary == "written first"
+    assert stored.summarized_until == turns[5].created_at
+
+
+def test_background_refresh_is_not_bound_by_the_spent_request_deadline(api, db, conversation, turns, llm):
+    with deadline_scope(0.0):
+        refresh_conversation_summary(conversation.id)
+
+    assert summary_of(db, conversation).summary == "the new summary"
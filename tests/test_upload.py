@@ -0,0 +1,154 @@
+import asyncio
+import os
+import threading
+import time
+import httpx
+import orjson
+import pytest
+import main
+from dependencies.database import db_service
+from models.item import Item
+from routes.item import UploadSizeLimitMiddleware
+from schemas.item import UploadProgress
+from services.embedding import EmbeddingService
+
+
+@pytest.fixture
+def ingest(monkeypatch):
+    """Replaces PDF ingestion by two slow steps recording what they saw."""
+    calls = {"paths": [], "closed": []}
+    in_batch = threading.Event()
+
+    def ingest_pdf(self, item, path):
+        calls["paths"].append(path)
+        item_id = item.id
+        try:
+            yield UploadProgress(status="parsing", item_id=item_id, pages_total=2, pages_done=0, chunks_done=0)
+            # A batch still being embedded when the client goes away
+            in_batch.set()
+            time.sleep(0.2)
+            yield UploadProgress(status="ingesting", item_id=item_id, pages_total=2, pages_done=1, chunks_done=1)
+            yield UploadProgress(status="ingesting", item_id=item_id, pages_total=2, pages_done=2, chunks_done=2)
+        finally:
+            session = db_service.session()
+            try:
+                calls["closed"].append({
+                    "item_exists": session.get(Item, item_id) is not None,
+                    "spool_exists": os.path.exists(path),
+                })
+            finally:
+                session.close()
+
+    monkeypatch.setattr(EmbeddingService, "ingest_pdf", ingest_pdf)
+    calls["in_batch"] = in_batch
+    return calls
+
+
+def upload_request(conversation_id, content=b"%PDF-1.4 test"):
+    return httpx.Request(
+        "POST",
+        "http://testserver/api/v1/item/upload",
+        data={"conversation_id": str(conversation_id)},
+        files={"file": ("doc.pdf", content, "application/pdf")},
+    )
+
+
+def run_asgi(app, request, disconnect=None):
+    """
+    Send ``request`` to ``app``; the client disconnects once ``disconnect`` is set.
+
+    Returns the messages sent and whether the body was read.
+    """
+    body = request.read()
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": request.method,
+        "scheme": "http",
+        "path": request.url.path,
+        "raw_path": request.url.raw_path,
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(k.lower(), v) for k, v in request.headers.raw],
+        "client": ("testclient", 50000),
+        "server": ("testserver", 80),
+    }
+    sent = []
+    state = {"body_read": False}
+
+    async def receive():
+        if not state["body_read"]:
+            state["body_read"] = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        if disconnect is None:
+            await asyncio.Event().wait()
+        while not disconnect.is_set():
+            await asyncio.sleep(0.01)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(app(scope, receive, send))
+    return sent, state["body_read"]
+
+
+def streamed_lines(sent):
+    body = b"".join(m.get("body", b"") for m in sent if m["type"] == "http.response.body")
+    return [orjson.loads(line) for line in body.splitlines()]
+
+
+def test_disconnect_stops_the_ingest_before_removing_the_item(api, db, conversation, ingest):
+    sent, _ = run_asgi(main.app, upload_request(conversation.id), disconnect=ingest["in_batch"])
+
+    assert sent[0]["status"] == 200
+    assert [line["status"] for line in streamed_lines(sent)][-1] != "done"
+    # The ingest was closed while its item and spool file still existed
+    assert ingest["closed"] == [{"item_exists": True, "spool_exists": True}]
+    assert not os.path.exists(ingest["paths"][0])
+    assert db.query(Item).filter(Item.conversation_id == conversation.id).count() == 0
+
+
+def test_completed_upload_activates_the_item_and_removes_the_spool(api, db, conversation, ingest):
+    response = api.post(
+        "/api/v1/item/upload",
+        data={"conversation_id": str(conversation.id)},
+        files={"file": ("doc.pdf", b"%PDF-1.4 test", "application/pdf")},
+    )
+
+    lines = [orjson.loads(line) for line in response.content.splitlines()]
+    assert [line["status"] for line in lines] == ["uploaded", "parsing", "ingesting", "ingesting", "done"]
+    item = db.query(Item).filter(Item.conversation_id == conversation.id).one()
+    assert item.active
+    assert ingest["closed"] == [{"item_exists": True, "spool_exists": True}]
+    assert not os.path.exists(ingest["paths"][0])
+
+
+def test_oversized_upload_is_refused_before_its_body_is_read():
+    async def route(scope, receive, send):
+        raise AssertionError("the route must not run")
+
+    app = UploadSizeLimitMiddleware(route, max_bytes=1024, prefix="/api/v1/item")
+    request = upload_request("00000000-0000-0000-0000-000000000000", content=b"x" * 200_000)
+
+    sent, body_read = run_asgi(app, request)
+
+    assert sent[0]["status"] == 413
+    assert not body_read
+
+
+def test_uploads_within_the_limit_pass_through():
+    seen = []
+
+    async def route(scope, receive, send):
+        seen.append(scope["path"])
+        await send({"type": "http.response.start", "status": 204, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    app = UploadSizeLimitMiddleware(route, max_bytes=1024, prefix="/api/v1/item")
+
+    sent, _ = run_asgi(app, upload_request("00000000-0000-0000-0000-000000000000"))
+
+    assert seen == ["/api/v1/item/upload"]
+    assert sent[0]["status"] == 204
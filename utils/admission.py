@@ -0,0 +1,128 @@
+import asyncio
+import math
+import os
+import time
+from typing import Dict, Optional
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted; carries a Retry-After hint in seconds."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Global and per-key concurrency limits with a bounded, timed wait queue.
+
+    Requests that cannot start immediately wait on the event loop (not in a
+    worker thread) for at most ``queue_timeout`` seconds. When ``max_queue``
+    requests are already waiting, new ones are rejected at once.
+    """
+
+    def __init__(self, global_limit: int, per_key_limit: int, max_queue: int, queue_timeout: float):
+        self.global_limit = global_limit
+        self.per_key_limit = per_key_limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._condition: Optional[asyncio.Condition] = None
+        self._active_total = 0
+        self._active: Dict[str, int] = {}
+        self._waiting = 0
+        self._admitted = 0
+        self._rejected_queue_full = 0
+        self._rejected_timeout = 0
+        self._wait_seconds_total = 0.0
+        self._wait_seconds_max = 0.0
+        self._hold_seconds_total = 0.0
+        self._released = 0
+
+    @classmethod
+    def from_env(cls, prefix: str) -> "AdmissionController":
+        return cls(
+            global_limit=int(os.getenv(f"{prefix}_GLOBAL_CONCURRENCY", "32")),
+            per_key_limit=int(os.getenv(f"{prefix}_USER_CONCURRENCY", "4")),
+            max_queue=int(os.getenv(f"{prefix}_QUEUE_SIZE", "64")),
+            queue_timeout=float(os.getenv(f"{prefix}_QUEUE_TIMEOUT", "10"))
+        )
+
+    @property
+    def condition(self) -> asyncio.Condition:
+        # Created lazily so it belongs to the server's event loop
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    def _can_start(self, key: str) -> bool:
+        return self._active_total < self.global_limit and self._active.get(key, 0) < self.per_key_limit
+
+    def _retry_after(self) -> int:
+        average_hold = self._hold_seconds_total / self._released if self._released else 1.0
+        return max(1, math.ceil(average_hold))
+
+    async def acquire(self, key: str, timeout: Optional[float] = None) -> float:
+        """
+        Take a slot for ``key``, waiting in the queue if needed.
+
+        Args:
+            key (str): Caller identity the per-key limit applies to
+            timeout (Optional[float]): Maximum wait, capped at ``queue_timeout``
+
+        Returns:
+            float: Seconds spent waiting
+
+        Raises:
+            AdmissionRejected: If the queue is full or the wait timed out
+        """
+        async with self.condition:
+            start = time.monotonic()
+            if not self._can_start(key):
+                if self._waiting >= self.max_queue:
+                    self._rejected_queue_full += 1
+                    raise AdmissionRejected("Too many queued requests", self._retry_after())
+                self._waiting += 1
+                try:
+                    await asyncio.wait_for(
+                        self.condition.wait_for(lambda: self._can_start(key)),
+                        timeout=self.queue_timeout if timeout is None else min(timeout, self.queue_timeout)
+                    )
+                except asyncio.TimeoutError:
+                    self._rejected_timeout += 1
+                    raise AdmissionRejected("Timed out waiting for capacity", self._retry_after())
+                finally:
+                    self._waiting -= 1
+            waited = time.monotonic() - start
+            self._active_total += 1
+            self._active[key] = self._active.get(key, 0) + 1
+            self._admitted += 1
+            self._wait_seconds_total += waited
+            self._wait_seconds_max = max(self._wait_seconds_max, waited)
+            return waited
+
+    async def release(self, key: str, held_seconds: float = 0.0) -> None:
+        """Give back a slot taken by ``acquire`` and wake up waiters."""
+        async with self.condition:
+            self._active_total -= 1
+            remaining = self._active.get(key, 1) - 1
+            if remaining:
+                self._active[key] = remaining
+            else:
+                self._active.pop(key, None)
+            self._released += 1
+            self._hold_seconds_total += held_seconds
+            self.condition.notify_all()
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "active": self._active_total,
+            "active_keys": len(self._active),
+            "queue_depth": self._waiting,
+            "admitted_total": self._admitted,
+            "rejected_queue_full_total": self._rejected_queue_full,
+            "rejected_timeout_total": self._rejected_timeout,
+            "wait_seconds_total": self._wait_seconds_total,
+            "wait_seconds_max": self._wait_seconds_max,
+        }
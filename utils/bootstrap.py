@@ -0,0 +1,150 @@
+"""
+Explicit database bootstrap: extensions, tables, indexes and in-place upgrades.
+
+Run once per deploy (or whenever the models change) instead of at import time:
+
+    python -m utils.bootstrap
+"""
+import logging
+import os
+from dotenv import load_dotenv, find_dotenv
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine
+import models  # noqa: F401 - registers every model on Base.metadata
+from models.base import Base
+
+logger = logging.getLogger(__name__)
+
+# Idempotent statements that bring databases created by older versions of the
+# models up to date; create_all only creates missing tables.
+UPGRADE_STATEMENTS = [
+    "ALTER TABLE embeddings ADD COLUMN IF NOT EXISTS chunk_index INTEGER NOT NULL DEFAULT 0",
+    "ALTER TABLE embeddings ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)",
+    "ALTER TABLE embeddings ADD COLUMN IF NOT EXISTS item_active BOOLEAN NOT NULL DEFAULT true",
+    "ALTER TABLE embeddings ADD COLUMN IF NOT EXISTS owner_id UUID REFERENCES users(id) ON DELETE CASCADE",
+    "ALTER TABLE embeddings DROP CONSTRAINT IF EXISTS uix_item_page",
+    """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'uix_item_page_chunk') THEN
+            ALTER TABLE embeddings ADD CONSTRAINT uix_item_page_chunk
+                UNIQUE (item_id, page, chunk_index) DEFERRABLE INITIALLY DEFERRED;
+        END IF;
+    END $$;
+    """,
+    """
+    DO $$
+    BEGIN
+        IF EXISTS (
+            SELECT 1 FROM pg_constraint
+            WHERE conname = 'messages_source_embedding_id_fkey' AND confdeltype <> 'n'
+        ) THEN
+            ALTER TABLE messages DROP CONSTRAINT messages_source_embedding_id_fkey;
+            ALTER TABLE messages ADD CONSTRAINT messages_source_embedding_id_fkey
+                FOREIGN KEY (source_embedding_id) REFERENCES embeddings(id) ON DELETE SET NULL;
+        END IF;
+    END $$;
+    """,
+    """
+    UPDATE embeddings e SET owner_id = i.owner_id
+    FROM items i
+    WHERE i.id = e.item_id AND e.owner_id IS NULL
+    """,
+    # Hash chunks stored before content hashes existed (same digest as compute_chunk_hash)
+    """
+    UPDATE embeddings SET content_hash = encode(sha256(convert_to(chunk_text, 'UTF8')), 'hex')
+    WHERE content_hash IS NULL
+    """,
+    "ALTER TABLE conversations ADD COLUMN IF NOT EXISTS summary TEXT",
+    "ALTER TABLE conversations ADD COLUMN IF NOT EXISTS summarized_until TIMESTAMP WITH TIME ZONE",
+    "ALTER TABLE messages ADD COLUMN IF NOT EXISTS idempotency_key VARCHAR(255)",
+    "ALTER TABLE message_archive_segments ADD COLUMN IF NOT EXISTS message_ids UUID[]",
+    """
+    UPDATE embeddings e SET item_active = COALESCE(i.active, true)
+    FROM items i
+    WHERE i.id = e.item_id AND e.item_active IS DISTINCT FROM COALESCE(i.active, true)
+    """,
+    # Superseded by the partial HNSW index; every insert was paying for both
+    "DROP INDEX IF EXISTS embeddings_embedding_idx",
+    # Listing stats: added and backfilled once; afterwards the services keep them current
+    """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = 'conversations' AND column_name = 'message_count'
+        ) THEN
+            ALTER TABLE conversations
+                ADD COLUMN IF NOT EXISTS active_item_count INTEGER NOT NULL DEFAULT 0,
+                ADD COLUMN IF NOT EXISTS chunk_count INTEGER NOT NULL DEFAULT 0,
+                ADD COLUMN message_count INTEGER NOT NULL DEFAULT 0,
+                ADD COLUMN IF NOT EXISTS last_message_at TIMESTAMP WITH TIME ZONE,
+                ADD COLUMN IF NOT EXISTS last_message_preview VARCHAR(200);
+            UPDATE conversations c SET
+                active_item_count = (SELECT count(*) FROM items i WHERE i.conversation_id = c.id AND i.active),
+                chunk_count = (SELECT count(*) FROM embeddings e WHERE e.conversation_id = c.id AND e.item_active),
+                message_count = (SELECT count(*) FROM messages m WHERE m.conversation_id = c.id),
+                last_message_at = (SELECT max(m.created_at) FROM messages m WHERE m.conversation_id = c.id),
+                last_message_preview = (
+                    SELECT left(m.content, 200) FROM messages m
+                    WHERE m.conversation_id = c.id
+                    ORDER BY m.created_at DESC LIMIT 1
+                );
+        END IF;
+    END $$;
+    """,
+]
+
+INDEX_STATEMENTS = [
+    # Owner-scoped search walks this graph; filters are applied during the scan
+    """
+    CREATE INDEX IF NOT EXISTS embeddings_embedding_hnsw_idx
+    ON embeddings USING hnsw (embedding vector_cosine_ops) WHERE item_active
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_embeddings_conversation_active ON embeddings (conversation_id) WHERE item_active",
+    "CREATE INDEX IF NOT EXISTS ix_embeddings_owner_active ON embeddings (owner_id) WHERE item_active",
+    "CREATE INDEX IF NOT EXISTS items_active_idx ON items (active)",
+    "CREATE INDEX IF NOT EXISTS items_conversation_id_idx ON items (conversation_id)",
+    "CREATE INDEX IF NOT EXISTS embeddings_item_id_idx ON embeddings (item_id)",
+    "CREATE INDEX IF NOT EXISTS ix_messages_conversation_created ON messages (conversation_id, created_at)",
+    # A partitioned messages table has this index per partition (see utils.partitioning)
+    """
+    DO $$
+    BEGIN
+        IF (SELECT relkind FROM pg_class WHERE oid = 'messages'::regclass) <> 'p' THEN
+            CREATE UNIQUE INDEX IF NOT EXISTS uix_messages_idempotency
+            ON messages (conversation_id, idempotency_key, role) WHERE idempotency_key IS NOT NULL;
+        END IF;
+    END $$;
+    """,
+]
+
+
+def init_database(engine: Engine) -> None:
+    """
+    Create the pgvector extension, all tables and indexes, and apply upgrades.
+
+    Args:
+        engine (Engine): Engine connected to the target database
+    """
+    with engine.begin() as conn:
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector;"))
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        for statement in UPGRADE_STATEMENTS + INDEX_STATEMENTS:
+            conn.execute(text(statement))
+    logger.info(f"Database initialized: {', '.join(sorted(Base.metadata.tables))}")
+
+
+def main():
+    load_dotenv(find_dotenv())
+    logging.basicConfig(level=logging.INFO)
+    engine = create_engine(os.environ['DATABASE_URL'])
+    try:
+        init_database(engine)
+    finally:
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,592 @@
+"""
+Shared cache for the service layer, with interchangeable backends.
+
+``CACHE_BACKEND`` selects where entries live:
+
+- ``memory``: an LRU dict in each worker process (the default)
+- ``sqlite``: one SQLite file (``CACHE_SQLITE_PATH``, on tmpfs when
+  available) shared by every worker on the host
+- ``redis``: any server speaking the Redis protocol at ``CACHE_URL``
+
+Every backend stores bytes with a TTL and enforces ``CACHE_MAX_BYTES``.
+Values are encoded by ``encode``/``decode``: JSON for the structure, with
+numpy arrays (embedding vectors) appended as raw bytes instead of number
+lists. Services use namespaced ``Cache`` objects from ``get_cache``, and
+entries are evicted through the invalidation bus when the data changes.
+
+Entries are filled from database reads with ``begin_fill`` before the read
+and ``fill`` after it, so a value read before an invalidation is never stored
+after it.
+"""
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Type
+from urllib.parse import unquote, urlparse
+import logging
+import os
+import socket
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+import uuid
+import numpy as np
+import orjson
+
+logger = logging.getLogger(__name__)
+
+_MAGIC = b"\x01"
+_HEADER = struct.Struct(">I")
+
+
+def encode(value: Any) -> bytes:
+    """
+    Serialize a JSON-like value; numpy arrays anywhere in it are stored as raw bytes.
+
+    Layout: magic byte, 4-byte length of the JSON part, the JSON part, then
+    the array buffers. Arrays are replaced in the JSON by markers holding
+    their dtype, shape and position in the buffer area.
+    """
+    buffers: List[bytes] = []
+    offset = 0
+
+    def default(obj):
+        nonlocal offset
+        if isinstance(obj, np.ndarray):
+            data = np.ascontiguousarray(obj).tobytes()
+            marker = {"__ndarray__": [obj.dtype.str, list(obj.shape), offset, len(data)]}
+            buffers.append(data)
+            offset += len(data)
+            return marker
+        raise TypeError(f"Cannot cache value of type {type(obj).__name__}")
+
+    # UUIDs and datetimes become strings; see from_row for the way back
+    document = orjson.dumps(value, default=default)
+    return b"".join([_MAGIC, _HEADER.pack(len(document)), document, *buffers])
+
+
+def decode(data: bytes) -> Any:
+    """Inverse of ``encode``; arrays come back as read-only views on ``data``."""
+    if data[:1] != _MAGIC:
+        raise ValueError("Unknown cache encoding")
+    (length,) = _HEADER.unpack_from(data, 1)
+    start = 1 + _HEADER.size
+    value = orjson.loads(data[start:start + length])
+    base = start + length
+
+    def restore(node):
+        if isinstance(node, dict):
+            marker = node.get("__ndarray__")
+            if marker is not None and len(node) == 1:
+                dtype, shape, offset, size = marker
+                dtype = np.dtype(dtype)
+                return np.frombuffer(
+                    data, dtype=dtype, count=size // dtype.itemsize, offset=base + offset
+                ).reshape(shape)
+            return {key: restore(item) for key, item in node.items()}
+        if isinstance(node, list):
+            return [restore(item) for item in node]
+        return node
+
+    return restore(value)
+
+
+def to_row(obj) -> Dict[str, Any]:
+    """Column values of an ORM instance, ready for ``encode``."""
+    from sqlalchemy import inspect
+
+    return {column.key: getattr(obj, column.key) for column in inspect(obj).mapper.column_attrs}
+
+
+def from_row(session, model: Type, row: Dict[str, Any]):
+    """
+    Attach an instance rebuilt from ``to_row`` output to ``session`` without a query.
+
+    Strings are turned back into UUIDs and datetimes according to the column
+    types, and the instance is merged with ``load=False`` so it behaves like
+    one loaded in this session (lazy relationships included).
+    """
+    from sqlalchemy import inspect
+    from sqlalchemy.orm import make_transient_to_detached
+
+    values = {}
+    for attribute in inspect(model).column_attrs:
+        key = attribute.key
+        if key not in row:
+            continue
+        value = row[key]
+        if isinstance(value, str):
+            try:
+                python_type = attribute.columns[0].type.python_type
+            except NotImplementedError:
+                python_type = str
+            if python_type is uuid.UUID:
+                value = uuid.UUID(value)
+            elif python_type in (datetime, date):
+                value = python_type.fromisoformat(value)
+        values[key] = value
+    instance = model(**values)
+    make_transient_to_detached(instance)
+    return session.merge(instance, load=False)
+
+
+class CacheBackend:
+    """Bytes store with TTLs and a size limit."""
+
+    name = "base"
+    # Whether other processes read and evict the same entries
+    shared = False
+
+    def __init__(self):
+        self._stats_lock = threading.Lock()
+        self.evictions = 0
+        self.errors = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def clear(self, prefix: str) -> None:
+        """Drop every key starting with ``prefix``."""
+        raise NotImplementedError
+
+    def _count(self, attribute: str, amount: int = 1) -> None:
+        with self._stats_lock:
+            setattr(self, attribute, getattr(self, attribute) + amount)
+
+    def stats(self) -> Dict[str, float]:
+        return {"evictions_total": self.evictions, "errors_total": self.errors}
+
+
+class MemoryCache(CacheBackend):
+    """LRU dict local to the process."""
+
+    name = "memory"
+
+    def __init__(self, max_bytes: int):
+        super().__init__()
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._lock = threading.Lock()
+        # key -> (expires at, value), least recently used first
+        self._entries: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self, prefix: str) -> None:
+        with self._lock:
+            for key in [key for key in self._entries if key.startswith(prefix)]:
+                self._remove(key)
+
+    def _remove(self, key: str) -> None:
+        self.size -= len(self._entries.pop(key)[1])
+
+    def stats(self) -> Dict[str, float]:
+        return {**super().stats(), "entries": len(self._entries), "bytes": self.size}
+
+
+class SQLiteCache(CacheBackend):
+    """
+    Cache in a SQLite file shared by every process on the host.
+
+    WAL mode lets readers run alongside a writer. When the stored size goes
+    over the limit, the entries closest to expiry are dropped first.
+    """
+
+    name = "sqlite"
+    shared = True
+
+    def __init__(self, path: str, max_bytes: int, check_every: int = 100):
+        super().__init__()
+        self.path = path
+        self.max_bytes = max_bytes
+        self.check_every = check_every
+        self._local = threading.local()
+        self._sets = 0
+        with self._connection() as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS cache (
+                    key TEXT PRIMARY KEY,
+                    value BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            connection.execute("CREATE INDEX IF NOT EXISTS cache_expires_at ON cache (expires_at)")
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            # Losing the cache on a power cut is fine
+            connection.execute("PRAGMA synchronous=OFF")
+            self._local.connection = connection
+        return connection
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            row = self._connection().execute(
+                "SELECT value FROM cache WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        except sqlite3.Error as e:
+            self._count("errors")
+            logger.warning(f"SQLite cache read failed: {str(e)}")
+            return None
+        return row[0] if row else None
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        if len(value) > self.max_bytes:
+            return
+        try:
+            connection = self._connection()
+            connection.execute(
+                "INSERT OR REPLACE INTO cache (key, value, size, expires_at) VALUES (?, ?, ?, ?)",
+                (key, value, len(value), time.time() + ttl)
+            )
+            self._sets += 1
+            if self._sets % self.check_every == 0:
+                self._enforce_limit(connection)
+        except sqlite3.Error as e:
+            self._count("errors")
+            logger.warning(f"SQLite cache write failed: {str(e)}")
+
+    def _enforce_limit(self, connection: sqlite3.Connection) -> None:
+        connection.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),))
+        total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Drop the soonest-expiring entries until a tenth of the budget is free again
+        excess = total - int(self.max_bytes * 0.9)
+        removed = connection.execute("""
+            DELETE FROM cache WHERE key IN (
+                SELECT key FROM (
+                    SELECT key, size, SUM(size) OVER (ORDER BY expires_at, key) AS running
+                    FROM cache
+                ) WHERE running - size < ?
+            )
+        """, (excess,)).rowcount
+        self._count("evictions", max(removed, 0))
+
+    def delete(self, key: str) -> None:
+        try:
+            self._connection().execute("DELETE FROM cache WHERE key = ?", (key,))
+        except sqlite3.Error as e:
+            self._count("errors")
+            logger.warning(f"SQLite cache delete failed: {str(e)}")
+
+    def clear(self, prefix: str) -> None:
+        try:
+            self._connection().execute(
+                "DELETE FROM cache WHERE substr(key, 1, ?) = ?", (len(prefix), prefix)
+            )
+        except sqlite3.Error as e:
+            self._count("errors")
+            logger.warning(f"SQLite cache clear failed: {str(e)}")
+
+
+class RespError(Exception):
+    pass
+
+
+class RespCache(CacheBackend):
+    """
+    Cache on a server speaking the Redis protocol (RESP2).
+
+    The server enforces the size limit (``maxmemory`` with an LRU policy);
+    entries over ``max_bytes`` are not sent. Connection errors count as
+    misses so a cache outage never fails a request, and the server is left
+    alone for ``retry_after`` seconds so an outage does not add a timeout to
+    every call.
+    """
+
+    name = "redis"
+    shared = True
+
+    def __init__(self, url: str, max_bytes: int, timeout: float = 0.5, retry_after: float = 1.0):
+        super().__init__()
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._down_until = 0.0
+        self._local = threading.local()
+
+    def _socket(self) -> Tuple[socket.socket, Any]:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connection = (sock, sock.makefile("rb"))
+            self._local.connection = connection
+            if self.password:
+                self._command("AUTH", self.password)
+            if self.db:
+                self._command("SELECT", str(self.db))
+        return connection
+
+    def _reset(self) -> None:
+        connection = getattr(self._local, "connection", None)
+        self._local.connection = None
+        if connection is not None:
+            connection[1].close()
+            connection[0].close()
+
+    def _command(self, *args) -> Any:
+        sock, reader = self._socket()
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        sock.sendall(b"".join(parts))
+        return self._read(reader)
+
+    def _read(self, reader) -> Any:
+        line = reader.readline()
+        if not line:
+            raise ConnectionError("Connection closed by cache server")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest
+        if kind == b"-":
+            raise RespError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            data = reader.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(rest)
+            return None if length < 0 else [self._read(reader) for _ in range(length)]
+        raise RespError(f"Unexpected reply: {line!r}")
+
+    def _call(self, *args, default=None) -> Any:
+        if time.monotonic() < self._down_until:
+            return default
+        try:
+            return self._command(*args)
+        except (OSError, ConnectionError, RespError) as e:
+            self._reset()
+            self._count("errors")
+            if not isinstance(e, RespError):
+                self._down_until = time.monotonic() + self.retry_after
+            logger.warning(f"Cache server command {args[0]} failed: {str(e)}")
+            return default
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._call("GET", key)
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        if len(value) <= self.max_bytes:
+            self._call("SET", key, value, "PX", max(int(ttl * 1000), 1))
+
+    def delete(self, key: str) -> None:
+        self._call("DEL", key)
+
+    def clear(self, prefix: str) -> None:
+        cursor = b"0"
+        while True:
+            reply = self._call("SCAN", cursor, "MATCH", f"{prefix}*", "COUNT", 500)
+            if reply is None:
+                return
+            cursor, keys = reply
+            if keys:
+                self._call("DEL", *keys)
+            if cursor == b"0":
+                return
+
+
+class Cache:
+    """
+    One namespace of the shared backend, storing encoded values.
+
+    Every invalidation seen by this process (``delete``, ``clear``, ``reset``)
+    bumps the namespace generation; ``fill`` drops values whose read started
+    in an older generation.
+    """
+
+    def __init__(self, namespace: str, ttl: float):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.prefix = f"{namespace}:"
+        self.hits = 0
+        self.misses = 0
+        self.stale_fills = 0
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._invalidated_at = float("-inf")
+
+    def get(self, key: Any) -> Optional[Any]:
+        data = get_backend().get(self.prefix + str(key))
+        with self._lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return None if data is None else decode(data)
+
+    def set(self, key: Any, value: Any, ttl: Optional[float] = None) -> None:
+        get_backend().set(self.prefix + str(key), encode(value), self.ttl if ttl is None else ttl)
+
+    def begin_fill(self, staleness: float = 0.0) -> Optional[int]:
+        """
+        Token to pass to ``fill`` for a read that starts now.
+
+        Args:
+            staleness (float): How far behind the primary the read may be, in
+                seconds (see ``utils.routing.replica_staleness``); reads that
+                may predate the last invalidation are not cached
+
+        Returns:
+            Optional[int]: The current generation, or None to skip the fill
+        """
+        with self._lock:
+            if staleness and time.monotonic() - self._invalidated_at < staleness:
+                return None
+            return self._generation
+
+    def fill(self, token: Optional[int], key: Any, value: Any, ttl: Optional[float] = None) -> bool:
+        """
+        Store a value read after ``begin_fill`` unless an invalidation came in since.
+
+        Returns:
+            bool: Whether the value was kept
+        """
+        if token is None or token != self._generation:
+            self._count_stale_fill()
+            return False
+        self.set(key, value, ttl)
+        if token != self._generation:
+            # Invalidated while storing; its delete may have run before the set
+            get_backend().delete(self.prefix + str(key))
+            self._count_stale_fill()
+            return False
+        return True
+
+    def _count_stale_fill(self) -> None:
+        with self._lock:
+            self.stale_fills += 1
+
+    def _invalidate(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._invalidated_at = time.monotonic()
+
+    def delete(self, key: Any) -> None:
+        self._invalidate()
+        get_backend().delete(self.prefix + str(key))
+
+    def clear(self) -> None:
+        self._invalidate()
+        get_backend().clear(self.prefix)
+
+    def reset(self) -> None:
+        """
+        Forget what this process may have missed, e.g. after the invalidation listener reconnects.
+
+        Entries in a process-local backend are dropped. Entries in a shared
+        backend are kept: the other processes' listeners evicted them, and
+        wiping them on every reconnect of any worker would empty the cache for
+        everyone. Fills in flight in this process are dropped either way.
+        """
+        if get_backend().shared:
+            self._invalidate()
+        else:
+            self.clear()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            hits, misses, stale_fills = self.hits, self.misses, self.stale_fills
+        return {
+            "hits_total": hits,
+            "misses_total": misses,
+            "stale_fills_total": stale_fills,
+            "hit_ratio": round(hits / (hits + misses), 4) if hits + misses else 0,
+        }
+
+
+_backend: Optional[CacheBackend] = None
+_backend_lock = threading.Lock()
+_caches: Dict[str, Cache] = {}
+
+
+def get_backend() -> CacheBackend:
+    """Process-wide backend picked by CACHE_BACKEND, created on first use."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            kind = os.getenv("CACHE_BACKEND", "memory")
+            max_bytes = int(os.getenv("CACHE_MAX_BYTES", str(256 * 1024 ** 2)))
+            if kind == "sqlite":
+                shared_dir = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+                _backend = SQLiteCache(
+                    os.getenv("CACHE_SQLITE_PATH", os.path.join(shared_dir, "chat-api-cache.sqlite")),
+                    max_bytes
+                )
+            elif kind == "redis":
+                _backend = RespCache(os.getenv("CACHE_URL", "redis://localhost:6379/0"), max_bytes)
+            elif kind == "memory":
+                _backend = MemoryCache(max_bytes)
+            else:
+                raise ValueError(f"Unknown CACHE_BACKEND: {kind}")
+            logger.info(f"Cache backend: {_backend.name}")
+        return _backend
+
+
+def get_cache(namespace: str, ttl: Optional[float] = None) -> Cache:
+    """
+    The cache for one namespace; entries expire after ``ttl`` seconds.
+
+    Defaults to ``CACHE_TTL_SECONDS``. Long TTLs are safe for data that is
+    invalidated through ``utils.invalidation`` on every write.
+    """
+    if namespace not in _caches:
+        _caches[namespace] = Cache(namespace, ttl or float(os.getenv("CACHE_TTL_SECONDS", "3600")))
+    return _caches[namespace]
+
+
+def cache_stats() -> Iterator[Tuple[str, Dict[str, float]]]:
+    """(label, stats) for every namespace and for the backend, for /metrics."""
+    for namespace, cache in list(_caches.items()):
+        yield f'namespace="{namespace}"', cache.stats()
+    if _backend is not None:
+        yield f'backend="{_backend.name}"', _backend.stats()
@@ -1,12 +1,16 @@
 import logging
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, insert, text
 from sqlalchemy.orm import sessionmaker
 from models.base import Base
 from models.item import Item
 from models.embedding import Embedding
-from typing import List, Dict, Optional
-from llama_index.core.schema import Node
+from typing import Dict, Iterable, List, Optional, TYPE_CHECKING
+from services.embedding import compute_chunk_hash
 from datetime import datetime
+from utils.bootstrap import init_database
+
+if TYPE_CHECKING:
+    from llama_index.core.schema import Node
 
 class DatabaseManager:
     def __init__(self, connection_string: str):
@@ -35,82 +39,23 @@ class DatabaseManager:
     def _initialize_database(self):
         """Create necessary tables, extensions, and indexes if they don't exist."""
         try:
-            with self.engine.connect() as conn:
-                # Enable pgvector extension
-                conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector;"))
-                
-                # Create tables if they don't exist
-                Base.metadata.create_all(bind=self.engine)
-                
-                # Create indexes for better performance
-                conn.execute(text("""
-                    -- Create GiST index for vector similarity search if not exists
-                    DO $$ 
-                    BEGIN 
-                        IF NOT EXISTS (
-                            SELECT 1 FROM pg_class c 
-                            JOIN pg_namespace n ON n.oid = c.relnamespace 
-                            WHERE c.relname = 'embeddings_embedding_idx'
-                        ) THEN
-                            CREATE INDEX embeddings_embedding_idx 
-                            ON embeddings 
-                            USING ivfflat (embedding vector_cosine_ops)
-                            WITH (lists = 100);
-                        END IF;
-                    END $$;
-                    
-                    -- Create index on items.active if not exists
-                    DO $$
-                    BEGIN
-                        IF NOT EXISTS (
-                            SELECT 1 FROM pg_class c
-                            JOIN pg_namespace n ON n.oid = c.relnamespace
-                            WHERE c.relname = 'items_active_idx'
-                        ) THEN
-                            CREATE INDEX items_active_idx ON items(active);
-                        END IF;
-                    END $$;
-                    
-                    -- Create index on items.conversation_id if not exists
-                    DO $$
-                    BEGIN
-                        IF NOT EXISTS (
-                            SELECT 1 FROM pg_class c
-                            JOIN pg_namespace n ON n.oid = c.relnamespace
-                            WHERE c.relname = 'items_conversation_id_idx'
-                        ) THEN
-                            CREATE INDEX items_conversation_id_idx ON items(conversation_id);
-                        END IF;
-                    END $$;
-                    
-                    -- Create index on embeddings.item_id if not exists
-                    DO $$
-                    BEGIN
-                        IF NOT EXISTS (
-                            SELECT 1 FROM pg_class c
-                            JOIN pg_namespace n ON n.oid = c.relnamespace
-                            WHERE c.relname = 'embeddings_item_id_idx'
-                        ) THEN
-                            CREATE INDEX embeddings_item_id_idx ON embeddings(item_id);
-                        END IF;
-                    END $$;
-                """))
-                
-                # Commit all changes
-                conn.commit()
-                
+            init_database(self.engine)
             self.logger.info("Database initialized successfully with all required tables and indexes")
             
         except Exception as e:
             self.logger.error(f"Failed to initialize database: {str(e)}")
             raise
 
-    def insert_document(self, nodes: List[Node], metadata: Dict) -> Optional[Item]:
+    def insert_document(self, nodes: Iterable["Node"], metadata: Dict, batch_size: int = 500) -> Optional[Item]:
         """
         Insert a document and its embeddings into the database.
         
+        Nodes are consumed lazily and written in batches, so a generator of
+        nodes is never materialized in memory. Everything still commits in a
+        single transaction.
+        
         Args:
-            nodes (List[Node]): List of LlamaIndex nodes containing text and embeddings
+            nodes (Iterable[Node]): LlamaIndex nodes containing text and embeddings, in document order
             metadata (Dict): Document metadata containing:
                 - id: Document ID
                 - file_name: Name of the file
@@ -118,6 +63,7 @@ class DatabaseManager:
                 - uri: Document URI
                 - owner: Document owner
                 - conversation_id: Conversation ID
+            batch_size (int): Number of embeddings sent per INSERT
                 
         Returns:
             Optional[Item]: Created Item object or None if failed
@@ -141,21 +87,36 @@ class DatabaseManager:
                 session.flush()  # Get the item ID
                 
                 # Create Embeddings for each node
+                next_index = {}
+                rows = []
+                count = 0
                 for node in nodes:
                     # Extract page number from node metadata
                     page = int(node.extra_info.get('page_label', -1))
+                    chunk_index = next_index.get(page, 0)
+                    next_index[page] = chunk_index + 1
+                    chunk_text = node.get_content()
                     
-                    embedding = Embedding(
-                        item_id=item.id,
-                        page=page,
-                        chunk_text=node.get_content(),
-                        embedding=node.embedding,
-                        last_updated=datetime.now()
-                    )
-                    session.add(embedding)
+                    rows.append({
+                        'item_id': item.id,
+                        'conversation_id': item.conversation_id,
+                        'owner_id': item.owner_id,
+                        'page': page,
+                        'chunk_index': chunk_index,
+                        'chunk_text': chunk_text,
+                        'content_hash': compute_chunk_hash(chunk_text),
+                        'embedding': node.embedding
+                    })
+                    if len(rows) >= batch_size:
+                        session.execute(insert(Embedding), rows)
+                        count += len(rows)
+                        rows = []
+                if rows:
+                    session.execute(insert(Embedding), rows)
+                    count += len(rows)
                 
                 session.commit()
-                self.logger.info(f"Successfully inserted document {item.file_name} with {len(nodes)} chunks")
+                self.logger.info(f"Successfully inserted document {item.file_name} with {count} chunks")
                 return item
                 
             except Exception as e:
@@ -190,7 +151,8 @@ class DatabaseManager:
         self,
         query_embedding: List[float],
         limit: int = 5,
-        active_only: bool = True
+        active_only: bool = True,
+        owner_id: Optional[str] = None
     ) -> List[Dict]:
         """
         Search for similar chunks using vector similarity.
@@ -199,6 +161,7 @@ class DatabaseManager:
             query_embedding (List[float]): Query embedding vector
             limit (int): Maximum number of results
             active_only (bool): Whether to search only active documents
+            owner_id (Optional[str]): Restrict the search to one owner's documents
             
         Returns:
             List[Dict]: List of similar chunks with their document metadata
@@ -206,30 +169,36 @@ class DatabaseManager:
         try:
             session = self.SessionLocal()
             
-            # Build the query with active document filter if needed
-            active_filter = "AND i.active = true" if active_only else ""
+            # Filters live on embeddings so the vector index can apply them
+            filters = ""
+            params = {
+                'query_embedding': str(list(query_embedding)),
+                'limit': limit
+            }
+            if active_only:
+                filters += " AND e.item_active"
+            if owner_id is not None:
+                filters += " AND e.owner_id = :owner_id"
+                params['owner_id'] = owner_id
             
             results = session.execute(text("""
                 SELECT 
                     i.id as doc_id,
                     i.file_name,
                     i.uri,
-                    i.owner,
+                    i.owner_id,
                     e.chunk_text,
                     e.page,
-                    1 - (e.embedding <=> :query_embedding) as similarity
+                    1 - (e.embedding <=> CAST(:query_embedding AS vector)) as similarity
                 FROM embeddings e
                 JOIN items i ON i.id = e.item_id
                 WHERE e.embedding IS NOT NULL
-                """ + active_filter + """
-                ORDER BY e.embedding <=> :query_embedding
+                """ + filters + """
+                ORDER BY e.embedding <=> CAST(:query_embedding AS vector)
                 LIMIT :limit
-            """), {
-                'query_embedding': query_embedding,
-                'limit': limit
-            })
+            """), params)
             
-            return [dict(row) for row in results]
+            return [dict(row._mapping) for row in results]
             
         finally:
             session.close()
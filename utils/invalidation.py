@@ -0,0 +1,174 @@
+"""
+Cross-worker cache invalidation over Postgres LISTEN/NOTIFY.
+
+Writers call ``publish`` inside their transaction. The events are sent with
+``pg_notify`` and only delivered when the transaction commits, so no worker
+evicts on a write that is later rolled back. Every worker runs one listener
+thread on a dedicated connection and hands events to the handlers subscribed
+for their topic. The publishing worker also dispatches locally right after
+its own commit instead of waiting for the round trip.
+
+Notifications sent while a listener is disconnected are lost, so handlers
+registered with ``on_reset`` are called after every (re)connect to drop
+everything that might have been missed by this process (see ``Cache.reset``).
+"""
+from collections import defaultdict
+from contextlib import closing
+from typing import Any, Callable, Dict, List, Optional
+import logging
+import select
+import threading
+import orjson
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "cache_invalidation"
+
+# Topics and the key each one carries
+USER = "user"                                      # user email
+CONVERSATION = "conversation"                      # conversation id
+USER_CONVERSATIONS = "user_conversations"          # user id
+CONVERSATION_DOCUMENTS = "conversation_documents"  # conversation id
+
+
+def publish(session: Session, topic: str, key: Any) -> None:
+    """
+    Queue an invalidation event in the session's current transaction.
+
+    Args:
+        session (Session): Session doing the write
+        topic (str): What changed, one of the topic constants
+        key (Any): Which entry changed; sent as a string
+    """
+    payload = orjson.dumps({"topic": topic, "key": str(key)}).decode()
+    # Text, not select(func...), so a routing session sends it to the primary
+    session.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": CHANNEL, "payload": payload})
+    session.info.setdefault('invalidations', []).append(payload)
+
+
+@event.listens_for(Session, "after_commit")
+def _dispatch_committed(session):
+    for payload in session.info.pop('invalidations', []):
+        invalidation_bus.dispatch(payload)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_rolled_back(session):
+    session.info.pop('invalidations', None)
+
+
+class InvalidationBus:
+    """Per-process subscriber registry and LISTEN thread."""
+
+    def __init__(self, poll_interval: float = 5.0, max_backoff: float = 30.0):
+        self.poll_interval = poll_interval
+        self.max_backoff = max_backoff
+        self._handlers: Dict[str, List[Callable[[str], None]]] = defaultdict(list)
+        self._reset_handlers: List[Callable[[], None]] = []
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.connected = False
+        self.received = 0
+
+    def subscribe(self, topic: str, handler: Callable[[str], None]) -> None:
+        """Call ``handler(key)`` for every event of ``topic``."""
+        self._handlers[topic].append(handler)
+
+    def on_reset(self, handler: Callable[[], None]) -> None:
+        """Call ``handler()`` whenever events may have been missed."""
+        self._reset_handlers.append(handler)
+
+    def dispatch(self, payload: str) -> None:
+        try:
+            message = orjson.loads(payload)
+        except orjson.JSONDecodeError:
+            logger.warning(f"Ignoring malformed invalidation: {payload!r}")
+            return
+        for handler in self._handlers.get(message.get("topic"), []):
+            try:
+                handler(message.get("key"))
+            except Exception as e:
+                logger.error(f"Invalidation handler failed for {message}: {str(e)}")
+
+    def reset(self) -> None:
+        for handler in self._reset_handlers:
+            try:
+                handler()
+            except Exception as e:
+                logger.error(f"Invalidation reset handler failed: {str(e)}")
+
+    def start(self, engine: Engine) -> None:
+        """Start listening on a connection of ``engine`` in a daemon thread."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(engine,), name="invalidation-listener", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout=self.poll_interval + 1)
+        self._thread = None
+
+    def _run(self, engine: Engine) -> None:
+        backoff = 1.0
+        while not self._stop.is_set():
+            try:
+                self._listen(engine)
+                backoff = 1.0
+            except Exception as e:
+                logger.warning(f"Invalidation listener disconnected, retrying in {backoff:.0f}s: {str(e)}")
+            finally:
+                self.connected = False
+            if self._stop.wait(backoff):
+                break
+            backoff = min(backoff * 2, self.max_backoff)
+
+    def _listen(self, engine: Engine) -> None:
+        raw = engine.raw_connection()
+        # Taken before detaching, which drops the pool record it is read from
+        connection = raw.driver_connection
+        # A dedicated connection that never goes back to the pool
+        raw.detach()
+        with closing(raw):
+            connection.autocommit = True
+            cursor = connection.cursor()
+            cursor.execute(f"LISTEN {CHANNEL}")
+            cursor.close()
+            self.connected = True
+            # Anything sent before LISTEN took effect is unknown
+            self.reset()
+            logger.info("Invalidation listener connected")
+
+            if hasattr(connection, "poll"):
+                # psycopg2
+                while not self._stop.is_set():
+                    if select.select([connection], [], [], self.poll_interval)[0]:
+                        connection.poll()
+                        while connection.notifies:
+                            self._receive(connection.notifies.pop(0).payload)
+            else:
+                # psycopg 3
+                while not self._stop.is_set():
+                    for notify in connection.notifies(timeout=self.poll_interval):
+                        self._receive(notify.payload)
+
+    def _receive(self, payload: str) -> None:
+        self.received += 1
+        self.dispatch(payload)
+
+    def stats(self) -> dict:
+        return {
+            "connected": int(self.connected),
+            "received_total": self.received,
+        }
+
+
+invalidation_bus = InvalidationBus()
@@ -0,0 +1,175 @@
+"""
+CPU-bound document parsing and chunking, fanned out over a process pool.
+
+PDF text extraction and sentence splitting hold the GIL, so a large upload
+would pin a single core. Pages are grouped into ranges, each range is parsed
+and chunked in a worker process that opens the file itself (only the path and
+the resulting strings cross the process boundary), and results are yielded
+back in page order. Readers are given an open file rather than a path, so
+pypdf seeks to the objects it needs instead of loading the whole file into
+memory in every task.
+"""
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import lru_cache
+from typing import Deque, Iterator, List, Optional, Tuple, TYPE_CHECKING
+import logging
+import multiprocessing
+import os
+import threading
+
+if TYPE_CHECKING:
+    from llama_index.core.schema import TextNode
+
+logger = logging.getLogger(__name__)
+
+# (1-based page number, chunk texts of that page)
+PageChunks = Tuple[int, List[str]]
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def parse_workers() -> int:
+    """Size of the parse pool: PARSE_WORKERS, defaulting to the CPU count."""
+    return int(os.getenv("PARSE_WORKERS", "0")) or os.cpu_count() or 1
+
+
+def get_parse_pool() -> ProcessPoolExecutor:
+    """Process-wide parse pool, started on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            workers = parse_workers()
+            # Spawn rather than fork: the server process runs threads and holds sockets
+            _pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+            logger.info(f"Parse pool started with {workers} workers")
+        return _pool
+
+
+def shutdown_parse_pool() -> None:
+    """Stop the parse pool if it was started."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(cancel_futures=True)
+            _pool = None
+
+
+@lru_cache(maxsize=8)
+def _get_splitter(chunk_size: int, chunk_overlap: int):
+    # One splitter (and tokenizer) per worker process and setting
+    from llama_index.core.text_splitter import SentenceSplitter
+
+    return SentenceSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+
+def count_pdf_pages(path: str) -> int:
+    """Number of pages of a PDF file."""
+    from pypdf import PdfReader
+
+    with open(path, "rb") as fh:
+        return len(PdfReader(fh).pages)
+
+
+def parse_page_range(path: str, start: int, stop: int, chunk_size: int, chunk_overlap: int) -> List[PageChunks]:
+    """
+    Extract and chunk pages ``[start, stop)`` of a PDF. Runs in a worker process.
+
+    Args:
+        path (str): Path of the PDF on local disk
+        start (int): First page (0-based, inclusive)
+        stop (int): Last page (0-based, exclusive)
+        chunk_size (int): Size of text chunks in tokens
+        chunk_overlap (int): Number of overlapping tokens between chunks
+
+    Returns:
+        List[PageChunks]: Chunks of every page in the range, in page order
+    """
+    from pypdf import PdfReader
+
+    splitter = _get_splitter(chunk_size, chunk_overlap)
+    pages: List[PageChunks] = []
+    with open(path, "rb") as fh:
+        reader = PdfReader(fh)
+        for index in range(start, stop):
+            text = reader.pages[index].extract_text() or ""
+            chunks = splitter.split_text(text) if text.strip() else []
+            pages.append((index + 1, chunks))
+    return pages
+
+
+def iter_pdf_chunks(
+    path: str,
+    chunk_size: int = 1000,
+    chunk_overlap: int = 200,
+    pages_per_task: int = 8,
+    page_count: Optional[int] = None
+) -> Iterator[PageChunks]:
+    """
+    Parse and chunk a PDF across the parse pool, yielding pages in order.
+
+    Only a bounded window of page ranges is in flight at a time, so the
+    caller can consume pages as they arrive. Small documents are handled
+    in-process since the pool round trip would cost more than it saves.
+
+    Args:
+        path (str): Path of the PDF on local disk
+        chunk_size (int): Size of text chunks in tokens
+        chunk_overlap (int): Number of overlapping tokens between chunks
+        pages_per_task (int): Pages parsed by one worker task
+        page_count (Optional[int]): Number of pages, if the caller already counted them
+
+    Yields:
+        PageChunks: (page number, chunk texts) for every page
+    """
+    if page_count is None:
+        page_count = count_pdf_pages(path)
+    if page_count <= pages_per_task:
+        yield from parse_page_range(path, 0, page_count, chunk_size, chunk_overlap)
+        return
+
+    pool = get_parse_pool()
+    window = 2 * parse_workers()
+    pending: Deque[Future] = deque()
+    try:
+        for start in range(0, page_count, pages_per_task):
+            pending.append(pool.submit(
+                parse_page_range, path, start, min(start + pages_per_task, page_count),
+                chunk_size, chunk_overlap
+            ))
+            if len(pending) >= window:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def chunk_pdf(path: str, chunk_size: int = 1000, chunk_overlap: int = 200) -> List["TextNode"]:
+    """
+    Parse and chunk a whole PDF into nodes in document order.
+
+    The page number is kept in the ``page_label`` metadata, which is where
+    ``DatabaseManager.insert_document`` and ``EmbeddingService.get_node_slots``
+    read ``Embedding.page`` from.
+
+    Args:
+        path (str): Path of the PDF on local disk
+        chunk_size (int): Size of text chunks in tokens
+        chunk_overlap (int): Number of overlapping tokens between chunks
+
+    Returns:
+        List[TextNode]: Chunks of the document
+    """
+    from llama_index.core.schema import TextNode
+
+    return [
+        TextNode(text=chunk, metadata={'page_label': str(page)})
+        for page, chunks in iter_pdf_chunks(path, chunk_size, chunk_overlap)
+        for chunk in chunks
+    ]
@@ -0,0 +1,367 @@
+"""
+Monthly range partitioning of ``messages`` and archival of cold partitions.
+
+History reads only touch the newest rows of a conversation, so old months
+can leave the hot table: vacuum, index maintenance and the table size then
+depend on the retention window instead of the whole history.
+
+    python -m utils.partitioning partition       # convert messages, once
+    python -m utils.partitioning maintain        # create upcoming partitions
+    python -m utils.partitioning archive         # move cold partitions to files
+
+``partition`` turns ``messages`` into a table partitioned by ``created_at``.
+The existing rows stay where they are and become the partition
+``messages_legacy`` covering everything up to the end of the current month. Its index
+is built concurrently beforehand; the switch itself blocks message reads and
+writes for one sequential scan of the old table (see ``partition_messages``).
+``maintain``
+should run at least monthly (e.g. daily from cron) so inserts land in a
+monthly partition rather than ``messages_default``.
+
+``archive`` writes each partition older than ``MESSAGE_HOT_MONTHS`` to
+``MESSAGE_ARCHIVE_DIR`` as gzip JSONL, one gzip member per conversation,
+records the byte ranges and message ids in ``message_archive_segments`` and
+then detaches and drops the partition. History reads fall back to these
+files for pages older than the hot table (see ``services.archive``), so
+``MESSAGE_ARCHIVE_DIR`` must be an absolute path on storage every API host
+mounts; there is no default.
+
+Postgres requires unique indexes of a partitioned table to include the
+partition key, so the Idempotency-Key index is created per partition. A
+retry is therefore only recognized as a duplicate within the same month.
+"""
+from datetime import datetime, timezone
+from typing import Iterator, List, Optional, Tuple
+import argparse
+import gzip
+import logging
+import os
+import re
+import orjson
+from dotenv import load_dotenv, find_dotenv
+from sqlalchemy import column, create_engine, insert, table, text
+from sqlalchemy.engine import Connection, Engine
+from models.message import Message
+from models.message_archive import MessageArchive, MessageArchiveSegment
+
+logger = logging.getLogger(__name__)
+
+# Absolute path on storage shared by every API host, e.g. a network mount
+MESSAGE_ARCHIVE_DIR = os.getenv("MESSAGE_ARCHIVE_DIR", "")
+MESSAGE_HOT_MONTHS = int(os.getenv("MESSAGE_HOT_MONTHS", "6"))
+PARTITIONS_AHEAD = 2
+EXPORT_BATCH_ROWS = 1000
+
+LEGACY_PARTITION = "messages_legacy"
+DEFAULT_PARTITION = "messages_default"
+PARTITION_BOUND = re.compile(r"TO \('([^']+)'\)")
+
+
+def archive_directory(directory: Optional[str] = None) -> str:
+    """
+    The archive directory, ``MESSAGE_ARCHIVE_DIR`` unless given.
+
+    Raises:
+        ValueError: If it is not set or not an absolute path; a relative
+            path resolves differently on every host and history would
+            silently miss the archived pages
+    """
+    directory = MESSAGE_ARCHIVE_DIR if directory is None else directory
+    if not directory or not os.path.isabs(directory):
+        raise ValueError(
+            f"MESSAGE_ARCHIVE_DIR must be an absolute path on storage shared by every API host, got {directory!r}"
+        )
+    return directory
+
+
+def month_start(moment: datetime, offset: int = 0) -> datetime:
+    """First instant (UTC) of the month ``offset`` months after the one containing ``moment``."""
+    index = moment.year * 12 + moment.month - 1 + offset
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def partition_name(start: datetime) -> str:
+    return f"messages_p{start:%Y%m}"
+
+
+def is_partitioned(conn: Connection) -> bool:
+    return conn.execute(text(
+        "SELECT relkind = 'p' FROM pg_class WHERE oid = 'messages'::regclass"
+    )).scalar()
+
+
+def list_partitions(conn: Connection) -> List[Tuple[str, Optional[datetime]]]:
+    """Attached partitions with their exclusive upper bound (None for the default partition)."""
+    partitions = []
+    for name, bound in conn.execute(text("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'messages'::regclass
+    """)):
+        match = PARTITION_BOUND.search(bound)
+        partitions.append((name, datetime.fromisoformat(match.group(1)) if match else None))
+    return sorted(partitions, key=lambda partition: (partition[1] is None, partition[1]))
+
+
+def create_partition(conn: Connection, start: datetime) -> str:
+    """Create the monthly partition starting at ``start`` with its idempotency index, if missing."""
+    name = partition_name(start)
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {name} PARTITION OF messages
+        FOR VALUES FROM ('{start.isoformat()}') TO ('{month_start(start, 1).isoformat()}')
+    """))
+    conn.execute(text(f"""
+        CREATE UNIQUE INDEX IF NOT EXISTS uix_{name}_idempotency
+        ON {name} (conversation_id, idempotency_key, role) WHERE idempotency_key IS NOT NULL
+    """))
+    return name
+
+
+def create_upcoming_partitions(conn: Connection, ahead: int = PARTITIONS_AHEAD) -> List[str]:
+    """Create the partitions of the current month and the next ``ahead`` months, unless still in ``messages_legacy``."""
+    now = datetime.now(timezone.utc)
+    legacy_end = dict(list_partitions(conn)).get(LEGACY_PARTITION)
+    return [
+        create_partition(conn, start)
+        for start in (month_start(now, offset) for offset in range(ahead + 1))
+        if legacy_end is None or start >= legacy_end
+    ]
+
+
+PARTITION_KEY_INDEX = "messages_id_created_at_key"
+CREATED_AT_NOT_NULL = "messages_created_at_not_null"
+
+
+def prepare_partitioning(engine: Engine) -> None:
+    """
+    Do the slow parts of ``partition_messages`` without blocking writes.
+
+    Fills NULL ``created_at`` values, validates a NOT NULL check and builds
+    the unique ``(id, created_at)`` index the partitioned primary key needs,
+    with ``CREATE INDEX CONCURRENTLY``. Safe to repeat; an invalid index left
+    by an interrupted build is rebuilt.
+    """
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        # The partition key cannot be NULL; such rows predate the server default
+        conn.execute(text("UPDATE messages SET created_at = 'epoch' WHERE created_at IS NULL"))
+        conn.execute(text(f"""
+            DO $$
+            BEGIN
+                IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = '{CREATED_AT_NOT_NULL}') THEN
+                    ALTER TABLE messages ADD CONSTRAINT {CREATED_AT_NOT_NULL}
+                        CHECK (created_at IS NOT NULL) NOT VALID;
+                END IF;
+            END $$;
+        """))
+        # Scans the table under a lock that still lets reads and writes through
+        conn.execute(text(f"ALTER TABLE messages VALIDATE CONSTRAINT {CREATED_AT_NOT_NULL}"))
+        valid = conn.execute(text(
+            "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name"
+        ), {"name": PARTITION_KEY_INDEX}).scalar()
+        if valid is False:
+            conn.execute(text(f"DROP INDEX CONCURRENTLY {PARTITION_KEY_INDEX}"))
+        conn.execute(text(
+            f"CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {PARTITION_KEY_INDEX} ON messages (id, created_at)"
+        ))
+
+
+def partition_messages(engine: Engine) -> bool:
+    """
+    Convert ``messages`` into a table range-partitioned by ``created_at``.
+
+    ``prepare_partitioning`` first builds the ``(id, created_at)`` index and
+    validates NOT NULL without blocking writes. The conversion itself runs in
+    one transaction holding an ACCESS EXCLUSIVE lock on ``messages``: the old
+    table becomes a partition without copying rows and its prebuilt index
+    becomes its primary key, so no index is built under the lock. Reads and
+    writes of messages wait for the one remaining scan, the validation of the
+    partition's range CHECK constraint (a sequential scan of the old table,
+    which then lets ATTACH skip its own). Plan for that much downtime.
+
+    Returns:
+        bool: False if the table was already partitioned
+    """
+    with engine.connect() as conn:
+        if is_partitioned(conn):
+            return False
+    prepare_partitioning(engine)
+    with engine.begin() as conn:
+        if is_partitioned(conn):
+            return False
+        # The old table keeps taking this month's rows; monthly partitions start next month
+        boundary = month_start(datetime.now(timezone.utc), 1).isoformat()
+        for statement in [
+            "LOCK TABLE messages IN ACCESS EXCLUSIVE MODE",
+            # Proven by the validated check, so no scan
+            "ALTER TABLE messages ALTER COLUMN created_at SET NOT NULL",
+            f"ALTER TABLE messages DROP CONSTRAINT {CREATED_AT_NOT_NULL}",
+            f"ALTER TABLE messages RENAME TO {LEGACY_PARTITION}",
+            f"ALTER TABLE {LEGACY_PARTITION} DROP CONSTRAINT messages_pkey",
+            f"""
+            ALTER TABLE {LEGACY_PARTITION} ADD CONSTRAINT {LEGACY_PARTITION}_pkey
+                PRIMARY KEY USING INDEX {PARTITION_KEY_INDEX}
+            """,
+            f"ALTER INDEX IF EXISTS ix_messages_conversation_created RENAME TO ix_{LEGACY_PARTITION}_conversation_created",
+            f"ALTER INDEX IF EXISTS uix_messages_idempotency RENAME TO uix_{LEGACY_PARTITION}_idempotency",
+            f"""
+            CREATE TABLE messages (LIKE {LEGACY_PARTITION} INCLUDING DEFAULTS INCLUDING STORAGE)
+            PARTITION BY RANGE (created_at)
+            """,
+            "ALTER TABLE messages ADD CONSTRAINT messages_pkey PRIMARY KEY (id, created_at)",
+            """
+            ALTER TABLE messages ADD CONSTRAINT messages_conversation_id_fkey
+                FOREIGN KEY (conversation_id) REFERENCES conversations(id) ON DELETE CASCADE
+            """,
+            """
+            ALTER TABLE messages ADD CONSTRAINT messages_user_id_fkey
+                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+            """,
+            """
+            ALTER TABLE messages ADD CONSTRAINT messages_source_embedding_id_fkey
+                FOREIGN KEY (source_embedding_id) REFERENCES embeddings(id) ON DELETE SET NULL
+            """,
+            "CREATE INDEX ix_messages_conversation_created ON messages (conversation_id, created_at)",
+            f"ALTER TABLE {LEGACY_PARTITION} ADD CONSTRAINT {LEGACY_PARTITION}_range CHECK (created_at < '{boundary}')",
+            f"ALTER TABLE messages ATTACH PARTITION {LEGACY_PARTITION} FOR VALUES FROM (MINVALUE) TO ('{boundary}')",
+            f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF messages DEFAULT",
+            f"""
+            CREATE UNIQUE INDEX IF NOT EXISTS uix_{DEFAULT_PARTITION}_idempotency
+            ON {DEFAULT_PARTITION} (conversation_id, idempotency_key, role) WHERE idempotency_key IS NOT NULL
+            """,
+        ]:
+            conn.execute(text(statement))
+        create_upcoming_partitions(conn)
+    logger.info(f"Partitioned messages; rows before {boundary} are in {LEGACY_PARTITION}")
+    return True
+
+
+def iter_conversation_rows(conn: Connection, name: str) -> Iterator[Tuple[str, List[dict]]]:
+    """Rows of one partition grouped by conversation, each group oldest first."""
+    partition = table(name, *[column(c.name, c.type) for c in Message.__table__.columns])
+    statement = partition.select().order_by(partition.c.conversation_id, partition.c.created_at)
+    result = conn.execution_options(stream_results=True, yield_per=EXPORT_BATCH_ROWS).execute(statement)
+    conversation_id, rows = None, []
+    for row in result.mappings():
+        if row['conversation_id'] != conversation_id and rows:
+            yield conversation_id, rows
+            rows = []
+        conversation_id = row['conversation_id']
+        rows.append(dict(row))
+    if rows:
+        yield conversation_id, rows
+
+
+def archive_partition(engine: Engine, name: str, range_end: datetime,
+                      directory: Optional[str] = None, keep_table: bool = False) -> int:
+    """
+    Move one partition to a gzip JSONL file and detach it from ``messages``.
+
+    The file is written (under a temporary name, then renamed) before the
+    catalogue rows are inserted and the partition is detached and dropped in
+    one transaction, so an interrupted run leaves the partition in place and
+    can simply be repeated.
+
+    Args:
+        engine (Engine): Engine of the database holding ``messages``
+        name (str): Partition to archive
+        range_end (datetime): Exclusive upper bound of the partition
+        directory (Optional[str]): Archive directory, ``MESSAGE_ARCHIVE_DIR`` by default
+        keep_table (bool): Only detach the partition instead of dropping it
+
+    Returns:
+        int: Number of archived rows
+    """
+    directory = archive_directory(directory)
+    os.makedirs(directory, exist_ok=True)
+    file_name = f"{name}.jsonl.gz"
+    path = os.path.join(directory, file_name)
+    segments = []
+    range_start = None
+    with engine.connect() as conn, open(f"{path}.tmp", "wb") as f:
+        for conversation_id, rows in iter_conversation_rows(conn, name):
+            member = gzip.compress(b"".join(orjson.dumps(row) + b"\n" for row in rows))
+            segments.append({
+                'conversation_id': conversation_id,
+                'offset': f.tell(),
+                'length': len(member),
+                'row_count': len(rows),
+                # Lets a lookup by id skip the files that cannot hold it
+                'message_ids': [row['id'] for row in rows],
+                'first_created_at': rows[0]['created_at'],
+                'last_created_at': rows[-1]['created_at'],
+            })
+            f.write(member)
+            first = rows[0]['created_at']
+            range_start = first if range_start is None else min(range_start, first)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(f"{path}.tmp", path)
+    row_count = sum(segment['row_count'] for segment in segments)
+
+    with engine.begin() as conn:
+        conn.execute(text("SET LOCAL lock_timeout = '5s'"))
+        archive_id = conn.execute(insert(MessageArchive).values(
+            partition_name=name,
+            range_start=range_start,
+            range_end=range_end,
+            path=file_name,
+            row_count=row_count
+        ).returning(MessageArchive.id)).scalar()
+        if segments:
+            conn.execute(
+                insert(MessageArchiveSegment),
+                [{**segment, 'archive_id': archive_id} for segment in segments]
+            )
+        conn.execute(text(f"ALTER TABLE messages DETACH PARTITION {name}"))
+        if not keep_table:
+            conn.execute(text(f"DROP TABLE {name}"))
+    logger.info(f"Archived {row_count} messages of {name} to {path}")
+    return row_count
+
+
+def archive_cold_partitions(engine: Engine, hot_months: int = MESSAGE_HOT_MONTHS,
+                            directory: Optional[str] = None, keep_table: bool = False) -> List[str]:
+    """Archive every partition that ends before the last ``hot_months`` months."""
+    directory = archive_directory(directory)
+    cutoff = month_start(datetime.now(timezone.utc), -hot_months)
+    with engine.connect() as conn:
+        if not is_partitioned(conn):
+            raise RuntimeError("messages is not partitioned; run `python -m utils.partitioning partition` first")
+        cold = [(name, end) for name, end in list_partitions(conn) if end is not None and end <= cutoff]
+    for name, end in cold:
+        archive_partition(engine, name, end, directory=directory, keep_table=keep_table)
+    return [name for name, _ in cold]
+
+
+def main():
+    load_dotenv(find_dotenv())
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Partition and archive the messages table")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("partition", help="Convert messages to a partitioned table")
+    maintain = commands.add_parser("maintain", help="Create the partitions of the coming months")
+    maintain.add_argument("--ahead", type=int, default=PARTITIONS_AHEAD)
+    archive = commands.add_parser("archive", help="Move cold partitions to compressed files")
+    archive.add_argument("--hot-months", type=int, default=MESSAGE_HOT_MONTHS)
+    archive.add_argument("--dir", default=None, help="Absolute archive directory, MESSAGE_ARCHIVE_DIR by default")
+    archive.add_argument("--keep-table", action="store_true", help="Detach but do not drop the partitions")
+    args = parser.parse_args()
+
+    # Partition bounds are read and written in UTC
+    engine = create_engine(os.environ['DATABASE_URL'], connect_args={"options": "-c timezone=UTC"})
+    try:
+        if args.command == "partition":
+            if not partition_messages(engine):
+                logger.info("messages is already partitioned")
+        elif args.command == "maintain":
+            with engine.begin() as conn:
+                logger.info(f"Partitions ready: {', '.join(create_upcoming_partitions(conn, args.ahead))}")
+        else:
+            archived = archive_cold_partitions(engine, args.hot_months, args.dir, args.keep_table)
+            logger.info(f"Archived partitions: {', '.join(archived) or 'none'}")
+    finally:
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+"""
+Opt-in sampling profiler for single requests.
+
+A request is profiled only when it carries ``PROFILE_SECRET`` in the
+``X-Profile`` header (never a query parameter, which would end up in access
+logs). While it runs, a
+sampler thread records the Python stack of every thread at a fixed interval
+and the database events of the request are timed. The result is written as a
+speedscope file (https://www.speedscope.app) to ``PROFILE_DIR`` and its id is
+returned in the ``X-Profile-Id`` response header.
+
+Without ``PROFILE_SECRET`` the middleware is not installed at all, and the
+query listeners are only registered once the first request is profiled.
+
+The sampler sees the whole process: stacks of the threads that ran the
+request (the event loop and the threadpool workers that executed its queries)
+are kept, so concurrent requests sharing those threads show up too. Profile
+on a quiet worker when the picture has to be exact.
+"""
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple, Union
+import hmac
+import logging
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import orjson
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+PROFILE_SECRET = os.getenv("PROFILE_SECRET", "")
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "profiles"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "120"))
+PROFILE_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+_profile: ContextVar[Optional["RequestProfile"]] = ContextVar("request_profile", default=None)
+_listeners_lock = threading.Lock()
+_listeners_installed = False
+
+# Frame key: (function, file, first line)
+FrameKey = Tuple[str, str, int]
+
+
+def is_authorized(secret: Optional[Union[str, bytes]]) -> bool:
+    """
+    Whether ``secret`` matches ``PROFILE_SECRET``; always False when profiling is disabled.
+
+    Takes the raw header value, or the string the ASGI server decoded from it
+    as latin-1. Bytes are compared because ``hmac.compare_digest`` rejects
+    non-ASCII strings with a TypeError.
+    """
+    if not PROFILE_SECRET or not secret:
+        return False
+    if isinstance(secret, str):
+        try:
+            secret = secret.encode("latin-1")
+        except UnicodeEncodeError:
+            # Cannot have come from a header
+            return False
+    return hmac.compare_digest(secret, PROFILE_SECRET.encode())
+
+
+def profile_path(profile_id: str) -> Optional[str]:
+    """Path of a stored profile, or None if the id is malformed or unknown."""
+    if not PROFILE_ID_PATTERN.match(profile_id):
+        return None
+    path = os.path.join(PROFILE_DIR, f"{profile_id}.speedscope.json")
+    return path if os.path.exists(path) else None
+
+
+class RequestProfile:
+    """Stack samples and database timings collected for one request."""
+
+    def __init__(self, name: str, interval: float, max_seconds: float):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.threads = {threading.get_ident()}
+        self.frames: Dict[FrameKey, int] = {}
+        # thread id -> (stacks as frame indexes root first, weights in ms)
+        self.samples: Dict[int, Tuple[List[List[int]], List[float]]] = {}
+        # (statement, start ms, duration ms)
+        self.queries: List[Tuple[str, float, float]] = []
+        self._stop = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+        self._start = 0.0
+        self._end = 0.0
+
+    def _ms(self, at: float) -> float:
+        return (at - self._start) * 1000
+
+    def start(self) -> None:
+        self._start = time.perf_counter()
+        self._sampler = threading.Thread(target=self._sample, name=f"profiler-{self.id[:8]}", daemon=True)
+        self._sampler.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        self._end = time.perf_counter()
+
+    def _frame_index(self, code) -> int:
+        key = (code.co_name, code.co_filename, code.co_firstlineno)
+        index = self.frames.get(key)
+        if index is None:
+            index = self.frames[key] = len(self.frames)
+        return index
+
+    def _sample(self) -> None:
+        own = threading.get_ident()
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            weight = (now - last) * 1000
+            last = now
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self._frame_index(frame.f_code))
+                    frame = frame.f_back
+                stack.reverse()
+                stacks, weights = self.samples.setdefault(thread_id, ([], []))
+                stacks.append(stack)
+                weights.append(weight)
+            if now - self._start > self.max_seconds:
+                logger.warning(f"Profile {self.id} stopped sampling after {self.max_seconds:.0f}s")
+                break
+
+    def record_query(self, statement: str, started: float, finished: float) -> None:
+        self.threads.add(threading.get_ident())
+        self.queries.append((statement, self._ms(started), (finished - started) * 1000))
+
+    def summary(self) -> dict:
+        total = sum(duration for _, _, duration in self.queries)
+        return {
+            "id": self.id,
+            "name": self.name,
+            "duration_ms": round(self._ms(self._end), 2),
+            "queries": len(self.queries),
+            "query_ms": round(total, 2),
+        }
+
+    def to_speedscope(self) -> dict:
+        """Render as a speedscope file: one sampled profile per request thread and a query timeline."""
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        end = self._ms(self._end)
+        profiles = []
+        for thread_id in sorted(self.threads):
+            stacks, weights = self.samples.get(thread_id, ([], []))
+            profiles.append({
+                "type": "sampled",
+                "name": f"{self.name} [{thread_names.get(thread_id, thread_id)}]",
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": end,
+                "samples": stacks,
+                "weights": weights,
+            })
+
+        frames = [
+            {"name": name, "file": file, "line": line}
+            for (name, file, line), _ in sorted(self.frames.items(), key=lambda item: item[1])
+        ]
+        events = []
+        for statement, started, duration in self.queries:
+            # Statements become frames of their own in the timeline
+            frames.append({"name": " ".join(statement.split())[:200]})
+            index = len(frames) - 1
+            events.append({"type": "O", "frame": index, "at": started})
+            events.append({"type": "C", "frame": index, "at": started + duration})
+        summary = self.summary()
+        profiles.append({
+            "type": "evented",
+            "name": f"database: {summary['queries']} queries, {summary['query_ms']:.1f} ms",
+            "unit": "milliseconds",
+            "startValue": 0,
+            "endValue": max(end, events[-1]["at"] if events else 0),
+            "events": events,
+        })
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": self.name,
+            "exporter": "drivechat-profiler",
+            "activeProfileIndex": 0,
+            "shared": {"frames": frames},
+            "profiles": profiles,
+        }
+
+    def save(self, directory: str) -> str:
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{self.id}.speedscope.json")
+        with open(path, "wb") as f:
+            f.write(orjson.dumps(self.to_speedscope()))
+        return path
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _profile.get() is not None:
+        conn.info.setdefault("profile_query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _profile.get()
+    starts = conn.info.get("profile_query_start")
+    if profile is not None and starts:
+        profile.record_query(statement, starts.pop(), time.perf_counter())
+
+
+def _install_listeners() -> None:
+    global _listeners_installed
+    with _listeners_lock:
+        if _listeners_installed:
+            return
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        _listeners_installed = True
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware profiling the requests that ask for it with the secret.
+
+    The profile covers the whole response, including streamed bodies.
+    """
+
+    def __init__(self, app, directory: str = PROFILE_DIR,
+                 interval_ms: float = PROFILE_INTERVAL_MS, max_seconds: float = PROFILE_MAX_SECONDS):
+        self.app = app
+        self.directory = directory
+        self.interval = interval_ms / 1000
+        self.max_seconds = max_seconds
+
+    def _requested(self, scope) -> bool:
+        return is_authorized(dict(scope["headers"]).get(b"x-profile"))
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._requested(scope):
+            return await self.app(scope, receive, send)
+
+        _install_listeners()
+        profile = RequestProfile(f"{scope['method']} {scope['path']}", self.interval, self.max_seconds)
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-profile-id", profile.id.encode())
+                ]
+            await send(message)
+
+        token = _profile.set(profile)
+        profile.start()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            profile.stop()
+            _profile.reset(token)
+            try:
+                profile.save(self.directory)
+                logger.info(f"Profiled request: {profile.summary()}")
+            except OSError as e:
+                logger.error(f"Failed to store profile {profile.id}: {str(e)}")
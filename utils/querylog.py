@@ -0,0 +1,255 @@
+"""
+Slow query log with sampled EXPLAIN capture.
+
+``install(engine)`` times every statement the engine runs. Statements are
+aggregated by their SQL text (parameters are bound separately, so one text is
+one query shape) and tagged with the service or route function that issued
+them. Statements slower than ``SLOW_QUERY_MS`` are logged, and a sample of
+the slow SELECTs is re-run as ``EXPLAIN (ANALYZE, BUFFERS)`` on a background
+thread, on a separate connection of the same engine, so the plan is kept
+with the statement without delaying the request.
+
+``query_log.top(n)`` reports the statements with the most total time.
+"""
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+SLOW_QUERY_EXPLAIN_RATE = float(os.getenv("SLOW_QUERY_EXPLAIN_RATE", "0.2"))
+# Seconds before the same statement is explained again
+SLOW_QUERY_EXPLAIN_INTERVAL = float(os.getenv("SLOW_QUERY_EXPLAIN_INTERVAL", "600"))
+EXPLAIN_TIMEOUT_MS = int(os.getenv("SLOW_QUERY_EXPLAIN_TIMEOUT_MS", "30000"))
+MAX_STATEMENTS = 1000
+MAX_ORIGINS = 5
+
+# Only plain reads are re-run by EXPLAIN ANALYZE
+EXPLAINABLE = re.compile(r"^\s*(SELECT|WITH)\b", re.IGNORECASE)
+NOT_EXPLAINABLE = re.compile(r"\bFOR\s+(UPDATE|SHARE|NO KEY UPDATE)\b|pg_notify|nextval|pg_advisory", re.IGNORECASE)
+APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ORIGIN_DIRS = tuple(os.path.join(APP_ROOT, name) + os.sep for name in ("services", "routes", "dependencies"))
+UTILS_DIR = os.path.join(APP_ROOT, "utils") + os.sep
+OWN_FILE = os.path.abspath(__file__)
+
+
+def _frame_name(frame) -> str:
+    instance = frame.f_locals.get("self")
+    if instance is not None:
+        return f"{type(instance).__name__}.{frame.f_code.co_name}"
+    module = os.path.splitext(os.path.relpath(frame.f_code.co_filename, APP_ROOT))[0].replace(os.sep, ".")
+    return f"{module}.{frame.f_code.co_name}"
+
+
+def statement_origin() -> str:
+    """
+    ``Class.method`` (or module function) that issued the current statement.
+
+    The innermost service, route or dependency frame wins; helpers in
+    ``utils`` are only named when nothing else is on the stack.
+    """
+    fallback = "unknown"
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(ORIGIN_DIRS):
+            return _frame_name(frame)
+        if fallback == "unknown" and filename.startswith(UTILS_DIR) and filename != OWN_FILE:
+            fallback = _frame_name(frame)
+        frame = frame.f_back
+    return fallback
+
+
+@dataclass
+class StatementStats:
+    statement: str
+    calls: int = 0
+    total_ms: float = 0.0
+    max_ms: float = 0.0
+    slow_calls: int = 0
+    origins: Dict[str, int] = field(default_factory=dict)
+    plan: Optional[str] = None
+    plan_ms: Optional[float] = None
+    explained_at: Optional[float] = None
+
+    def report(self) -> dict:
+        return {
+            "statement": self.statement,
+            "calls": self.calls,
+            "total_ms": round(self.total_ms, 2),
+            "mean_ms": round(self.total_ms / self.calls, 2) if self.calls else 0.0,
+            "max_ms": round(self.max_ms, 2),
+            "slow_calls": self.slow_calls,
+            "origins": self.origins,
+            "plan_ms": self.plan_ms,
+            "plan": self.plan,
+        }
+
+
+class QueryLog:
+    """Per-process statement timings, slow query logging and EXPLAIN sampling."""
+
+    def __init__(self, slow_ms: float = SLOW_QUERY_MS, explain_rate: float = SLOW_QUERY_EXPLAIN_RATE,
+                 explain_interval: float = SLOW_QUERY_EXPLAIN_INTERVAL):
+        self.slow_ms = slow_ms
+        self.explain_rate = explain_rate
+        self.explain_interval = explain_interval
+        self._lock = threading.Lock()
+        self._stats: Dict[str, StatementStats] = {}
+        self._engines: List[Engine] = []
+        self._explains: "queue.Queue[Tuple[Engine, str, Any]]" = queue.Queue(maxsize=16)
+        self._worker: Optional[threading.Thread] = None
+        self.statements_total = 0
+        self.slow_total = 0
+        self.untracked_total = 0
+        self.explained_total = 0
+
+    def install(self, engine: Engine) -> None:
+        """Time the statements of ``engine``."""
+        event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+        self._engines.append(engine)
+
+    def uninstall(self) -> None:
+        for engine in self._engines:
+            event.remove(engine, "before_cursor_execute", self._before_cursor_execute)
+            event.remove(engine, "after_cursor_execute", self._after_cursor_execute)
+        self._engines = []
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if conn.info.get("untimed"):
+            return
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("query_start")
+        if not starts:
+            return
+        elapsed = (time.perf_counter() - starts.pop()) * 1000
+        slow = elapsed >= self.slow_ms
+        explain = False
+        with self._lock:
+            self.statements_total += 1
+            stats = self._stats.get(statement)
+            if stats is None:
+                if len(self._stats) >= MAX_STATEMENTS:
+                    self.untracked_total += 1
+                    stats = None
+                else:
+                    stats = self._stats[statement] = StatementStats(statement)
+            if stats is not None:
+                stats.calls += 1
+                stats.total_ms += elapsed
+                stats.max_ms = max(stats.max_ms, elapsed)
+            if slow:
+                self.slow_total += 1
+                if stats is not None:
+                    stats.slow_calls += 1
+                    now = time.monotonic()
+                    explain = (
+                        not executemany
+                        and (stats.explained_at is None or now - stats.explained_at >= self.explain_interval)
+                        and random.random() < self.explain_rate
+                        and EXPLAINABLE.match(statement) is not None
+                        and NOT_EXPLAINABLE.search(statement) is None
+                    )
+                    if explain:
+                        stats.explained_at = now
+        if slow or (stats is not None and stats.calls == 1):
+            # Walking the stack is only paid for new and slow statements
+            origin = statement_origin()
+            with self._lock:
+                if stats is not None and (origin in stats.origins or len(stats.origins) < MAX_ORIGINS):
+                    stats.origins[origin] = stats.origins.get(origin, 0) + 1
+            if slow:
+                logger.warning(f"Slow query {elapsed:.0f}ms from {origin}: {' '.join(statement.split())[:500]}")
+        if explain:
+            self._queue_explain(conn.engine, statement, parameters)
+
+    def _queue_explain(self, engine: Engine, statement: str, parameters: Any) -> None:
+        if self._worker is None or not self._worker.is_alive():
+            with self._lock:
+                if self._worker is None or not self._worker.is_alive():
+                    self._worker = threading.Thread(target=self._explain_loop, name="query-explain", daemon=True)
+                    self._worker.start()
+        try:
+            self._explains.put_nowait((engine, statement, parameters))
+        except queue.Full:
+            pass
+
+    def _explain_loop(self) -> None:
+        while True:
+            engine, statement, parameters = self._explains.get()
+            try:
+                self.explain(engine, statement, parameters)
+            except Exception as e:
+                logger.warning(f"EXPLAIN failed: {str(e)}")
+
+    def explain(self, engine: Engine, statement: str, parameters: Any) -> Optional[str]:
+        """
+        Run ``EXPLAIN (ANALYZE, BUFFERS)`` for a statement and keep the plan with its stats.
+
+        Runs in its own read-only transaction that is rolled back, on a
+        connection that is not timed itself.
+
+        Args:
+            engine (Engine): Engine the statement ran on
+            statement (str): SQL as sent to the driver
+            parameters (Any): Driver-level parameters of the slow execution
+
+        Returns:
+            Optional[str]: The plan text
+        """
+        with engine.connect() as connection:
+            connection.info["untimed"] = True
+            try:
+                connection.exec_driver_sql("SET TRANSACTION READ ONLY")
+                connection.exec_driver_sql(f"SET LOCAL statement_timeout = {EXPLAIN_TIMEOUT_MS}")
+                rows = connection.exec_driver_sql(
+                    f"EXPLAIN (ANALYZE, BUFFERS) {statement}", parameters or ()
+                ).fetchall()
+            finally:
+                connection.rollback()
+                connection.info.pop("untimed", None)
+        plan = "\n".join(row[0] for row in rows)
+        match = re.search(r"Execution Time: ([\d.]+) ms", plan)
+        with self._lock:
+            self.explained_total += 1
+            stats = self._stats.get(statement)
+            if stats is not None:
+                stats.plan = plan
+                stats.plan_ms = float(match.group(1)) if match else None
+        logger.info(f"Plan for slow query {' '.join(statement.split())[:200]}:\n{plan}")
+        return plan
+
+    def top(self, limit: int = 20, order_by: str = "total_ms") -> List[dict]:
+        """Statements with the most total time (or ``max_ms``, ``calls``, ``slow_calls``)."""
+        with self._lock:
+            stats = sorted(self._stats.values(), key=lambda s: getattr(s, order_by), reverse=True)[:limit]
+            return [s.report() for s in stats]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+
+    def stats(self) -> dict:
+        return {
+            "statements_total": self.statements_total,
+            "slow_total": self.slow_total,
+            "untracked_total": self.untracked_total,
+            "explained_total": self.explained_total,
+            "tracked": len(self._stats),
+        }
+
+
+query_log = QueryLog()
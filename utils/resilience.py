@@ -0,0 +1,295 @@
+"""
+Request deadlines, circuit breakers and budget-aware retries for outbound calls.
+
+A deadline is stored in a context variable, so it follows the request into
+threadpool workers and asyncio tasks. Every outbound call derives its
+timeout from the remaining budget, and retries only happen when the budget
+still allows another attempt.
+"""
+import asyncio
+import logging
+import math
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Iterator, Optional, Tuple, Type
+
+logger = logging.getLogger(__name__)
+
+_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """The request ran out of time budget."""
+
+
+class CircuitOpenError(Exception):
+    """A dependency is failing and calls to it are short-circuited."""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name} is unavailable")
+        self.name = name
+        self.retry_after = retry_after
+
+
+@contextmanager
+def deadline_scope(seconds: Optional[float], override: bool = False) -> Iterator[None]:
+    """
+    Run the block with a deadline ``seconds`` from now.
+
+    Nested scopes can only shorten the current deadline unless ``override``
+    is set, which is meant for work that outlives the request (streams,
+    background jobs).
+    """
+    current = _deadline.get()
+    deadline = None if seconds is None else time.monotonic() + seconds
+    if not override and current is not None and (deadline is None or current < deadline):
+        deadline = current
+    token = _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left before the current deadline, or None without a deadline."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def timeout_for(cap: float) -> float:
+    """
+    Timeout for one outbound call: ``cap`` limited by the remaining budget.
+
+    Raises:
+        DeadlineExceeded: If the budget is already spent
+    """
+    left = remaining()
+    if left is None:
+        return cap
+    if left <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+    return min(cap, left)
+
+
+class CircuitBreaker:
+    """
+    Classic closed / open / half-open breaker.
+
+    After ``failure_threshold`` consecutive failures the circuit opens and
+    calls fail immediately for ``reset_timeout`` seconds; then a single trial
+    call is let through and its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_running = False
+        self._trials = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return "half_open"
+            return "open"
+
+    def before_call(self) -> Optional[int]:
+        """
+        Raise CircuitOpenError unless a call may go through now.
+
+        Returns:
+            Optional[int]: Token of the half-open trial this call is, to pass to
+                ``end_trial`` once it is over, or None for a normal call
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return None
+            elapsed = time.monotonic() - self._opened_at
+            if elapsed >= self.reset_timeout and not self._trial_running:
+                self._trial_running = True
+                self._trials += 1
+                return self._trials
+            raise CircuitOpenError(self.name, max(self.reset_timeout - elapsed, 1.0))
+
+    def end_trial(self, token: Optional[int]) -> None:
+        """
+        Let another trial through if trial ``token`` ended without an outcome.
+
+        A trial that was cancelled (or failed with something that says
+        nothing about the dependency) must not keep the circuit open forever.
+        """
+        if token is None:
+            return
+        with self._lock:
+            if self._trials == token:
+                self._trial_running = False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._trial_running or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.warning(f"Circuit {self.name} opened after {self._failures} failures")
+                self._opened_at = time.monotonic()
+            self._trial_running = False
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """Process-wide breaker for a dependency, configured by CIRCUIT_* env vars."""
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(
+                name,
+                failure_threshold=int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5")),
+                reset_timeout=float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30"))
+            )
+        return _breakers[name]
+
+
+def breaker_states() -> Dict[str, str]:
+    """Current state of every breaker created so far."""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.state for breaker in breakers}
+
+
+def _backoff(attempt: int, base_delay: float, max_delay: float) -> float:
+    # Full jitter
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+def _can_retry(delay: float, last_duration: float) -> bool:
+    left = remaining()
+    return left is None or left > delay + last_duration
+
+
+def call_with_retries(
+    fn: Callable[[], Any],
+    breaker: CircuitBreaker,
+    retry_on: Tuple[Type[BaseException], ...],
+    attempts: int = 3,
+    base_delay: float = 0.2,
+    max_delay: float = 2.0
+) -> Any:
+    """
+    Call ``fn`` through ``breaker``, retrying transient ``retry_on`` errors.
+
+    A retry only happens if the remaining budget covers the backoff plus
+    another attempt as long as the last one. Errors outside ``retry_on`` mean
+    the dependency answered, so they count as a success for the breaker.
+    """
+    for attempt in range(attempts):
+        timeout_for(float("inf"))
+        trial = breaker.before_call()
+        start = time.monotonic()
+        try:
+            result = fn()
+        except retry_on as e:
+            breaker.record_failure()
+            delay = _backoff(attempt, base_delay, max_delay)
+            if attempt == attempts - 1 or not _can_retry(delay, time.monotonic() - start):
+                raise
+            logger.info(f"Retrying {breaker.name} in {delay:.2f}s after: {str(e)}")
+            time.sleep(delay)
+        except Exception:
+            breaker.record_success()
+            raise
+        else:
+            breaker.record_success()
+            return result
+        finally:
+            breaker.end_trial(trial)
+
+
+async def acall_with_retries(
+    fn: Callable[[], Awaitable[Any]],
+    breaker: CircuitBreaker,
+    retry_on: Tuple[Type[BaseException], ...],
+    attempts: int = 3,
+    base_delay: float = 0.2,
+    max_delay: float = 2.0
+) -> Any:
+    """Async counterpart of ``call_with_retries``."""
+    for attempt in range(attempts):
+        timeout_for(float("inf"))
+        trial = breaker.before_call()
+        start = time.monotonic()
+        try:
+            result = await fn()
+        except retry_on as e:
+            breaker.record_failure()
+            delay = _backoff(attempt, base_delay, max_delay)
+            if attempt == attempts - 1 or not _can_retry(delay, time.monotonic() - start):
+                raise
+            logger.info(f"Retrying {breaker.name} in {delay:.2f}s after: {str(e)}")
+            await asyncio.sleep(delay)
+        except Exception:
+            breaker.record_success()
+            raise
+        else:
+            breaker.record_success()
+            return result
+        finally:
+            breaker.end_trial(trial)
+
+
+def openai_transient_errors() -> Tuple[Type[BaseException], ...]:
+    """OpenAI errors worth retrying, imported lazily with the client library."""
+    import openai
+
+    return (
+        openai.APIConnectionError,  # includes APITimeoutError
+        openai.RateLimitError,
+        openai.InternalServerError,
+    )
+
+
+class DeadlineMiddleware:
+    """
+    ASGI middleware giving every HTTP request a deadline.
+
+    Clients may ask for a shorter budget with ``X-Request-Timeout`` (seconds);
+    it is capped at ``max_seconds``. Values that are not a positive finite
+    number get the default budget.
+    """
+
+    def __init__(self, app, default_seconds: float, max_seconds: float):
+        self.app = app
+        self.default_seconds = default_seconds
+        self.max_seconds = max_seconds
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        seconds = self.default_seconds
+        header = dict(scope["headers"]).get(b"x-request-timeout")
+        if header:
+            try:
+                requested = float(header)
+            except ValueError:
+                requested = math.nan
+            if math.isfinite(requested) and requested > 0:
+                seconds = min(requested, self.max_seconds)
+        with deadline_scope(seconds):
+            await self.app(scope, receive, send)
@@ -0,0 +1,176 @@
+"""
+Read-replica routing for SQLAlchemy sessions.
+
+``RoutingSession`` sends plain SELECTs to the replica assigned to it (through
+``session.info['replica']``) and everything else to the primary. Once a
+session has written, its reads go to the primary too, unless they are wrapped
+in ``replica_reads`` because they cannot depend on what was just written.
+
+Replicas are only assigned when their measured replay lag is within the
+staleness limit, and not to callers who wrote within that limit, so people
+read their own new messages.
+"""
+from contextlib import contextmanager
+from itertools import count
+from typing import Dict, Iterator, List, Optional, Tuple
+import logging
+import threading
+import time
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import Select
+from sqlalchemy.sql.dml import UpdateBase
+
+logger = logging.getLogger(__name__)
+
+REPLICA_LAG_SQL = text("""
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
+
+
+class RoutingSession(Session):
+    """Session that reads from ``info['replica']`` when it safely can."""
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if isinstance(clause, UpdateBase):
+            self.info['wrote'] = True
+        elif (
+            self.info.get('replica') is not None
+            and isinstance(clause, Select)
+            and clause._for_update_arg is None
+            and not self._flushing
+            and (not self.info.get('wrote') or self.info.get('replica_after_write'))
+        ):
+            return self.info['replica']
+        return super().get_bind(mapper=mapper, clause=clause, **kw)
+
+
+@contextmanager
+def replica_reads(session: Session) -> Iterator[None]:
+    """
+    Keep reads in the block on the replica even if the session already wrote.
+
+    Only for data the session's own writes cannot affect, like a
+    conversation's chunks while storing a chat message.
+    """
+    session.info['replica_after_write'] = session.info.get('replica_after_write', 0) + 1
+    try:
+        yield
+    finally:
+        session.info['replica_after_write'] -= 1
+
+
+def replica_staleness(session: Session) -> float:
+    """
+    How far behind the primary the session's next plain read may be, in seconds.
+
+    0 when the read goes to the primary. Used to keep replica reads that may
+    predate a recent invalidation out of the cache.
+    """
+    if session.info.get('replica') is None:
+        return 0.0
+    if session.info.get('wrote') and not session.info.get('replica_after_write'):
+        return 0.0
+    return session.info.get('replica_staleness', 0.0)
+
+
+class WriteTracker:
+    """
+    Remember which callers committed a write in the last ``horizon`` seconds.
+
+    Sessions report commits through ``info['write_tracker']`` and
+    ``info['user_key']``. The record is per process: a caller whose next
+    request lands on another worker is protected by the staleness limit only.
+    """
+
+    def __init__(self, horizon: float):
+        self.horizon = horizon
+        self._lock = threading.Lock()
+        self._last_write: Dict[str, float] = {}
+
+    def note(self, key: str) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._last_write[key] = now
+            if len(self._last_write) > 10000:
+                # Entries past the horizon no longer affect routing
+                self._last_write = {k: t for k, t in self._last_write.items() if now - t < self.horizon}
+
+    def wrote_recently(self, key: str) -> bool:
+        with self._lock:
+            last = self._last_write.get(key)
+        return last is not None and time.monotonic() - last < self.horizon
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def _mark_written(session, flush_context):
+    session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def _note_write(session):
+    tracker = session.info.get('write_tracker')
+    key = session.info.get('user_key')
+    if tracker is not None and key and session.info.get('wrote'):
+        tracker.note(key)
+
+
+class ReplicaSet:
+    """
+    Round-robin over the replicas whose replay lag is within ``max_staleness``.
+
+    Lag is measured with a short query at most every ``check_interval``
+    seconds per replica; a replica that fails the check is skipped until the
+    next one succeeds.
+    """
+
+    def __init__(self, engines: List[Engine], max_staleness: float, check_interval: float = 5.0):
+        self.engines = engines
+        self.max_staleness = max_staleness
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        # engine index -> (checked at, lag in seconds or None if unreachable)
+        self._lags: Dict[int, Tuple[float, Optional[float]]] = {}
+        self._next = count()
+
+    def lag(self, index: int) -> Optional[float]:
+        """Replay lag of one replica in seconds, None if it could not be measured."""
+        now = time.monotonic()
+        with self._lock:
+            checked = self._lags.get(index)
+            if checked is not None and now - checked[0] < self.check_interval:
+                return checked[1]
+            # Claim the check so concurrent callers use the previous value meanwhile
+            self._lags[index] = (now, checked[1] if checked else None)
+        try:
+            with self.engines[index].connect() as connection:
+                lag = float(connection.execute(REPLICA_LAG_SQL).scalar() or 0)
+        except Exception as e:
+            logger.warning(f"Replica {index} lag check failed: {str(e)}")
+            lag = None
+        with self._lock:
+            self._lags[index] = (time.monotonic(), lag)
+        return lag
+
+    @property
+    def max_lag(self) -> float:
+        """Worst lag of a picked replica: the limit plus the time since its last check."""
+        return self.max_staleness + self.check_interval
+
+    def pick(self) -> Optional[Engine]:
+        """A replica fresh enough to read from, or None to use the primary."""
+        fresh = [
+            engine for index, engine in enumerate(self.engines)
+            if (lag := self.lag(index)) is not None and lag <= self.max_staleness
+        ]
+        if not fresh:
+            return None
+        return fresh[next(self._next) % len(fresh)]
+
+    def dispose(self) -> None:
+        for engine in self.engines:
+            engine.dispose()